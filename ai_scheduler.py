@@ -0,0 +1,121 @@
+# Kylander: The Reckoning - Scheduled AI
+# An AI player only decides every few frames (game_core.update_ai): it picks
+# an intent - approach, retreat, hold its ground or pause - and whether to arm
+# an attack, and the decision is cached in the player store. In between, one
+# NumPy pass over every AI player follows the cached intents: walking while
+# outside the preferred distance band, facing the opponent inside it,
+# swinging an armed attack once the opponent is in reach, and letting go of a
+# one-frame duck.
+
+import numpy as np
+
+from player_store import (X, HEALTH, FACING, ATTACK_TIMER, COOLDOWN_TIMER, KNOCKBACK_TIMER, IS_ATTACKING,
+                          IS_DUCKING, IS_JUMPING, HAS_HIT_THIS_ATTACK, ANIMATION, AI_INTENT, AI_ATTACK_ARMED,
+                          AI_NEXT_DECISION, AI_DUCKED_ON)
+from wire_protocol import ANIMATION_IDS
+
+# Intents (AI_INTENT row)
+PAUSE = 0      # No movement decision: keep going as before, don't move
+APPROACH = 1   # Walk toward the opponent until inside the preferred band
+RETREAT = 2    # Back away until outside the inner edge of the band
+HOLD = 3       # Stand and face the opponent
+
+BATCH_THRESHOLD = 8   # Fewer AIs than this are followed one by one (a NumPy pass has a fixed cost of tens of µs)
+
+
+def decision_due(store, slot, frame):
+    return store.data.item(AI_NEXT_DECISION, slot) <= frame
+
+
+def schedule_next_decision(store, slot, frame, interval, rng):
+    """Next decision `interval` frames on; an AI's first gap is random, so AIs that start
+    together don't all decide on the same frames"""
+    first = store.data.item(AI_NEXT_DECISION, slot) == 0
+    store.data[AI_NEXT_DECISION, slot] = frame + (rng.randint(1, interval) if first else interval)
+
+
+def chance_per_decision(chance_per_frame, interval):
+    """Probability that an event with `chance_per_frame` happens at least once in `interval` frames"""
+    return 1.0 - (1.0 - chance_per_frame) ** interval
+
+
+def follow_intents(store, ai_slots, target_slots, frames, move_speed, preferred_distance, distance_buffer,
+                   attack_range, attack_duration, attack_cooldown):
+    """One frame of every AI's cached intent (ai_slots[i] plays against target_slots[i] in a room on frames[i])"""
+    if len(ai_slots) < BATCH_THRESHOLD:
+        for ai_slot, target_slot, frame in zip(ai_slots, target_slots, frames):
+            _follow_intent(store.data, ai_slot, target_slot, frame, move_speed, preferred_distance, distance_buffer,
+                           attack_range, attack_duration, attack_cooldown)
+        return
+    ai_slots = np.asarray(ai_slots, dtype=np.intp); target_slots = np.asarray(target_slots, dtype=np.intp)
+    ai = store.data[:, ai_slots]
+    dx = store.data[X, target_slots] - ai[X]
+    distance = np.abs(dx)
+    toward = np.where(dx > 0, 1, -1)
+    jumping = ai[IS_JUMPING] != 0
+    active = (ai[HEALTH] > 0) & (ai[KNOCKBACK_TIMER] == 0)
+
+    # A duck lasts one frame
+    release = active & (ai[IS_DUCKING] != 0) & (ai[AI_DUCKED_ON] < np.asarray(frames))
+    ai[IS_DUCKING][release] = 0
+    ai[ANIMATION][release & (ai[IS_ATTACKING] == 0) & ~jumping] = ANIMATION_IDS['idle']
+    ducking = ai[IS_DUCKING] != 0
+
+    swing = (active & (ai[AI_ATTACK_ARMED] != 0) & (ai[IS_ATTACKING] == 0) & (ai[COOLDOWN_TIMER] == 0) &
+             ~ducking & (distance >= preferred_distance - distance_buffer) & (distance <= attack_range))
+    ai[IS_ATTACKING][swing] = 1
+    ai[ATTACK_TIMER][swing] = attack_duration
+    ai[ANIMATION][swing] = np.where(jumping[swing], ANIMATION_IDS['jump_attack'], ANIMATION_IDS['attack'])
+    ai[HAS_HIT_THIS_ATTACK][swing] = 0
+    ai[COOLDOWN_TIMER][swing] = attack_cooldown
+    ai[AI_ATTACK_ARMED][swing] = 0
+
+    free = active & (ai[IS_ATTACKING] == 0) & ~ducking
+    intent = ai[AI_INTENT]
+    approach = free & (intent == APPROACH) & (distance > preferred_distance + distance_buffer)
+    retreat = free & (intent == RETREAT) & (distance < preferred_distance - distance_buffer)
+    hold = free & (intent != PAUSE) & ~approach & ~retreat
+    ai[X] += move_speed * toward * (approach.astype(np.int32) - retreat)
+    ai[FACING] = np.where(approach | retreat | hold, toward, ai[FACING])
+    ai[ANIMATION][(approach | retreat) & ~jumping] = ANIMATION_IDS['walk']
+    ai[ANIMATION][hold & ~jumping] = ANIMATION_IDS['idle']
+    store.data[:, ai_slots] = ai
+
+
+def _follow_intent(data, slot, target_slot, frame, move_speed, preferred_distance, distance_buffer,
+                   attack_range, attack_duration, attack_cooldown):
+    """follow_intents for a single AI, on Python ints"""
+    item = data.item
+    if item(HEALTH, slot) <= 0 or item(KNOCKBACK_TIMER, slot) > 0:
+        return
+    dx = item(X, target_slot) - item(X, slot)
+    distance = abs(dx)
+    toward = 1 if dx > 0 else -1
+    jumping = item(IS_JUMPING, slot) != 0
+    attacking = item(IS_ATTACKING, slot) != 0
+    ducking = item(IS_DUCKING, slot) != 0
+
+    if ducking and item(AI_DUCKED_ON, slot) < frame:
+        data[IS_DUCKING, slot] = 0; ducking = False
+        if not attacking and not jumping: data[ANIMATION, slot] = ANIMATION_IDS['idle']
+
+    if (item(AI_ATTACK_ARMED, slot) and not attacking and item(COOLDOWN_TIMER, slot) == 0 and not ducking and
+            preferred_distance - distance_buffer <= distance <= attack_range):
+        data[IS_ATTACKING, slot] = 1; attacking = True
+        data[ATTACK_TIMER, slot] = attack_duration
+        data[ANIMATION, slot] = ANIMATION_IDS['jump_attack' if jumping else 'attack']
+        data[HAS_HIT_THIS_ATTACK, slot] = 0
+        data[COOLDOWN_TIMER, slot] = attack_cooldown
+        data[AI_ATTACK_ARMED, slot] = 0
+
+    intent = item(AI_INTENT, slot)
+    if attacking or ducking or intent == PAUSE:
+        return
+    if intent == APPROACH and distance > preferred_distance + distance_buffer:
+        data[X, slot] = item(X, slot) + move_speed * toward; animation = 'walk'
+    elif intent == RETREAT and distance < preferred_distance - distance_buffer:
+        data[X, slot] = item(X, slot) - move_speed * toward; animation = 'walk'
+    else:
+        animation = 'idle'
+    data[FACING, slot] = toward
+    if not jumping: data[ANIMATION, slot] = ANIMATION_IDS[animation]
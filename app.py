@@ -1,836 +1,621 @@
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
-import random
+from flask import Flask, redirect, render_template, request
+from flask_socketio import SocketIO, emit, leave_room, disconnect
+import hmac
 import time
 import os
+from urllib.parse import urlencode
+import asset_tiers
+import build_assets
+import game_log
+import matchmaking
+import metrics
+import static_files
+import tracing
+from game_core import (AI_SID_PLACEHOLDER, CHARACTER_NAMES, CHURCH_BG_COUNT, CONTROLS_SCREEN_DURATION_FRAMES,
+                       MAX_PLAYERS_PER_ROOM, PARIS_BG_COUNT, TICK_RATE, end_replay, forget_room,
+                       get_default_player_state, get_default_room_state, input_buffer, ms_to_frames, player_store,
+                       record_replay_edit, release_room_players, remove_player, replay_recorder, rollback_histories,
+                       room_rng, start_replay, tick_rooms)
+from room_manager import RoomManager
+from scheduler import FixedTimestepScheduler
+from io_process import RingEmitManager, SimInputs
+from matchmaking import MatchmakingQueue
+from packet_cache import PacketCache, encode_json, join_object, packet_json
+from sharding import RoomRouter, ShardMap, make_client_manager
+from snapshots import SnapshotChannel
+import spectators
+from spectators import SpectatorGroup, encode_update
+import wire_protocol
 
 # Kylander: The Reckoning - Server Code
 # Updated with jump defense mechanics, AI balance, and dual Darius sound support
+# Transport only: sockets, routes and the game loop. The match itself is
+# simulated by game_core.py.
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'kylander_is_the_best_keep_it_secret_CHANGE_THIS!')
 
+# Sharded deployment (see sharding.py): every worker's public URL, this worker's, and the queue between them
+SHARDS = [url for url in os.environ.get('KYLANDER_SHARDS', '').split(',') if url]
+SHARD = os.environ.get('KYLANDER_SHARD', '')
+MESSAGE_QUEUE = os.environ.get('KYLANDER_MESSAGE_QUEUE')
+# Split simulation / I/O (see io_process.py): the ring this process publishes to and the I/O processes' input queues
+SIM_RING = os.environ.get('KYLANDER_SIM_RING')
+SIM_INPUTS = [name for name in os.environ.get('KYLANDER_SIM_INPUTS', '').split(',') if name]
+
 # Configure SocketIO for production
 socketio = SocketIO(app, 
                    async_mode='eventlet',
                    cors_allowed_origins="*",  # Allow all origins for production
-                   logger=True, 
-                   engineio_logger=True)
-
-# --- Game Constants ---
-GAME_WIDTH = 800; GAME_HEIGHT = 600; GROUND_LEVEL = GAME_HEIGHT - 50
-PLAYER_SPEED = 10 
-PLAYER_JUMP_VELOCITY = -15; GRAVITY = 1
-PLAYER_ATTACK_RANGE = 85  # INCREASED: More generous attack range
-PLAYER_SPRITE_HALF_WIDTH = 35 
-ATTACK_DURATION = 24      # Animation duration for attacks
-ATTACK_COOLDOWN = 15      # UPDATED: Shorter cooldown for human players (was 20)
-CLASH_STUN_DURATION = 30  # Longer stun for more dramatic effect
-KNOCKBACK_DISTANCE = 50   # INCREASED: Very noticeable knockback
-MAX_WINS = 5; SPECIAL_LEVEL_WINS = 3 
-SLIDESHOW_DURATION_MS = 6000; VICTORY_SCREEN_DURATION_MS = 4000
-CONTROLS_SCREEN_DURATION_MS = 1000; CHURCH_INTRO_DURATION_MS = 4000
-QUICKENING_FLASHES = 6; QUICKENING_FLASH_DURATION_MS = 100
-MAX_PLAYERS_PER_ROOM = 2
-
-PARIS_BG_COUNT = 7; CHURCH_BG_COUNT = 3; VICTORY_BG_COUNT = 10; SLIDESHOW_COUNT = 12
-CHARACTER_NAMES = ["The Potzer", "The Kylander", "Darichris"]
-AI_SID_PLACEHOLDER = "AI_PLAYER_SID" 
-
-# IMPROVED: Better balanced AI constants
-AI_SPEED_MULTIPLIER = 0.6  # Movement speed multiplier
-AI_PREFERRED_DISTANCE = 75  # REDUCED: Closer optimal fighting distance (was 85)
-AI_DISTANCE_BUFFER = 25     # REDUCED: Tighter distance tolerance (was 30)
-AI_ATTACK_FREQUENCY = 0.18  # REDUCED: Even less frequent attacks (was 0.22)
-AI_JUMP_FREQUENCY = 0.12    # REDUCED: Less jumping (was 0.15)
-AI_DUCK_FREQUENCY = 0.2     # More frequent ducking
-AI_ATTACK_COOLDOWN_BONUS = 45  # Much longer AI cooldown
-AI_DECISION_FREQUENCY = 0.6   # NEW: AI only makes movement decisions 60% of the time
-
-game_sessions = {}; game_room_id = 'default_room' 
-
-# Performance optimization variables
-last_broadcast_time = 0
-BROADCAST_INTERVAL = 1.0 / 60  # 60 FPS max
-
-def get_default_player_state(player_id_num, character_name_choice=None):
-    player_id_str = f"player{player_id_num}"
-    valid_char_name = character_name_choice if character_name_choice in CHARACTER_NAMES else None
-    return {
-        'id': player_id_str, 'sid': None, 'name': player_id_str, 
-        'character_name': valid_char_name, 'original_character_name': valid_char_name, 'display_character_name': valid_char_name,
-        'x': 150 if player_id_num == 1 else GAME_WIDTH - 150, 'y': GROUND_LEVEL,
-        'health': 100, 'score': 0, 'facing': 1 if player_id_num == 1 else -1,
-        'current_animation': 'idle', 'animation_frame_server': 0, 
-        'is_attacking': False, 'attack_timer': 0, 'is_ducking': False, 'is_jumping': False,
-        'vertical_velocity': 0, 'cooldown_timer': 0, 'has_hit_this_attack': False,
-        'is_ready_next_round': False, '_ai_last_duck_time': 0, '_ai_last_jump_time': 0,
-        'miss_swing': False,  # Track missed swings for sound effects
-        'knockback_timer': 0  # Track knockback state
-    }
-
-def get_default_room_state():
-    return {
-        'id': game_room_id, 'players': {}, 'current_screen': 'TITLE', 'game_mode': None,
-        'player1_char_name_chosen': None, 'player2_char_name_chosen': None,
-        'p1_selection_complete': False, 'p2_selection_complete': False,
-        'p1_waiting_for_p2': False,  # NEW: Track if P1 is waiting for P2 to connect
-        'match_score_p1': 0, 'match_score_p2': 0,
-        'current_background_key': 'paris', 'current_background_index': 0,
-        'special_level_active': False, 'special_swap_target_player_id': None, 
-        'round_winner_player_id': None, 'game_winner_player_id': None,
-        'last_update_time': time.time(), 'state_timer_ms': 0, 
-        'ai_opponent_active': False, 'quickening_effect_active': False,
-        'dark_quickening_effect_active': False, 'final_sound_played': False, 
-        'available_victory_sfx_indices': list(range(5)), 
-        'used_victory_sfx_indices': [], 
-        'available_victory_bgs_player': list(range(VICTORY_BG_COUNT)), 
-        'used_special_bgs': [], 
-        'sfx_event_for_client': None,
-        'swordeffects_playing': False,  # Track sword effects sound
-        'clash_flash_timer': 0,  # NEW: Track clash flash effect
-        # ADDED: Track original character for special level reversion
-        'special_level_original_p1_char': None,
-        'special_level_original_p2_char': None,
-        'slideshow_music_started': False,  # Track slideshow music state
-        'church_victory_sound_triggered': False,  # Track when to play Darius sound
-        'church_victory_bg_index': 0  # NEW: Track which church victory background (0 or 1) for sound selection
-    }
-game_sessions[game_room_id] = get_default_room_state()
-
-def get_player_by_id(room_state, target_player_id):
-    if target_player_id == AI_SID_PLACEHOLDER and AI_SID_PLACEHOLDER in room_state['players']: return room_state['players'][AI_SID_PLACEHOLDER]
-    for p_state in room_state['players'].values():
-        if p_state['id'] == target_player_id: return p_state
-    return None
-
-def get_opponent_state(room_state, player_state_or_sid):
-    player_id_to_match = None; current_sid = None
-    if isinstance(player_state_or_sid, str): 
-        current_sid = player_state_or_sid
-        if current_sid in room_state['players']: player_id_to_match = room_state['players'][current_sid]['id']
-    elif isinstance(player_state_or_sid, dict): 
-        player_id_to_match = player_state_or_sid.get('id'); current_sid = player_state_or_sid.get('sid')
-    if player_id_to_match:
-        for p_sid_iter, p_data in room_state['players'].items():
-            if p_sid_iter != current_sid: return p_data
-    return None
-
-def cleanup_room_state(room_state):
-    """Clean up any accumulated state that might cause memory issues"""
-    for player_sid, player_state in room_state['players'].items():
-        if 'miss_swing' in player_state:
-            player_state['miss_swing'] = False
-        if '_temp_animation_data' in player_state:
-            del player_state['_temp_animation_data']
-        # Reset knockback
-        player_state['knockback_timer'] = 0
-        
-        # FIXED: Additional safeguards to prevent getting stuck in states
-        # If player is somehow ducking while jumping or attacking, reset ducking
-        if player_state.get('is_ducking') and (player_state.get('is_jumping') or player_state.get('is_attacking')):
-            print(f"CLEANUP: Resetting stuck ducking state for {player_state.get('id', 'unknown')}")
-            player_state['is_ducking'] = False
-            if not player_state.get('is_jumping') and not player_state.get('is_attacking'):
-                player_state['current_animation'] = 'idle'
-    
-    room_state['sfx_event_for_client'] = None
-    room_state['swordeffects_playing'] = False
-    room_state['clash_flash_timer'] = 0  # Reset clash flash effect
-    room_state['church_victory_sound_triggered'] = False  # Reset church victory sound flag
-    room_state['church_victory_bg_index'] = 0  # NEW: Reset church victory background index
-
-def reset_player_for_round(player_state, room_state): 
-    player_state['health'] = 100
-    player_state['x'] = 150 if player_state['id'] == 'player1' else GAME_WIDTH - 150
-    player_state['y'] = GROUND_LEVEL
-    player_state.update({'is_attacking': False, 'attack_timer': 0, 'cooldown_timer': 0, 'is_jumping': False, 
-                         'is_ducking': False, 'vertical_velocity': 0, 'current_animation': 'idle', 
-                         'has_hit_this_attack': False, 'is_ready_next_round': False,
-                         'facing': 1 if player_state['id'] == 'player1' else -1,
-                         'miss_swing': False, 'knockback_timer': 0})  
-    
-    # FIXED: Proper asset swapping for special level
-    if room_state['special_level_active'] and player_state['id'] == room_state['special_swap_target_player_id']:
-        player_state['character_name'] = "Darichris" 
-        player_state['display_character_name'] = "Darichris"
-    else: 
-        player_state['character_name'] = player_state['original_character_name'] 
-        player_state['display_character_name'] = player_state['original_character_name']
-
-def initialize_round(room_state):
-    print("🎯 initialize_round called!")
-    try:
-        cleanup_room_state(room_state)
-        
-        room_state.update({'round_winner_player_id': None, 'state_timer_ms': 0, 
-                           'quickening_effect_active': False, 'dark_quickening_effect_active': False,
-                           'sfx_event_for_client': None, 'swordeffects_playing': False})
-        
-        print(f"🎯 Resetting {len(room_state['players'])} players")
-        for p_state in room_state['players'].values(): 
-            reset_player_for_round(p_state, room_state)
-        
-        if room_state['special_level_active']:
-            print("🎯 Setting up special level background")
-            available_church_bgs = [i for i in range(CHURCH_BG_COUNT) if i not in room_state.get('used_special_bgs', [])]
-            if not available_church_bgs: 
-                room_state['used_special_bgs'] = []
-                available_church_bgs = list(range(CHURCH_BG_COUNT))
-            chosen_church_idx = random.choice(available_church_bgs)
-            room_state.update({'current_background_key': 'church', 'current_background_index': chosen_church_idx})
-            room_state.setdefault('used_special_bgs', []).append(chosen_church_idx)
+                   logger=False,  # Per-packet logging; game events go through game_log instead
+                   engineio_logger=False,
+                   json=packet_json,  # Splices pre-encoded room updates (packet_cache.py) into packets
+                   client_manager=(RingEmitManager(SIM_RING) if SIM_RING else
+                                   make_client_manager(MESSAGE_QUEUE) if MESSAGE_QUEUE else None))
+
+# Structured logs per category (see game_log.py); KYLANDER_LOG_LEVEL=INFO,tick=DEBUG etc.
+game_log.configure()
+tick_log = game_log.get_logger('tick')
+round_log = game_log.get_logger('round')
+net_log = game_log.get_logger('net')
+loop_log = game_log.get_logger('loop')
+
+# Prometheus metrics, scraped from /metrics (see metrics.py)
+tick_seconds = metrics.histogram('tick_seconds', 'Time to step one frame of every room', metrics.TICK_BUCKETS)
+tick_overruns = metrics.counter('tick_overruns_total', 'Frames that took longer than the frame budget')
+dropped_frames = metrics.counter('dropped_frames_total', 'Frames skipped because the loop fell too far behind')
+loop_lag_seconds = metrics.histogram('loop_lag_seconds', 'How late the game loop woke up for its next frame')
+loop_errors = metrics.counter('loop_errors_total', 'Exceptions caught by the game loop and the tasks beside it',
+                              labelnames=('where',))
+broadcast_messages = metrics.counter('broadcast_messages_total', 'Room updates emitted (one per group of recipients)',
+                                     labelnames=('protocol',))
+broadcast_recipients = metrics.counter('broadcast_recipients_total', 'Clients room updates were emitted to',
+                                       labelnames=('protocol',))
+broadcast_payload_bytes = metrics.histogram('broadcast_payload_bytes', 'Encoded size of each room update emitted',
+                                            metrics.BYTES_BUCKETS, labelnames=('protocol',))
+player_actions_received = metrics.counter('player_actions_total', 'player_actions messages received',
+                                          labelnames=('protocol',))
+handler_seconds = metrics.histogram('event_handler_seconds', 'Time spent in a socket event handler',
+                                    labelnames=('event',))
+connects = metrics.counter('connects_total', 'Clients connected', labelnames=('kind',))
+disconnects = metrics.counter('disconnects_total', 'Clients disconnected', labelnames=('kind',))
+connections_rejected = metrics.counter('connections_rejected_total', 'Connections turned away (room_full, wrong_shard)',
+                                       labelnames=('reason',))
+metrics.gauge('rooms', 'Active rooms by current screen', lambda: room_manager.stats()['rooms_by_screen'],
+              labelnames=('screen',))
+metrics.gauge('players', 'Players seated in rooms', lambda: len(room_manager.sid_to_room))
+metrics.gauge('spectators', 'Clients spectating a room', lambda: len(spectator_rooms))
+metrics.gauge('matchmaking_queued', 'Players waiting for a match', lambda: len(matchmaking_queue))
+broadcast_metrics = {protocol: (broadcast_messages.labels(protocol), broadcast_recipients.labels(protocol),
+                                broadcast_payload_bytes.labels(protocol)) for protocol in ('json', 'binary', 'spectator')}
+json_actions_received = player_actions_received.labels('json')
+binary_actions_received = player_actions_received.labels('binary')
+
+def instrumented(event):
+    """Decorator (under @socketio.on) timing a socket handler for /metrics and tracing it"""
+    timed = metrics.timed(handler_seconds.labels(event)); traced = tracing.traced(event)
+    return lambda handler: timed(traced(handler))
+
+def count_broadcast(protocol, message, recipients):
+    messages, recipient_count, sizes = broadcast_metrics[protocol]
+    messages.inc(); recipient_count.inc(recipients)
+    if isinstance(message, (str, bytes, bytearray)):   # Else the I/O processes encode it (split deployment)
+        sizes.observe(len(message))
+
+# Content-hashed atlases, backgrounds etc. from build_assets.py; None (source files served) until the tree is built
+asset_manifest = build_assets.install(app)
+# What the client loads for which screen (/assets/manifest, also inlined into the page)
+asset_tier_manifest = asset_tiers.install(app, asset_manifest)
+# /static/: precompressed variants, strong ETags, immutable caching of built files, byte ranges
+static_server = static_files.install(app)
+
+MAX_ROOMS = int(os.environ.get('MAX_ROOMS', 5000))  # Per-process room capacity
+ADMIN_TOKEN = os.environ.get('KYLANDER_ADMIN_TOKEN')  # Admin routes require ?token=<this>; unset, they're refused
+MAX_CATCHUP_FRAMES = 5      # Frames a late loop may run back-to-back before dropping the backlog
+# Spectators (?spectate=1&room=<id>): update rate, how far they trail the match, and how many a room takes
+SPECTATOR_RATE = int(os.environ.get('KYLANDER_SPECTATOR_RATE', spectators.SPECTATOR_RATE))
+SPECTATOR_DELAY_FRAMES = (ms_to_frames(int(os.environ['KYLANDER_SPECTATOR_DELAY_MS']))
+                          if os.environ.get('KYLANDER_SPECTATOR_DELAY_MS') else spectators.SPECTATOR_DELAY_FRAMES)
+MAX_SPECTATORS_PER_ROOM = int(os.environ.get('KYLANDER_MAX_SPECTATORS', spectators.MAX_SPECTATORS_PER_ROOM))
+SPECTATOR_SEND_BATCH = 50   # Spectators sent to between yields to the game loop
+# Matchmaking (?match=1, optionally &character=<name>&rating=<n>): seconds in the queue before playing the AI
+MATCH_AI_FALLBACK_S = float(os.environ.get('KYLANDER_MATCH_AI_AFTER_S', matchmaking.AI_FALLBACK_S))
+MATCH_POLL_S = 0.5          # How often waiting players' rating windows and AI fallbacks are checked
+MAX_MATCH_RATING = 5000
+# Tick tracing (see tracing.py): on from the start with KYLANDER_TRACE=1; a tick over the budget is captured
+TRACE_BUDGET_S = float(os.environ.get('KYLANDER_TRACE_BUDGET_MS', 1000 / TICK_RATE)) / 1000
+tracing.TRACER.set_enabled(os.environ.get('KYLANDER_TRACE', '') not in ('', '0'))
+
+# Client events relayed by the I/O processes when split; None when this process holds the sockets itself
+sim_inputs = SimInputs(socketio, app, SIM_INPUTS) if SIM_RING else None
+
+# Which worker owns which room when sharded; None when this process hosts every room
+shard_map = ShardMap(SHARDS, SHARD) if SHARDS else None
+room_router = RoomRouter(shard_map) if shard_map else None
+MATCHMAKING_SHARD_KEY = 'matchmaking'   # Ring key of the worker that runs matchmaking
+
+# All live rooms, created on demand and destroyed when the last human leaves
+room_manager = RoomManager(get_default_room_state, MAX_PLAYERS_PER_ROOM, AI_SID_PLACEHOLDER, max_rooms=MAX_ROOMS,
+                           owns_room_id=shard_map.owns if shard_map else None)
+
+# Per-room snapshot streams: clients get deltas against their last acknowledged snapshot.
+# Binary-protocol clients get the per-frame fields as packed structs and a snapshot
+# stream of the remaining (cold) fields.
+snapshot_channels = {}; binary_snapshot_channels = {}
+client_wire_versions = {}   # sid -> binary protocol version (absent = JSON protocol)
+last_hot_state_sent = {}    # sid -> packed hot state last sent to that binary client
+# Encoded room updates, shared by every recipient and every emit within a room frame
+packet_cache = PacketCache()
+
+def get_snapshot_channel(room_id, binary=False):
+    channels = binary_snapshot_channels if binary else snapshot_channels
+    channel = channels.get(room_id)
+    if channel is None:
+        if binary:
+            channel = SnapshotChannel(exclude_room_keys=wire_protocol.HOT_ROOM_KEYS,
+                                      exclude_player_keys=wire_protocol.HOT_PLAYER_KEYS)
         else:
-            print("🎯 Setting up normal Paris background")
-            old_bg_index = room_state.get('current_background_index', -1)
-            new_bg_index = (old_bg_index + 1) % PARIS_BG_COUNT
-            room_state.update({'current_background_key': 'paris', 'current_background_index': new_bg_index})
-            print(f"🎯 Background changed from {old_bg_index} to {new_bg_index}")
-        
-        room_state['current_screen'] = 'PLAYING'
-        print(f"🎯 ✅ initialize_round COMPLETE! Screen set to: {room_state['current_screen']}")
-        
-    except Exception as e:
-        print(f"❌ EXCEPTION in initialize_round: {e}")
-        import traceback
-        traceback.print_exc()
-
-def handle_round_victory(room_state, victor_player_id, loser_player_id):
-    if room_state['current_screen'] not in ['PLAYING', 'SPECIAL']: 
+            channel = SnapshotChannel()
+        channels[room_id] = channel
+    return channel
+
+def register_snapshot_client(room_id, sid):
+    """(Re)start a client's snapshot stream; its next update is a full keyframe"""
+    get_snapshot_channel(room_id, sid in client_wire_versions).add_client(sid)
+    last_hot_state_sent.pop(sid, None)
+
+def unregister_snapshot_client(room_id, sid):
+    for channels in (snapshot_channels, binary_snapshot_channels):
+        if room_id in channels: channels[room_id].remove_client(sid)
+    last_hot_state_sent.pop(sid, None)
+
+def drop_snapshot_channels(room_id):
+    snapshot_channels.pop(room_id, None); binary_snapshot_channels.pop(room_id, None)
+    packet_cache.drop(room_id)
+
+def snapshot_channel_for_sid(sid):
+    room = room_manager.room_for_sid(sid)
+    if not room: return None
+    channels = binary_snapshot_channels if sid in client_wire_versions else snapshot_channels
+    return channels.get(room['id'])
+
+def broadcast_room_state(room_state):
+    """Send each client in the room only what changed since the snapshot it last acknowledged"""
+    room_id = room_state['id']
+    channel = snapshot_channels.get(room_id)
+    if channel and channel.clients:
+        frame = room_state['frame']
+        for payload, sids in channel.publish(room_state):
+            if sim_inputs is None:
+                key = ('json', payload['seq'], payload['base'])
+                payload = packet_cache.get(room_id, frame, key, lambda: encode_json(payload), recipients=len(sids))
+            # else the I/O processes encode it, once per message
+            socketio.emit('room_snapshot', payload, to=sids)
+            count_broadcast('json', payload, len(sids))
+    binary_channel = binary_snapshot_channels.get(room_id)
+    if binary_channel and binary_channel.clients:
+        frame = room_state['frame']
+        hot_bytes = wire_protocol.encode_hot_state(room_state)
+        hot_only_sids = []
+        for payload, sids in binary_channel.publish(room_state):
+            message = packet_cache.get(room_id, frame, ('bin', hot_bytes, payload['seq'], payload['base']),
+                                       lambda: wire_protocol.encode_room_message(frame, hot_bytes, payload),
+                                       recipients=len(sids))
+            for sid in sids: last_hot_state_sent[sid] = hot_bytes
+            socketio.emit('room_snapshot_bin', message, to=sids)
+            count_broadcast('binary', message, len(sids))
+        for sid in binary_channel.clients:
+            if last_hot_state_sent.get(sid) != hot_bytes:   # Else nothing changed for this client
+                last_hot_state_sent[sid] = hot_bytes; hot_only_sids.append(sid)
+        if hot_only_sids:
+            message = wire_protocol.encode_room_message(frame, hot_bytes)
+            socketio.emit('room_snapshot_bin', message, to=hot_only_sids)
+            count_broadcast('binary', message, len(hot_only_sids))
+
+def assign_player_message(room_state, player_id):
+    """assign_player_id payload; the room inside it is encoded once per room version and frame"""
+    room_id = room_state['id']; frame = room_state['frame']
+    seq, snapshot = get_snapshot_channel(room_id).record(room_state)
+    initial_state = packet_cache.get(room_id, frame, ('initial', seq), lambda: encode_json(dict(snapshot, frame=frame)))
+    return join_object(playerId=player_id, roomId=room_id, initialRoomState=initial_state)
+
+# Spectators: one shared update stream per watched room (see spectators.py). The tick only
+# captures; spectator_fanout_task sends the released updates between ticks, a batch at a time.
+spectator_groups = {}     # room id -> SpectatorGroup
+spectator_rooms = {}      # spectator sid -> room id
+spectator_outbox = {}     # room id -> newest released update not yet sent
+spectator_fanout_started = False
+
+def join_as_spectator(sid, room_id):
+    room = room_manager.get_room(room_id) if room_id else None
+    group = spectator_groups.get(room_id) if room else None
+    if room is None or (group is not None and len(group.sids) >= MAX_SPECTATORS_PER_ROOM):
+        reason = 'no_room' if room is None else 'spectators_full'
+        connections_rejected.labels(reason).inc()
+        net_log.warning('rejected', sid=sid, reason=reason, requested_room=room_id, spectator=True)
+        emit('room_full', room=sid); disconnect(sid); return
+    if group is None:
+        group = spectator_groups[room_id] = SpectatorGroup(max(1, TICK_RATE // SPECTATOR_RATE), SPECTATOR_DELAY_FRAMES)
+    group.sids.add(sid); spectator_rooms[sid] = room_id
+    net_log.info('spectator_joined', sid=sid, room=room_id, spectators=len(group.sids))
+    emit('spectating', {'roomId': room_id}, room=sid)
+    update = group.join_update()
+    if update is not None: emit('room_snapshot_bin', encode_update(update), room=sid)
+    start_spectator_fanout()
+
+def remove_spectator(sid):
+    room_id = spectator_rooms.pop(sid, None)
+    group = spectator_groups.get(room_id)
+    if group is None: return
+    group.sids.discard(sid)
+    net_log.info('spectator_left', sid=sid, room=room_id, spectators=len(group.sids))
+    if not group.sids:
+        del spectator_groups[room_id]; spectator_outbox.pop(room_id, None)
+
+def close_spectator_group(room_id):
+    """The room is gone: tell its spectators and forget them"""
+    group = spectator_groups.pop(room_id, None); spectator_outbox.pop(room_id, None)
+    if group is None: return
+    for sid in group.sids:
+        spectator_rooms.pop(sid, None)
+        socketio.emit('spectate_ended', {'roomId': room_id}, to=sid)
+
+def publish_spectator_updates(rooms):
+    """Capture each watched room for its spectators and queue whatever update is due"""
+    for room_state in rooms:
+        group = spectator_groups.get(room_state['id'])
+        if group is None: continue
+        group.observe(room_state)
+        update = group.release(room_state['frame'])
+        if update is None: continue
+        queued = spectator_outbox.get(room_state['id'])
+        if queued is not None and update[2] is None and queued[2] is not None:
+            update = (update[0], update[1], queued[2])  # The unsent update changed the cold fields
+        spectator_outbox[room_state['id']] = update
+
+def send_spectator_updates():
+    """Send the queued spectator updates: each encoded once, then emitted a batch of spectators at a time"""
+    while spectator_outbox:
+        room_id = next(iter(spectator_outbox))
+        update = spectator_outbox.pop(room_id)
+        group = spectator_groups.get(room_id)
+        if group is None: continue
+        message = encode_update(update)
+        sids = list(group.sids)
+        count_broadcast('spectator', message, len(sids))
+        for start in range(0, len(sids), SPECTATOR_SEND_BATCH):
+            socketio.emit('room_snapshot_bin', message, to=sids[start:start + SPECTATOR_SEND_BATCH])
+            socketio.sleep(0)  # Let the game loop in between batches
+
+def spectator_fanout_task():
+    while True:
+        try:
+            send_spectator_updates()
+        except Exception as e:
+            loop_errors.labels('spectator_fanout').inc()
+            net_log.exception('spectator_fanout_failed', error=str(e))
+        socketio.sleep(1 / TICK_RATE)
+
+def start_spectator_fanout():
+    global spectator_fanout_started
+    if not spectator_fanout_started:
+        socketio.start_background_task(target=spectator_fanout_task)
+        spectator_fanout_started = True
+
+# Matchmaking: queued players hold no room until they're paired, then the pair gets a fresh room
+# (see matchmaking.py). Players who wait too long get the AI opponent instead.
+matchmaking_queue = MatchmakingQueue(ai_fallback_s=MATCH_AI_FALLBACK_S)
+matchmaking_started = False
+
+def queue_for_match(sid, args):
+    character = args.get('character') if args.get('character') in CHARACTER_NAMES else None
+    try:
+        rating = max(0, min(int(args.get('rating', matchmaking.DEFAULT_RATING)), MAX_MATCH_RATING))
+    except ValueError:
+        rating = matchmaking.DEFAULT_RATING
+    start_matchmaking()
+    if args.get('mode') == 'ONE':
+        start_matched_room([(sid, character)]); return
+    pair = matchmaking_queue.enqueue(sid, 'TWO', character, rating)
+    if pair is not None:
+        start_matched_room([(ticket.sid, ticket.character) for ticket in pair]); return
+    net_log.info('match_queued', sid=sid, character=character, rating=rating, queued=len(matchmaking_queue))
+    socketio.emit('matchmaking', {'status': 'queued', 'waiting': matchmaking_queue.position(sid)}, to=sid)
+
+def start_matched_room(seats):
+    """A fresh room for a matched pair, or for one player against the AI. seats: [(sid, preferred character)]"""
+    if len(room_manager) >= MAX_ROOMS:
+        for sid, _ in seats:
+            connections_rejected.labels('no_room').inc()
+            net_log.warning('rejected', sid=sid, reason='no_room', matchmaking=True)
+            socketio.emit('room_full', to=sid); socketio.server.disconnect(sid, namespace='/')
         return
-    
-    cleanup_room_state(room_state)
-    print(f"Round over! Winner: {victor_player_id}")
-    
-    if victor_player_id == 'player1': room_state['match_score_p1'] += 1
-    elif victor_player_id == 'player2': room_state['match_score_p2'] += 1
-
-    # Check for game winner IMMEDIATELY after score update
-    if room_state['match_score_p1'] >= MAX_WINS or room_state['match_score_p2'] >= MAX_WINS:
-        room_state['game_winner_player_id'] = victor_player_id
-        print(f"MATCH WINNER determined: {victor_player_id}")
-    
-    room_state.update({'round_winner_player_id': victor_player_id, 'quickening_effect_active': True, 
-                       'state_timer_ms': (QUICKENING_FLASHES * 2 * QUICKENING_FLASH_DURATION_MS) + 500,
-                       'current_screen': room_state['current_screen']}) 
-
-def handle_special_level_loss_by_swapped(room_state, original_victor_id): 
-    print(f"Player {original_victor_id} (original character) defeated Darichris (swapped character) in special level!")
-    room_state.update({'dark_quickening_effect_active': True, 'game_winner_player_id': original_victor_id,
-                       'state_timer_ms': (QUICKENING_FLASHES * 2 * QUICKENING_FLASH_DURATION_MS) + 500,
-                       'current_screen': 'SPECIAL_END'})
-
-def end_special_level(room_state):
-    """Properly end special level and revert characters"""
-    print("Ending special level, reverting characters")
-    room_state['special_level_active'] = False
-    room_state['special_swap_target_player_id'] = None
-    
-    # FIXED: Revert characters to their original forms
-    for player_sid, player_state in room_state['players'].items():
-        if player_state['id'] == 'player1':
-            orig_char = room_state.get('special_level_original_p1_char') or player_state['original_character_name']
-            player_state['character_name'] = orig_char
-            player_state['display_character_name'] = orig_char
-        elif player_state['id'] == 'player2':
-            orig_char = room_state.get('special_level_original_p2_char') or player_state['original_character_name']
-            player_state['character_name'] = orig_char
-            player_state['display_character_name'] = orig_char
-    
-    # Clear special level character tracking
-    room_state['special_level_original_p1_char'] = None
-    room_state['special_level_original_p2_char'] = None
-
-def update_player_physics_and_timers(player_state):
-    # Handle knockback - disable ALL movement during knockback
-    if player_state.get('knockback_timer', 0) > 0:
-        player_state['knockback_timer'] -= 1
-        # FIXED: Prevent all input processing during knockback
-        player_state['is_attacking'] = False
-        player_state['is_ducking'] = False
-        # Allow gravity for vertical knockback effect
-        if player_state['is_jumping']:
-            player_state['y'] += player_state['vertical_velocity']
-            player_state['vertical_velocity'] += GRAVITY
-            if player_state['y'] >= GROUND_LEVEL:
-                player_state.update({'y': GROUND_LEVEL, 'is_jumping': False, 'vertical_velocity': 0})
-        return  # Don't process any other movement during knockback
-    
-    # FIXED: Reset ducking when jumping or attacking (prevents getting stuck)
-    if player_state['is_jumping'] or player_state['is_attacking']:
-        player_state['is_ducking'] = False
-    
-    if player_state['is_jumping']:
-        player_state['y'] += player_state['vertical_velocity']; player_state['vertical_velocity'] += GRAVITY
-        if player_state['y'] >= GROUND_LEVEL:
-            player_state.update({'y': GROUND_LEVEL, 'is_jumping': False, 'vertical_velocity': 0})
-            if not player_state['is_attacking']: player_state['current_animation'] = 'idle'
-    if player_state['cooldown_timer'] > 0: player_state['cooldown_timer'] -= 1
-    if player_state['is_attacking']:
-        player_state['attack_timer'] -= 1
-        if player_state['attack_timer'] <= 0:
-            # FIXED: Check for missed attacks to trigger sound
-            if not player_state['has_hit_this_attack']:
-                player_state['miss_swing'] = True
-            player_state.update({'is_attacking': False, 'has_hit_this_attack': False, 'cooldown_timer': ATTACK_COOLDOWN})
-            player_state['current_animation'] = 'idle' if not player_state['is_jumping'] else 'jump'
-
-def apply_screen_wrap(player_state):
-    if player_state['x'] > GAME_WIDTH + PLAYER_SPRITE_HALF_WIDTH: player_state['x'] = -PLAYER_SPRITE_HALF_WIDTH +1 
-    elif player_state['x'] < -PLAYER_SPRITE_HALF_WIDTH: player_state['x'] = GAME_WIDTH + PLAYER_SPRITE_HALF_WIDTH -1
-
-def update_ai(ai_state, target_state, room_state):
-    """SIMPLIFIED AI behavior - less jerky, more predictable"""
-    if not ai_state or not target_state or ai_state['health'] <= 0: return
-    update_player_physics_and_timers(ai_state)
-    
-    # Skip AI updates during knockback
-    if ai_state['knockback_timer'] > 0:
+    mode = 'TWO' if len(seats) == 2 else 'ONE'
+    room = room_manager.create_room()
+    # Where MODE_SELECT would have left the room
+    room.update({'game_mode': mode, 'current_screen': 'CHARACTER_SELECT_P1', 'ai_opponent_active': mode == 'ONE'})
+    try:
+        for (sid, _), player_id in zip(seats, ('player1', 'player2')):
+            seat_player(room, sid, player_id)
+    except Exception as e:
+        # Nobody has been told of the room yet: drop it, and send the players back to queue again
+        for sid, _ in seats:
+            socketio.server.leave_room(sid, room['id'], namespace='/')
+        room_manager.destroy_room(room['id'])
+        loop_errors.labels('matchmaking').inc()
+        net_log.exception('match_failed', room=room['id'], sids=[sid for sid, _ in seats], error=str(e))
+        for sid, _ in seats:
+            socketio.emit('matchmaking', {'status': 'failed'}, to=sid); socketio.server.disconnect(sid, namespace='/')
         return
-    
-    # Calculate distance and direction
-    dx = target_state['x'] - ai_state['x']
-    distance = abs(dx)
-    current_time_s = time.time()
-    
-    # IMPROVED: More frequent ducking when threatened
-    if (target_state['is_attacking'] and distance < PLAYER_ATTACK_RANGE + 40 and 
-        not ai_state['is_jumping'] and random.random() < AI_DUCK_FREQUENCY):
-        if current_time_s - ai_state.get('_ai_last_duck_time', 0) > 2.0:
-            ai_state.update({'is_ducking': True, 'current_animation': 'duck'})
-            ai_state['_ai_last_duck_time'] = current_time_s
-    elif ai_state['is_ducking']:
-        ai_state['is_ducking'] = False
-        if not ai_state['is_attacking'] and not ai_state['is_jumping']:
-            ai_state['current_animation'] = 'idle'
-    
-    # IMPROVED: Less aggressive attack frequency
-    attack_frequency = AI_ATTACK_FREQUENCY  # 0.18 - more conservative
-    if room_state.get('special_level_active') and ai_state.get('display_character_name') == 'Darichris':
-        attack_frequency = 0.45  # Still higher for special level
-    
-    # IMPROVED: Larger attack zone to prevent AI standing outside range
-    EFFECTIVE_ATTACK_RANGE = PLAYER_ATTACK_RANGE + 35  # INCREASED: Much larger attack zone
-    
-    # Only attack when in proper range and not too frequently
-    if (not ai_state['is_attacking'] and ai_state['cooldown_timer'] == 0 and 
-        not ai_state['is_ducking'] and 
-        distance >= AI_PREFERRED_DISTANCE - AI_DISTANCE_BUFFER and
-        distance <= EFFECTIVE_ATTACK_RANGE):  # IMPROVED: Use larger attack zone
-        if random.random() < attack_frequency:
-            ai_state.update({
-                'is_attacking': True, 
-                'attack_timer': ATTACK_DURATION,
-                'current_animation': 'jump_attack' if ai_state['is_jumping'] else 'attack',
-                'has_hit_this_attack': False,
-                'cooldown_timer': ATTACK_COOLDOWN + AI_ATTACK_COOLDOWN_BONUS
-            })
-    
-    # SIMPLIFIED: Less frequent movement decisions to reduce jerkiness
-    if not ai_state['is_attacking'] and not ai_state['is_ducking']:
-        # NEW: Only make movement decisions some of the time
-        if random.random() < AI_DECISION_FREQUENCY:  # 60% of the time
-            if distance > AI_PREFERRED_DISTANCE + AI_DISTANCE_BUFFER:
-                # Move closer
-                move_speed = int(PLAYER_SPEED * AI_SPEED_MULTIPLIER)
-                if dx > 0:
-                    ai_state['x'] += move_speed
-                    ai_state['facing'] = 1
-                else:
-                    ai_state['x'] -= move_speed
-                    ai_state['facing'] = -1
-                if not ai_state['is_jumping']:
-                    ai_state['current_animation'] = 'walk'
-            elif distance < AI_PREFERRED_DISTANCE - AI_DISTANCE_BUFFER:
-                # Move away to maintain distance
-                move_speed = int(PLAYER_SPEED * AI_SPEED_MULTIPLIER)
-                if dx > 0:
-                    ai_state['x'] -= move_speed
-                    ai_state['facing'] = 1
-                else:
-                    ai_state['x'] += move_speed
-                    ai_state['facing'] = -1
-                if not ai_state['is_jumping']:
-                    ai_state['current_animation'] = 'walk'
-            else:
-                # In optimal range - just face opponent
-                if not ai_state['is_jumping']:
-                    ai_state['current_animation'] = 'idle'
-                ai_state['facing'] = 1 if dx > 0 else -1
-        # ELSE: AI doesn't make a movement decision this frame - keeps current animation
-    
-    # IMPROVED: Less frequent jumping
-    if (not ai_state['is_jumping'] and not ai_state['is_ducking'] and 
-        random.random() < AI_JUMP_FREQUENCY):
-        if current_time_s - ai_state.get('_ai_last_jump_time', 0) > 3.5:  # Longer cooldown
-            ai_state.update({
-                'is_jumping': True,
-                'vertical_velocity': PLAYER_JUMP_VELOCITY,
-                'current_animation': 'jump'
-            })
-            ai_state['_ai_last_jump_time'] = current_time_s
-    
-    apply_screen_wrap(ai_state)
+    for (sid, _), player_id in zip(seats, ('player1', 'player2')):
+        socketio.emit('matchmaking', {'status': 'matched', 'opponent': 'player' if mode == 'TWO' else 'ai'}, to=sid)
+        socketio.emit('assign_player_id', assign_player_message(room, player_id), to=sid)
+        register_snapshot_client(room['id'], sid)
+    room_manager.refresh_open_state(room)
+    net_log.info('matched', room=room['id'], mode=mode, sids=[sid for sid, _ in seats], rooms=len(room_manager))
+    # Preferred characters count as picked, in the order the select screens take them
+    for (sid, character), select_screen in zip(seats, ('CHARACTER_SELECT_P1', 'CHARACTER_SELECT_P2')):
+        if character and room['current_screen'] == select_screen:
+            choose_character(room, sid, character)
+    broadcast_room_state(room)
+
+def match_waiting_players():
+    """One matchmaking pass: rooms for the pairs whose windows now meet and for the players due the AI"""
+    pairs, fallbacks = matchmaking_queue.poll()
+    for pair in pairs:
+        start_matched_room([(ticket.sid, ticket.character) for ticket in pair])
+    for ticket in fallbacks:
+        start_matched_room([(ticket.sid, ticket.character)])
+
+def matchmaking_task():
+    while True:
+        try:
+            match_waiting_players()
+        except Exception as e:
+            loop_errors.labels('matchmaking').inc()
+            net_log.exception('matchmaking_failed', error=str(e))
+        socketio.sleep(MATCH_POLL_S)
+
+def start_matchmaking():
+    global matchmaking_started
+    if not matchmaking_started:
+        socketio.start_background_task(target=matchmaking_task)
+        matchmaking_started = True
+
+# Input received since the last tick: (sid, client frame, actions, target room frame)
+pending_inputs = []
+
+def take_pending_inputs(sids=None):
+    """Remove and return the pending input (only that of `sids` when given)"""
+    global pending_inputs
+    if sids is None:
+        taken, pending_inputs = pending_inputs, []
+    else:
+        taken = [entry for entry in pending_inputs if entry[0] in sids]
+        pending_inputs = [entry for entry in pending_inputs if entry[0] not in sids]
+    return taken
+
+def run_tick(rooms, inputs):
+    with tracing.span('tick', rooms=len(rooms), inputs=len(inputs)):
+        rooms_to_send, _ = tick_rooms(rooms, inputs)
+        laps = tracing.TRACER.enabled and tracing.TRACER.laps()
+        for room_state in rooms_to_send:
+            try:
+                broadcast_room_state(room_state)
+            except Exception as e:
+                loop_errors.labels('broadcast').inc()
+                net_log.exception('broadcast_failed', room=room_state['id'], error=str(e))
+        if laps: laps.lap('broadcast', rooms=len(rooms_to_send))
+        if spectator_groups:
+            publish_spectator_updates(rooms_to_send)
+            if laps: laps.lap('publish_spectator_updates')
 
 def game_tick(room_state):
-    try:
-        # ALWAYS print this to verify game_tick is being called
-        current_screen = room_state.get('current_screen', 'UNKNOWN')
-        timer_val = room_state.get('state_timer_ms', 0)
-        print(f"🔄 game_tick: screen={current_screen}, timer={timer_val:.1f}")
-        
-        current_time_s = time.time()
-        delta_s = current_time_s - room_state['last_update_time']
-        room_state['last_update_time'] = current_time_s
-        
-        # Limit delta time to prevent large jumps
-        delta_s = min(delta_s, 1.0 / 30)
-        
-        # Clear previous frame's SFX events
-        room_state['sfx_event_for_client'] = None 
-        
-        # Handle clash flash effect
-        if room_state.get('clash_flash_timer', 0) > 0:
-            room_state['clash_flash_timer'] -= 1
-
-        # FIXED: Only handle timer once per frame
-        if room_state['state_timer_ms'] > 0:
-            old_timer = room_state['state_timer_ms']
-            room_state['state_timer_ms'] -= delta_s * 1000
-            print(f"⏰ Timer: {old_timer:.1f} -> {room_state['state_timer_ms']:.1f} (delta: {delta_s:.3f})")
-            
-            if room_state['state_timer_ms'] <= 0:
-                prev_screen_when_timer_expired = room_state['current_screen'] 
-                print(f"🚨 TIMER EXPIRED! Processing screen: {prev_screen_when_timer_expired}")
-                
-                if room_state['quickening_effect_active'] or room_state['dark_quickening_effect_active']:
-                    room_state['quickening_effect_active'] = False; room_state['dark_quickening_effect_active'] = False
-                    
-                    # FIXED: Handle SPECIAL_END state for dark quickening
-                    if prev_screen_when_timer_expired == 'SPECIAL_END':
-                        # Show GAME_OVER screen after dark quickening
-                        room_state.update({'current_screen': 'GAME_OVER', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS})
-                    elif room_state['game_winner_player_id']:
-                        if prev_screen_when_timer_expired == 'SPECIAL_END':
-                            # Show GAME_OVER screen for special level defeat
-                            room_state.update({'current_screen': 'GAME_OVER', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS})
-                        else:
-                            room_state.update({'current_screen': 'FINAL', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS}) 
-                        if not room_state['final_sound_played']: room_state['final_sound_played'] = True 
-                    # FIXED: Church victory handling - match original kylander2.py exactly
-                    elif prev_screen_when_timer_expired == 'SPECIAL' and \
-                         room_state['round_winner_player_id'] == room_state['special_swap_target_player_id']:
-                        # Darichris (swapped player) won the special round. Show church victory screen.
-                        print("Darichris won special round. Showing church victory screen.")
-                        chosen_bg_index = random.choice([0, 1])  # 0 = churchvictory.png, 1 = churchvictory2.png
-                        room_state.update({'current_screen': 'CHURCH_VICTORY', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS,
-                                          'church_victory_sound_triggered': True, 'church_victory_bg_index': chosen_bg_index})
-                        room_state['current_background_index'] = chosen_bg_index
-                        print(f"Church victory using background index {chosen_bg_index} ({'churchvictory.png' if chosen_bg_index == 0 else 'churchvictory2.png'})")
-                        # FIXED: End special level after Darichris wins
-                        end_special_level(room_state)
-                    elif prev_screen_when_timer_expired == 'SPECIAL' and \
-                         room_state['round_winner_player_id'] != room_state['special_swap_target_player_id']:
-                        # Original character won special round. Back to normal gameplay.
-                        print("Original character won special round. Showing normal church victory.")
-                        room_state.update({'current_screen': 'CHURCH_VICTORY', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS})
-                        # Use churchvictory.png (index 0) for original character win
-                        room_state['current_background_index'] = 0
-                        # FIXED: End special level after original character wins
-                        end_special_level(room_state)
-                    # FIXED: Special level trigger logic - handle AI opponent winning 3 rounds
-                    elif not room_state['special_level_active'] and \
-                         (room_state['match_score_p1'] == SPECIAL_LEVEL_WINS or room_state['match_score_p2'] == SPECIAL_LEVEL_WINS) and \
-                         room_state['round_winner_player_id']: 
-                         room_state['special_level_active'] = True 
-                         winner_of_trigger_round = room_state['round_winner_player_id']
-                         # Store original characters before swapping
-                         p1 = get_player_by_id(room_state, 'player1')
-                         p2 = get_player_by_id(room_state, 'player2')
-                         if p1: room_state['special_level_original_p1_char'] = p1['original_character_name']
-                         if p2: room_state['special_level_original_p2_char'] = p2['original_character_name']
-                         
-                         # CRITICAL FIX: The LOSER becomes Darichris!
-                         if room_state['match_score_p1'] == SPECIAL_LEVEL_WINS:
-                             # Player 1 won 3 rounds, so Player 2 (the opponent) becomes Darichris
-                             room_state['special_swap_target_player_id'] = 'player2'
-                             print(f"Player 1 won 3 rounds. AI opponent (player2) becomes Darichris.")
-                         else:
-                             # Player 2 (AI) won 3 rounds, so Player 1 becomes Darichris  
-                             room_state['special_swap_target_player_id'] = 'player1'
-                             print(f"AI opponent (player2) won 3 rounds. Player 1 becomes Darichris.")
-                         
-                         room_state.update({'current_screen': 'CHURCH_INTRO', 'state_timer_ms': CHURCH_INTRO_DURATION_MS})
-                         print(f"Special Level triggered. Winner: {winner_of_trigger_round}. {room_state['special_swap_target_player_id']} becomes Darichris.")
-                    else: 
-                        room_state.update({'current_screen': 'VICTORY', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS, 'current_background_key': 'victory'})
-                        if not room_state.get('available_victory_bgs_player'): room_state['available_victory_bgs_player'] = list(range(VICTORY_BG_COUNT))
-                        if room_state['available_victory_bgs_player']:
-                            idx = random.choice(room_state['available_victory_bgs_player'])
-                            room_state['current_background_index'] = idx; room_state['available_victory_bgs_player'].remove(idx)
-                        else: room_state['current_background_index'] = random.randint(0, VICTORY_BG_COUNT -1)
-                        
-                        if not room_state.get('available_victory_sfx_indices'): room_state['available_victory_sfx_indices'] = list(range(5))
-                        if room_state['available_victory_sfx_indices']:
-                            sfx_idx = random.choice(room_state['available_victory_sfx_indices'])
-                            room_state['victory_sfx_to_play_index'] = sfx_idx
-                            room_state['available_victory_sfx_indices'].remove(sfx_idx)
-                        else: room_state['victory_sfx_to_play_index'] = random.randint(0,4)
-                
-                elif prev_screen_when_timer_expired == 'CONTROLS': 
-                    print("🎯 CONTROLS timer expired - calling initialize_round!")
-                    try:
-                        initialize_round(room_state) 
-                        print(f"✅ initialize_round completed! New screen: {room_state['current_screen']}")
-                    except Exception as init_error:
-                        print(f"❌ ERROR in initialize_round: {init_error}")
-                        import traceback
-                        traceback.print_exc()
-                elif prev_screen_when_timer_expired == 'CHURCH_INTRO': 
-                    print("🎯 Church intro expired - calling initialize_round!")
-                    try:
-                        initialize_round(room_state)
-                        print(f"✅ Church intro initialize_round completed! New screen: {room_state['current_screen']}")
-                    except Exception as init_error:
-                        print(f"❌ ERROR in church intro initialize_round: {init_error}")
-                        import traceback
-                        traceback.print_exc() 
-                # FIXED: Church victory timer handling - return to normal gameplay
-                elif prev_screen_when_timer_expired == 'CHURCH_VICTORY':
-                    # After church victory screen, return to normal gameplay (not special level)
-                    print("Church victory screen ended. Returning to normal gameplay.")
-                    # Reset special level flags completely
-                    room_state['special_level_active'] = False
-                    room_state['special_swap_target_player_id'] = None
-                    # Clear any special level character tracking
-                    room_state['special_level_original_p1_char'] = None
-                    room_state['special_level_original_p2_char'] = None
-                    # NEW: Reset church victory sound flags
-                    room_state['church_victory_sound_triggered'] = False
-                    room_state['church_victory_bg_index'] = 0
-                    # Initialize a new round in normal gameplay
-                    initialize_round(room_state)
-                # FIXED: Handle immediate church victory (when Darichris wins in special level)
-                elif prev_screen_when_timer_expired == 'CHURCH_VICTORY_IMMEDIATE':
-                    # After immediate church victory, return to normal gameplay
-                    print("Immediate church victory ended. Returning to normal gameplay.")
-                    # NEW: Reset church victory sound flags
-                    room_state['church_victory_sound_triggered'] = False
-                    room_state['church_victory_bg_index'] = 0
-                    # The special level was already ended, just start a new round
-                    initialize_round(room_state)
-                elif prev_screen_when_timer_expired == 'VICTORY':
-                    if not room_state['game_winner_player_id']: initialize_round(room_state)
-                elif prev_screen_when_timer_expired == 'FINAL': 
-                    room_state.update({'current_screen': 'SLIDESHOW', 'current_background_key': 'slideshow', 
-                                       'current_background_index': 0, 'state_timer_ms': SLIDESHOW_DURATION_MS,
-                                       'slideshow_music_started': True})
-                elif prev_screen_when_timer_expired == 'GAME_OVER':
-                    room_state.update({'current_screen': 'SLIDESHOW', 'current_background_key': 'slideshow', 
-                                       'current_background_index': 0, 'state_timer_ms': SLIDESHOW_DURATION_MS,
-                                       'slideshow_music_started': True})
-
-        # IMPROVED: Slideshow management with better music control
-        if room_state['current_screen'] == 'SLIDESHOW':
-            if room_state['state_timer_ms'] <= 0:
-                # Check if we've shown all slides
-                if room_state['current_background_index'] >= SLIDESHOW_COUNT - 1:
-                    # Slideshow completed naturally - prepare to return to title
-                    print("Slideshow completed naturally - returning to title")
-                    room_state['slideshow_music_started'] = False  # Signal to stop slideshow music
-                    
-                    # Send update to stop music first
-                    socketio.emit('update_room_state', room_state, room=game_room_id)
-                    
-                    # Brief delay to let music stop, then transition
-                    room_state['state_timer_ms'] = 200  # 200ms delay
-                    room_state['current_screen'] = 'SLIDESHOW_TO_TITLE'  # Intermediate state
-                else:
-                    # Show next slide
-                    room_state['current_background_index'] = (room_state['current_background_index'] + 1) % SLIDESHOW_COUNT
-                    room_state['state_timer_ms'] = SLIDESHOW_DURATION_MS
-        
-        # Handle slideshow completion transition
-        elif room_state['current_screen'] == 'SLIDESHOW_TO_TITLE':
-            if room_state['state_timer_ms'] <= 0:
-                # Now transition to title
-                room_state.update({'current_screen': 'TITLE', 'current_background_key': 'paris',
-                                   'current_background_index': 0, 'slideshow_music_started': False})
-                # Reset game state
-                room_state['match_score_p1'] = 0
-                room_state['match_score_p2'] = 0
-                room_state['final_sound_played'] = False
-
-        if room_state['current_screen'] == 'PLAYING' or room_state['current_screen'] == 'SPECIAL':
-            p1 = get_player_by_id(room_state, 'player1'); p2 = get_player_by_id(room_state, 'player2')
-            if p1 : update_player_physics_and_timers(p1)
-            if p2 :
-                if room_state['ai_opponent_active']: update_ai(p2, p1, room_state)
-                else: update_player_physics_and_timers(p2)
-            
-            # FIXED: Handle miss swing sound effects
-            if p1 and p1['miss_swing']:
-                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'
-                p1['miss_swing'] = False
-            if p2 and p2['miss_swing']:
-                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'
-                p2['miss_swing'] = False
-                
-            if p1 and p2 and p1['health'] > 0 and p2['health'] > 0:
-                p1_hit_this_tick = False; p2_hit_this_tick = False
-                
-                # === COMBAT MECHANICS OVERVIEW ===
-                # 1. SWORD CLASH/BLOCK: Both players attacking simultaneously = knockback, stun, clash sound
-                # 2. EVASION (Jump/Duck): Avoid damage but NO clash effects (just miss sound)
-                # 3. NORMAL HIT: Attack connects = damage and hit sound
-                
-                # IMPROVED: Enhanced collision detection with centered sprites
-                SPRITE_CENTER_OFFSET_X = 0  # Sprites are already centered properly
-                SPRITE_CENTER_OFFSET_Y = 25  # Adjust for bottom-aligned sprites
-                
-                p1_center_x = p1['x'] + SPRITE_CENTER_OFFSET_X
-                p1_center_y = p1['y'] - SPRITE_CENTER_OFFSET_Y
-                p2_center_x = p2['x'] + SPRITE_CENTER_OFFSET_X
-                p2_center_y = p2['y'] - SPRITE_CENTER_OFFSET_Y
-                
-                # INCREASED: Much more generous clash detection
-                CLASH_DETECTION_RANGE = 110  # INCREASED: Even more generous (was 90)
-                VERTICAL_CLASH_TOLERANCE = 80  # INCREASED: (was 70)
-                
-                # IMPROVED: SWORD CLASH DETECTION - Only when both players are actively attacking
-                # This is a TRUE BLOCK that causes knockback, stun, and clash effects
-                if p1['is_attacking'] and p2['is_attacking'] and \
-                   p1['health'] > 0 and p2['health'] > 0 and \
-                   abs(p1_center_x - p2_center_x) < CLASH_DETECTION_RANGE and \
-                   abs(p1_center_y - p2_center_y) < VERTICAL_CLASH_TOLERANCE:
-                    
-                    # VERY GENEROUS: Allow clash even with significant timing differences
-                    # Check if either player just started attacking or is still attacking
-                    p1_attack_active = p1['is_attacking'] and p1['attack_timer'] > 0
-                    p2_attack_active = p2['is_attacking'] and p2['attack_timer'] > 0
-                    
-                    # Allow clash if both are attacking within a very generous window
-                    if p1_attack_active and p2_attack_active and not p1['has_hit_this_attack'] and not p2['has_hit_this_attack']:
-                        print(f"GENEROUS CLASH! P1 timer: {p1['attack_timer']}, P2 timer: {p2['attack_timer']}, Distance: {abs(p1_center_x - p2_center_x)}")
-                        
-                        # Block detected - both players avoid damage completely
-                        p1.update({'has_hit_this_attack': True, 'cooldown_timer': max(p1['cooldown_timer'], CLASH_STUN_DURATION), 'attack_timer': min(p1['attack_timer'], 3)})
-                        p2.update({'has_hit_this_attack': True, 'cooldown_timer': max(p2['cooldown_timer'], CLASH_STUN_DURATION), 'attack_timer': min(p2['attack_timer'], 3)})
-                        
-                        # Apply stronger knockback
-                        old_p1_x, old_p2_x = p1['x'], p2['x']
-                        knockback_force = KNOCKBACK_DISTANCE + 10  # Even stronger knockback
-                        if p1['x'] < p2['x']:
-                            p1['x'] -= knockback_force
-                            p2['x'] += knockback_force
-                        else:
-                            p1['x'] += knockback_force
-                            p2['x'] -= knockback_force
-                        
-                        print(f"STRONG KNOCKBACK! P1: {old_p1_x} -> {p1['x']}, P2: {old_p2_x} -> {p2['x']}")
-                        
-                        # UPDATED: Longer knockback timers for more noticeable effect
-                        p1['knockback_timer'] = 35  # INCREASED
-                        p2['knockback_timer'] = 35  # INCREASED
-                        
-                        # More dramatic vertical bounce
-                        if not p1['is_jumping']:
-                            p1['vertical_velocity'] = -10  # INCREASED: (was -8)
-                            p1['is_jumping'] = True
-                        if not p2['is_jumping']:
-                            p2['vertical_velocity'] = -10  # INCREASED: (was -8)
-                            p2['is_jumping'] = True
-                        
-                        # Ensure players stay on screen
-                        p1['x'] = max(PLAYER_SPRITE_HALF_WIDTH, min(GAME_WIDTH - PLAYER_SPRITE_HALF_WIDTH, p1['x']))
-                        p2['x'] = max(PLAYER_SPRITE_HALF_WIDTH, min(GAME_WIDTH - PLAYER_SPRITE_HALF_WIDTH, p2['x']))
-                        
-                        # Screen flash effect
-                        room_state['clash_flash_timer'] = 8  # INCREASED: (was 5)
-                        
-                        print("GENEROUS CLASH SUCCESSFUL! - TRUE SWORD BLOCK"); room_state['sfx_event_for_client'] = 'sfx_swordClash'
-                        
-                else:
-                    # No sword clash detected - check for individual hits and evasive maneuvers
-                    # IMPORTANT: Jump/Duck are EVASION (avoid damage) not BLOCKS (no clash effects)
-                    ATTACK_RANGE_EXTENSION = 50  # INCREASED from 42.5 (PLAYER_ATTACK_RANGE / 2)
-                    HIT_BOX_WIDTH = 45  # How wide the hit detection is
-                    
-                    if p1['is_attacking'] and not p1['has_hit_this_attack']:
-                        # Calculate attack position extending from sprite edge
-                        if p1['facing'] == 1:  # Facing right
-                            attack_x = p1_center_x + ATTACK_RANGE_EXTENSION
-                        else:  # Facing left
-                            attack_x = p1_center_x - ATTACK_RANGE_EXTENSION
-                        
-                        # Check if attack can potentially hit p2
-                        can_hit_p2 = (abs(attack_x - p2_center_x) < HIT_BOX_WIDTH and 
-                                     abs(p1_center_y - p2_center_y) < VERTICAL_CLASH_TOLERANCE)
-                        
-                        if can_hit_p2:
-                            # Check for EVASIVE MANEUVERS (duck or jump defense)
-                            if p2['is_ducking']:
-                                # DUCK EVASION - avoids damage, no clash effects
-                                print(f"P2 DUCK EVASION! P2 avoided P1's attack by ducking")
-                                p1['has_hit_this_attack'] = True  # Prevent multiple attempts
-                                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'  # Miss sound
-                            elif p2['is_jumping'] and not p1['is_jumping']:
-                                # JUMP EVASION - defender jumping vs ground attacker, avoids damage, no clash effects
-                                print(f"P2 JUMP EVASION! P2 avoided P1's ground attack by jumping")
-                                p1['has_hit_this_attack'] = True  # Prevent multiple attempts
-                                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'  # Miss sound
-                            else:
-                                # SUCCESSFUL HIT - either both jumping or defender not evading
-                                p2['health'] -= 10; p1['has_hit_this_attack'] = True; p1_hit_this_tick = True
-                                print(f"P1 HIT P2. P2 Health: {p2['health']} (P1 jumping: {p1['is_jumping']}, P2 jumping: {p2['is_jumping']})")
-                                room_state['sfx_event_for_client'] = 'sfx_swordSwing'
-                                if p2['health'] <= 0:
-                                    # FIXED: Special level logic for AI wins
-                                    if room_state['special_level_active']:
-                                        if room_state['special_swap_target_player_id'] == 'player2' and p2.get('display_character_name') == "Darichris":
-                                            # Darichris was killed - trigger special ending (dark quickening)
-                                            print("AI killed Darichris on holy ground! Dark quickening...")
-                                            handle_special_level_loss_by_swapped(room_state, 'player1')
-                                        else:
-                                            # The non-Darichris player was killed - this means Darichris won!
-                                            print("Darichris defeated the AI! Church victory...")
-                                            chosen_bg_index = random.choice([0, 1])  # 0 = churchvictory.png, 1 = churchvictory2.png
-                                            room_state.update({'current_screen': 'CHURCH_VICTORY_IMMEDIATE', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS,
-                                                              'church_victory_sound_triggered': True, 'church_victory_bg_index': chosen_bg_index})
-                                            room_state['current_background_index'] = chosen_bg_index
-                                            room_state['round_winner_player_id'] = 'player2'  
-                                            print(f"Immediate church victory using background index {chosen_bg_index} ({'churchvictory.png' if chosen_bg_index == 0 else 'churchvictory2.png'})")
-                                            end_special_level(room_state)
-                                    else:
-                                        handle_round_victory(room_state, 'player1', 'player2')
-                    
-                    if p2['is_attacking'] and not p2['has_hit_this_attack'] and p1['health'] > 0:
-                        # Calculate attack position extending from sprite edge
-                        if p2['facing'] == 1:  # Facing right
-                            attack_x = p2_center_x + ATTACK_RANGE_EXTENSION
-                        else:  # Facing left
-                            attack_x = p2_center_x - ATTACK_RANGE_EXTENSION
-                        
-                        # Check if attack can potentially hit p1
-                        can_hit_p1 = (abs(attack_x - p1_center_x) < HIT_BOX_WIDTH and 
-                                     abs(p2_center_y - p1_center_y) < VERTICAL_CLASH_TOLERANCE)
-                        
-                        if can_hit_p1:
-                            # Check for EVASIVE MANEUVERS (duck or jump defense)
-                            if p1['is_ducking']:
-                                # DUCK EVASION - avoids damage, no clash effects
-                                print(f"P1 DUCK EVASION! P1 avoided P2's attack by ducking")
-                                p2['has_hit_this_attack'] = True  # Prevent multiple attempts
-                                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'  # Miss sound
-                            elif p1['is_jumping'] and not p2['is_jumping']:
-                                # JUMP EVASION - defender jumping vs ground attacker, avoids damage, no clash effects
-                                print(f"P1 JUMP EVASION! P1 avoided P2's ground attack by jumping")
-                                p2['has_hit_this_attack'] = True  # Prevent multiple attempts
-                                room_state['sfx_event_for_client'] = 'sfx_swordWhoosh'  # Miss sound
-                            else:
-                                # SUCCESSFUL HIT - either both jumping or defender not evading
-                                p1['health'] -= 10; p2['has_hit_this_attack'] = True; p2_hit_this_tick = True
-                                print(f"P2 HIT P1. P1 Health: {p1['health']} (P1 jumping: {p1['is_jumping']}, P2 jumping: {p2['is_jumping']})")
-                                room_state['sfx_event_for_client'] = 'sfx_swordSwing'
-                                if p1['health'] <= 0:
-                                    # FIXED: Special level logic for AI opponent
-                                    if room_state['special_level_active']:
-                                        if room_state['special_swap_target_player_id'] == 'player1' and p1.get('display_character_name') == "Darichris":
-                                            # Darichris was killed - trigger special ending (dark quickening)
-                                            print("AI killed Darichris on holy ground! Dark quickening...")
-                                            handle_special_level_loss_by_swapped(room_state, 'player2')
-                                        else:
-                                            # The non-Darichris player was killed - this means Darichris won!
-                                            print("Darichris defeated the AI! Church victory...")
-                                            chosen_bg_index = random.choice([0, 1])  # 0 = churchvictory.png, 1 = churchvictory2.png
-                                            room_state.update({'current_screen': 'CHURCH_VICTORY_IMMEDIATE', 'state_timer_ms': VICTORY_SCREEN_DURATION_MS,
-                                                              'church_victory_sound_triggered': True, 'church_victory_bg_index': chosen_bg_index})
-                                            room_state['current_background_index'] = chosen_bg_index
-                                            room_state['round_winner_player_id'] = 'player1'  
-                                            print(f"Immediate church victory using background index {chosen_bg_index} ({'churchvictory.png' if chosen_bg_index == 0 else 'churchvictory2.png'})")
-                                            end_special_level(room_state)
-                                    else:
-                                        handle_round_victory(room_state, 'player2', 'player1')
-                
-                # IMPROVED: Sword effects sound matching original
-                if p1['is_attacking'] and p2['is_attacking'] and not room_state['swordeffects_playing']:
-                    room_state['sfx_event_for_client'] = 'sfx_swordEffects'
-                    room_state['swordeffects_playing'] = True
-                elif not (p1['is_attacking'] and p2['is_attacking']):
-                    room_state['swordeffects_playing'] = False
-        
-        # Always emit the room state update
-        socketio.emit('update_room_state', room_state, room=game_room_id)
-        print(f"✅ game_tick completed and broadcasted")
-        
-    except Exception as e:
-        print(f"❌ EXCEPTION in game_tick: {e}")
-        import traceback
-        traceback.print_exc()
+    run_tick([room_state], take_pending_inputs(room_state['players']))
+
+def tick_all_rooms():
+    run_tick(list(room_manager.rooms.values()), take_pending_inputs())
 
 @app.route('/')
-def index(): return render_template('index.html')
+def index():
+    if room_router is not None:
+        # Sharded: the page (and so the socket) has to come from the worker that owns the room
+        room_id = request.args.get('room')
+        if request.args.get('match'):
+            # One worker holds the matchmaking queue and hosts the rooms it makes
+            owner = shard_map.owner(MATCHMAKING_SHARD_KEY)
+            if owner != shard_map.shard:
+                return redirect(f"{owner}/?{urlencode(request.args)}")
+            return render_template('index.html')
+        if room_id is None and request.args.get('spectate'):
+            return render_template('index.html')
+        routed_room_id, owner = room_router.route(room_id)
+        if room_id is None or owner != shard_map.shard:
+            return redirect(f"{owner}/?{urlencode(dict(request.args, room=routed_room_id))}")
+    return render_template('index.html')
+
+@app.route('/route')
+def route_room():
+    """Where a room lives (?room=<id>), or a quick-play room for a visitor without one"""
+    if room_router is None:
+        return {'status': 'unsharded', 'room': request.args.get('room'), 'owner': None}
+    room_id, owner = room_router.route(request.args.get('room'))
+    return {'status': 'ok', 'room': room_id, 'owner': owner, 'local': owner == shard_map.shard}
 
 @app.route('/health')
 def health_check():
     """Health check endpoint to verify server is running"""
-    room = game_sessions.get(game_room_id)
+    room_id = request.args.get('room')
+    if room_id:
+        room = room_manager.get_room(room_id)
+        return {
+            'status': 'ok',
+            'room_exists': room is not None,
+            'current_screen': room.get('current_screen', 'unknown') if room else 'no_room',
+            'players_count': len(room.get('players', {})) if room else 0,
+            'timestamp': time.time()
+        }
+    stats = room_manager.stats()
     return {
         'status': 'ok',
-        'room_exists': room is not None,
-        'current_screen': room.get('current_screen', 'unknown') if room else 'no_room',
-        'players_count': len(room.get('players', {})) if room else 0,
+        'rooms_count': stats['rooms'],
+        'open_rooms_count': stats['open_rooms'],
+        'players_count': stats['connected_sids'],
+        'rooms_by_screen': stats['rooms_by_screen'],
+        'scheduler': game_scheduler.stats(),
+        'player_store': player_store.stats(),
+        'inputs': input_buffer.stats,
+        'rollback': dict(rollback_histories.stats, rooms=len(rollback_histories.rooms)),
+        'replays': replay_recorder.stats() if replay_recorder is not None else None,
+        'packet_cache': packet_cache.stats(),
+        'assets': {'build': asset_manifest['bytes'] if asset_manifest else None,
+                   'version': asset_tier_manifest['version'], 'tier_bytes': asset_tier_manifest['tier_bytes']},
+        'static': static_server.report(),
+        'split': {'ring': socketio.server.manager.stats, 'inputs': sim_inputs.report()} if sim_inputs else None,
+        'matchmaking': matchmaking_queue.report(),
+        'sharding': dict(shard_map.stats(), routing=room_router.stats,
+                         message_queue=MESSAGE_QUEUE.split('://')[0] if MESSAGE_QUEUE else None) if shard_map else None,
+        'tracing': {'enabled': tracing.TRACER.enabled, 'captures': len(tracing.TRACER.captures)},
+        'spectators': {'rooms': len(spectator_groups), 'spectators': len(spectator_rooms),
+                       'queued_updates': len(spectator_outbox)},
         'timestamp': time.time()
     }
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def admin_authorized():
+    """Whether the request carries the admin token; always False when no token is configured"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.args.get('token', ''), ADMIN_TOKEN)
+
+@app.route('/logging')
+def logging_control():
+    """Inspect or change logging at runtime.
+
+    ?level=DEBUG[&category=tick] sets a level, ?sample_every=N&category=... keeps 1 in N
+    DEBUG/INFO records, ?rate_limit=N&category=... caps records per second (0 = unlimited)."""
+    if not admin_authorized():
+        return {'status': 'forbidden'}, 403
+    category = request.args.get('category') or None
+    try:
+        if 'level' in request.args:
+            game_log.set_level(request.args['level'], category)
+        if category and 'sample_every' in request.args:
+            game_log.set_sampling(category, int(request.args['sample_every']))
+        if category and 'rate_limit' in request.args:
+            game_log.set_rate_limit(category, int(request.args['rate_limit']) or None)
+    except (KeyError, ValueError) as e:
+        return {'status': 'bad_request', 'error': str(e)}, 400
+    return {'status': 'ok', 'logging': game_log.stats(), 'timestamp': time.time()}
+
+@app.route('/trace')
+def trace_control():
+    """Tick tracing: the recorded spans as Chrome trace JSON (open in ui.perfetto.dev).
+
+    ?enable=1 / ?enable=0 turns tracing on or off, ?status=1 lists the
+    automatic captures, ?capture=N downloads one (0 = newest). Every form
+    needs ?token=<KYLANDER_ADMIN_TOKEN>, like /logging."""
+    if not admin_authorized():
+        return {'status': 'forbidden'}, 403
+    tracer = tracing.TRACER
+    if 'enable' in request.args:
+        tracer.set_enabled(request.args['enable'] not in ('', '0'))
+        if tracer.enabled: tracer.clear()
+        return {'status': 'ok', 'tracing': tracer.stats(), 'timestamp': time.time()}
+    if request.args.get('status'):
+        return {'status': 'ok', 'tracing': tracer.stats(), 'timestamp': time.time()}
+    if 'capture' in request.args:
+        try:
+            capture = tracer.captures[int(request.args['capture'])]
+        except (IndexError, ValueError):
+            return {'status': 'no_capture', 'captures': len(tracer.captures)}, 404
+        body = tracing.chrome_trace(capture['spans'], dict(capture['detail'], reason=capture['reason'], time=capture['time']))
+        name = f"kylander-trace-{int(capture['time'])}.json"
+    else:
+        body = tracing.chrome_trace(tracer.recent(), {'time': time.time()})
+        name = f"kylander-trace-{int(time.time())}.json"
+    response = app.response_class(body, mimetype='application/json')
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
 @app.route('/start_game_loop')
 def start_game_loop_route():
     """Manual trigger to start game loop if it's not running"""
     try:
-        print("🔧 Manual game loop start triggered!")
         result = start_game_loop()
         return {'status': 'success' if result else 'failed', 'timestamp': time.time()}
     except Exception as e:
-        print(f"❌ Failed to start game loop manually: {e}")
+        loop_log.exception('manual_loop_start_failed', error=str(e))
         return {'status': 'error', 'error': str(e), 'timestamp': time.time()}
 
 @app.route('/tick')
 def manual_tick():
-    """Manual single game tick for testing"""
+    """Manual single game tick for testing (one room with ?room=<id>, otherwise all rooms)"""
     try:
-        print("🔧 Manual tick triggered!")
-        room = game_sessions.get(game_room_id)
-        if room:
+        room_id = request.args.get('room')
+        if room_id:
+            room = room_manager.get_room(room_id)
+            if not room:
+                return {'status': 'no_room', 'timestamp': time.time()}
             game_tick(room)
-            return {'status': 'tick_executed', 'screen': room.get('current_screen'), 'timer': room.get('state_timer_ms'), 'timestamp': time.time()}
-        else:
-            return {'status': 'no_room', 'timestamp': time.time()}
+            return {'status': 'tick_executed', 'screen': room.get('current_screen'), 'frame': room.get('frame'), 'timer': room.get('state_timer_frames'), 'timestamp': time.time()}
+        tick_all_rooms()
+        return {'status': 'tick_executed', 'rooms_ticked': len(room_manager), 'timestamp': time.time()}
     except Exception as e:
-        print(f"❌ Failed manual tick: {e}")
-        import traceback
-        traceback.print_exc()
+        tick_log.exception('manual_tick_failed', error=str(e))
         return {'status': 'error', 'error': str(e), 'timestamp': time.time()}
 
+def seat_player(room, player_sid, player_id_str):
+    """Add a connected client to a room as player1/player2 (taking the character already chosen for that slot)"""
+    player_id_num = 1 if player_id_str == "player1" else 2
+    player_state = get_default_player_state(player_id_num); player_state['sid'] = player_sid
+    if player_state['id'] == 'player1' and room['player1_char_name_chosen']: player_state.update({'character_name': room['player1_char_name_chosen'], 'original_character_name': room['player1_char_name_chosen'], 'display_character_name': room['player1_char_name_chosen']})
+    elif player_state['id'] == 'player2' and room['player2_char_name_chosen']: player_state.update({'character_name': room['player2_char_name_chosen'], 'original_character_name': room['player2_char_name_chosen'], 'display_character_name': room['player2_char_name_chosen']})
+    room['players'][player_sid] = player_state
+    # Through the server rather than join_room(), which needs an app context the matchmaking task doesn't have
+    socketio.server.enter_room(player_sid, room['id'], namespace='/')
+    room_manager.add_sid(player_sid, room)
+    return player_state
+
 @socketio.on('connect')
 def handle_connect():
     # Try to start game loop when first player connects
     start_game_loop()
     
-    player_sid = request.sid; room = game_sessions[game_room_id]
-    print(f"Connect attempt: {player_sid}. Current human SIDs: {[s for s, p in room['players'].items() if s != AI_SID_PLACEHOLDER]}")
+    player_sid = request.sid
+    connects.labels('spectator' if request.args.get('spectate') else 'match' if request.args.get('match') else 'player').inc()
+    if request.args.get('spectate'):
+        join_as_spectator(player_sid, request.args.get('room')); return
+    requested_room_id = request.args.get('room')
+    if requested_room_id and shard_map is not None and not shard_map.owns(requested_room_id):
+        owner = shard_map.owner(requested_room_id)
+        connections_rejected.labels('wrong_shard').inc()
+        net_log.warning('rejected', sid=player_sid, reason='wrong_shard', requested_room=requested_room_id, owner=owner)
+        emit('wrong_shard', {'roomId': requested_room_id, 'owner': owner}, room=player_sid); disconnect(player_sid); return
+    wire_version = wire_protocol.negotiate(request.args.get('wire'))
+    if wire_version: client_wire_versions[player_sid] = wire_version
+    if request.args.get('match'):
+        queue_for_match(player_sid, request.args); return
+    room = room_manager.find_room_for_new_player(requested_room_id)
+    if room is None:
+        connections_rejected.labels('no_room').inc()
+        net_log.warning('rejected', sid=player_sid, reason='no_room', requested_room=request.args.get('room'))
+        emit('room_full', room=player_sid); disconnect(player_sid); return
+    room_id = room['id']
     human_sids_in_room = [sid for sid in room['players'] if sid != AI_SID_PLACEHOLDER]
     assigned_player_id_str = None
     if not any(p['id'] == 'player1' for sid, p in room['players'].items() if sid != AI_SID_PLACEHOLDER): assigned_player_id_str = "player1"
     elif not any(p['id'] == 'player2' for sid, p in room['players'].items() if sid != AI_SID_PLACEHOLDER) and len(human_sids_in_room) < MAX_PLAYERS_PER_ROOM:
         assigned_player_id_str = "player2"
     if assigned_player_id_str is None:
-        print(f"Room full or slot error. SID {player_sid} rejected."); emit('room_full', room=player_sid); disconnect(player_sid); return
-    player_id_num = 1 if assigned_player_id_str == "player1" else 2
-    player_state = get_default_player_state(player_id_num); player_state['sid'] = player_sid
-    if player_state['id'] == 'player1' and room['player1_char_name_chosen']: player_state.update({'character_name': room['player1_char_name_chosen'], 'original_character_name': room['player1_char_name_chosen'], 'display_character_name': room['player1_char_name_chosen']})
-    elif player_state['id'] == 'player2' and room['player2_char_name_chosen']: player_state.update({'character_name': room['player2_char_name_chosen'], 'original_character_name': room['player2_char_name_chosen'], 'display_character_name': room['player2_char_name_chosen']})
-    room['players'][player_sid] = player_state; join_room(game_room_id)
-    print(f"Player {player_state['id']} ({player_sid}) connected. Total SIDs (inc AI): {len(room['players'])}.")
+        connections_rejected.labels('no_slot').inc()
+        net_log.warning('rejected', sid=player_sid, reason='no_slot', room=room_id)
+        emit('room_full', room=player_sid); disconnect(player_sid); return
+    player_state = seat_player(room, player_sid, assigned_player_id_str)
+    net_log.info('connected', sid=player_sid, player=player_state['id'], room=room_id,
+                 wire='binary' if wire_version else 'json', rooms=len(room_manager))
     
     # FIXED: Check if Player 2 is connecting after Player 1 has already chosen
     if player_state['id'] == 'player2' and room['game_mode'] == 'TWO' and \
@@ -843,22 +628,42 @@ def handle_connect():
          room['current_screen'] != 'CHARACTER_SELECT_P2': 
         room['current_screen'] = 'CHARACTER_SELECT_P2'
     
-    emit('assign_player_id', {'playerId': player_state['id'], 'initialRoomState': room}, room=player_sid)
-    socketio.emit('update_room_state', room, room=game_room_id)
+    emit('assign_player_id', assign_player_message(room, player_state['id']), room=player_sid)
+    register_snapshot_client(room_id, player_sid)
+    broadcast_room_state(room)
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    player_sid = request.sid; room = game_sessions.get(game_room_id)
+    player_sid = request.sid
+    if player_sid in spectator_rooms:
+        disconnects.labels('spectator').inc()
+        remove_spectator(player_sid); return
+    if matchmaking_queue.cancel(player_sid):
+        disconnects.labels('match').inc()
+        client_wire_versions.pop(player_sid, None)
+        net_log.info('match_cancelled', sid=player_sid, queued=len(matchmaking_queue)); return
+    disconnects.labels('player').inc()
+    room = room_manager.remove_sid(player_sid)
+    client_wire_versions.pop(player_sid, None)
+    input_buffer.remove(player_sid)
     if room and player_sid in room['players']:
-        p_id_disc = room['players'][player_sid]['id']; del room['players'][player_sid]
-        print(f"Player {p_id_disc} ({player_sid}) disconnected.")
+        room_id = room['id']
+        end_replay(room, 'left')
+        p_id_disc = room['players'][player_sid]['id']; remove_player(room, player_sid)
+        rollback_histories.drop(room_id)
+        leave_room(room_id); unregister_snapshot_client(room_id, player_sid)
+        net_log.info('disconnected', sid=player_sid, player=p_id_disc, room=room_id)
         if p_id_disc == 'player1' and room['ai_opponent_active']:
-            if AI_SID_PLACEHOLDER in room['players']: del room['players'][AI_SID_PLACEHOLDER]; print("AI player removed.")
+            remove_player(room, AI_SID_PLACEHOLDER)
             room['ai_opponent_active'] = False
         human_players_remaining_sids = [sid for sid in room['players'] if sid != AI_SID_PLACEHOLDER]
-        if not human_players_remaining_sids: game_sessions[game_room_id] = get_default_room_state(); print("Room empty, resetting.")
+        if not human_players_remaining_sids:
+            release_room_players(room_manager.destroy_room(room_id)); drop_snapshot_channels(room_id)
+            forget_room(room_id); close_spectator_group(room_id)
+            net_log.info('room_destroyed', room=room_id, rooms=len(room_manager))
+            return
         else: 
-            print(f"One player remains. Resetting room to TITLE.")
+            net_log.info('room_reset_to_title', room=room_id, reason='opponent_left')
             room.update({'current_screen': 'TITLE', 'game_mode': None, 'ai_opponent_active': False,
                          'match_score_p1': 0, 'match_score_p2': 0, 'final_sound_played': False,
                          'player1_char_name_chosen':None, 'player2_char_name_chosen':None,
@@ -869,50 +674,73 @@ def handle_disconnect():
             rem_sid = human_players_remaining_sids[0]
             char_of_remaining = room['players'][rem_sid]['original_character_name'] if rem_sid in room['players'] and room['players'][rem_sid] else None
             new_p1_state = get_default_player_state(1, char_of_remaining); new_p1_state['sid'] = rem_sid
-            if AI_SID_PLACEHOLDER in room['players']: del room['players'][AI_SID_PLACEHOLDER]
+            release_room_players(room)
             room['players'] = {rem_sid: new_p1_state}
             room['player1_char_name_chosen'] = char_of_remaining
-            emit('assign_player_id', {'playerId': 'player1', 'initialRoomState': room}, room=rem_sid)
-        socketio.emit('update_room_state', room, room=game_room_id)
+            room_manager.refresh_open_state(room)
+            emit('assign_player_id', assign_player_message(room, 'player1'), room=rem_sid)
+            register_snapshot_client(room_id, rem_sid)
+        broadcast_room_state(room)
+
+@socketio.on('snapshot_ack')
+@instrumented('snapshot_ack')
+def on_snapshot_ack(data):
+    """Client confirms it holds snapshot data['seq']; later deltas are computed against it"""
+    channel = snapshot_channel_for_sid(request.sid)
+    if channel and isinstance(data, dict): channel.ack(request.sid, data.get('seq'))
+
+@socketio.on('snapshot_resync')
+@instrumented('snapshot_resync')
+def on_snapshot_resync(data=None):
+    """Client lost its delta base; send a full keyframe next tick"""
+    channel = snapshot_channel_for_sid(request.sid)
+    if channel: channel.request_keyframe(request.sid)
 
 @socketio.on('change_game_state')
+@instrumented('change_game_state')
 def on_change_game_state(data):
-    new_state = data.get('newState'); room = game_sessions.get(game_room_id); player_sid = request.sid
+    new_state = data.get('newState'); player_sid = request.sid; room = room_manager.room_for_sid(player_sid)
     if not room or player_sid not in room['players']: return
-    print(f"P {room['players'][player_sid]['id']} req state {new_state} from {room['current_screen']}")
+    room_id = room['id']
+    rollback_histories.drop(room_id)
+    round_log.debug('state_change_requested', room=room_id, player=room['players'][player_sid]['id'],
+                    new_state=new_state, screen=room['current_screen'])
     
     # Special handling for slideshow to title transition
     if new_state == 'TITLE_SCREEN': 
+        end_replay(room, 'reset')
         # ENHANCED: Complete music and state reset
-        print("TITLE_SCREEN request - performing complete reset")
         room['slideshow_music_started'] = False  # Signal to stop slideshow music
         room['current_screen'] = 'TITLE'  # Force screen change first
         
         # Send immediate state update to stop music
-        socketio.emit('update_room_state', room, room=game_room_id)
+        broadcast_room_state(room)
         
         # Then reset everything
         current_sids_map = {p['id']: sid for sid, p in room['players'].items() if sid != AI_SID_PLACEHOLDER}
-        game_sessions[game_room_id] = get_default_room_state(); new_room_state = game_sessions[game_room_id]
+        new_room_state = room_manager.reset_room(room_id)
+        new_room_state['frame'] = room['frame']  # Frame counter stays monotonic across resets
         
         # Preserve players but reset their state
         if 'player1' in current_sids_map:
             p1_sid = current_sids_map['player1']; p1_new = get_default_player_state(1); p1_new['sid'] = p1_sid
             new_room_state['players'][p1_sid] = p1_new
-            emit('assign_player_id', {'playerId': 'player1', 'initialRoomState': new_room_state}, room=p1_sid)
+            emit('assign_player_id', assign_player_message(new_room_state, 'player1'), room=p1_sid)
+            register_snapshot_client(room_id, p1_sid)
         if 'player2' in current_sids_map:
             p2_sid = current_sids_map['player2']; p2_new = get_default_player_state(2); p2_new['sid'] = p2_sid
             new_room_state['players'][p2_sid] = p2_new
-            emit('assign_player_id', {'playerId': 'player2', 'initialRoomState': new_room_state}, room=p2_sid)
+            emit('assign_player_id', assign_player_message(new_room_state, 'player2'), room=p2_sid)
+            register_snapshot_client(room_id, p2_sid)
         
-        # Clean up AI if present
-        if AI_SID_PLACEHOLDER in room['players']:
-            del room['players'][AI_SID_PLACEHOLDER]
-            room['ai_opponent_active'] = False
+        # The old room's players (AI included) are replaced; free their store slots
+        release_room_players(room)
+        room['ai_opponent_active'] = False
         
         room = new_room_state
         room['final_sound_played'] = False
         room['slideshow_music_started'] = False  # Ensure it's false
+        room_manager.refresh_open_state(room)
     
     elif new_state == 'MODE_SELECT' and room['current_screen'] == 'TITLE': room['current_screen'] = 'MODE_SELECT'
     elif new_state == 'CHARACTER_SELECT_P1' and room['current_screen'] == 'MODE_SELECT':
@@ -924,18 +752,25 @@ def on_change_game_state(data):
         for p_state_sid_iter in list(room['players'].keys()):
             player_obj = room['players'].get(p_state_sid_iter)
             if player_obj: player_obj.update({'character_name': None, 'original_character_name': None, 'display_character_name': None})
+        room_manager.refresh_open_state(room)  # One-player rooms stop taking visitors
     
-    socketio.emit('update_room_state', room, room=game_room_id)
+    broadcast_room_state(room)
 
 @socketio.on('player_character_choice')
+@instrumented('player_character_choice')
 def on_player_character_choice(data):
     char_name = data.get('characterName'); player_sid = request.sid
-    room = game_sessions.get(game_room_id)
+    room = room_manager.room_for_sid(player_sid)
     if not room or player_sid not in room['players'] or char_name not in CHARACTER_NAMES: return
+    choose_character(room, player_sid, char_name)
 
+def choose_character(room, player_sid, char_name):
+    """A player picks their fighter; moves the room on to P2's pick or the controls screen"""
     player_data = room['players'][player_sid]
-    print(f"Player {player_data['id']} chose {char_name}")
+    round_log.info('character_chosen', room=room['id'], player=player_data['id'], character=char_name)
     player_data.update({'character_name': char_name, 'original_character_name': char_name, 'display_character_name': char_name})
+    record_replay_edit(room, players={player_data['id']: {'character_name': char_name, 'original_character_name': char_name,
+                                                         'display_character_name': char_name}})
 
     ready_for_controls = False
     if room['current_screen'] == 'CHARACTER_SELECT_P1' and player_data['id'] == 'player1':
@@ -946,9 +781,9 @@ def on_player_character_choice(data):
             normal_ai_opponent_pool = [cn for cn in CHARACTER_NAMES if cn != char_name and cn != "Darichris"]
             if not normal_ai_opponent_pool:
                 fallback_ai_pool = [cn for cn in CHARACTER_NAMES if cn != char_name]
-                ai_char = random.choice(fallback_ai_pool) if fallback_ai_pool else CHARACTER_NAMES[0]
+                ai_char = room_rng(room).choice(fallback_ai_pool) if fallback_ai_pool else CHARACTER_NAMES[0]
             else:
-                ai_char = random.choice(normal_ai_opponent_pool)
+                ai_char = room_rng(room).choice(normal_ai_opponent_pool)
             
             room['player2_char_name_chosen'] = ai_char
             
@@ -962,7 +797,8 @@ def on_player_character_choice(data):
                                                             'original_character_name':ai_char, 
                                                             'display_character_name':ai_char, 
                                                             'id': 'player2'})
-            print(f"AI (player2) set to {ai_char}")
+            round_log.info('character_chosen', room=room['id'], player='player2', character=ai_char, ai=True)
+            room_manager.refresh_open_state(room)
             room['p2_selection_complete'] = True; ready_for_controls = True
         elif room['game_mode'] == 'TWO':
             # FIXED: In 2-player mode, always advance to P2 selection after P1 chooses
@@ -974,7 +810,6 @@ def on_player_character_choice(data):
             else:
                 # Player 2 not connected yet, wait at P1 screen showing waiting message
                 # The screen will change to P2 selection when P2 connects
-                print("Waiting for Player 2 to connect...")
                 room['p1_waiting_for_p2'] = True
             
     elif room['current_screen'] == 'CHARACTER_SELECT_P2' and player_data['id'] == 'player2':
@@ -984,156 +819,114 @@ def on_player_character_choice(data):
 
     if ready_for_controls:
         room['current_screen'] = 'CONTROLS'
-        room['state_timer_ms'] = CONTROLS_SCREEN_DURATION_MS
-        print(f"🎯 Setting CONTROLS screen with timer: {CONTROLS_SCREEN_DURATION_MS}ms")  # DEBUG
-    socketio.emit('update_room_state', room, room=game_room_id)
+        room['state_timer_frames'] = CONTROLS_SCREEN_DURATION_FRAMES
+        start_replay(room)
+    broadcast_room_state(room)
 
 @socketio.on('player_actions')
+@instrumented('player_actions')
 def handle_player_actions(data):
-    player_sid = request.sid; room = game_sessions.get(game_room_id)
+    """Hold a client's actions for the next tick (see game_core.apply_room_inputs)"""
+    (binary_actions_received if isinstance(data, (bytes, bytearray)) else json_actions_received).inc()
+    player_sid = request.sid; room = room_manager.room_for_sid(player_sid)
     if not room or player_sid not in room['players'] or room['current_screen'] not in ['PLAYING', 'SPECIAL']: return
-    player = room['players'][player_sid]
-    if player['health'] <= 0 : return
-    actions = data.get('actions', []); action_taken = False
-    
-    # Skip processing actions during knockback
-    if player.get('knockback_timer', 0) > 0:
-        print(f"Player {player['id']} in knockback, ignoring input")
-        return
-    
-    # NEW: Check if there are any movement actions in this frame
-    has_movement_action = any(action.get('type') == 'move' for action in actions)
-    
-    for action_data in actions:
-        action_type = action_data.get('type')
-        if action_type == 'move':
-            if not player['is_attacking'] and not player['is_ducking']:
-                direction = action_data.get('direction')
-                if direction == 'left': player['x'] -= PLAYER_SPEED; player['facing'] = -1
-                elif direction == 'right': player['x'] += PLAYER_SPEED; player['facing'] = 1
-                apply_screen_wrap(player) 
-                if not player['is_jumping']: player['current_animation'] = 'walk'
-                action_taken = True
-        elif action_type == 'jump':
-            if not player['is_jumping'] and not player['is_ducking'] and not player['is_attacking']:
-                player['is_jumping'] = True; player['vertical_velocity'] = PLAYER_JUMP_VELOCITY
-                player['current_animation'] = 'jump'; player['is_ducking'] = False  # FIXED: Explicitly reset ducking
-                action_taken = True
-        elif action_type == 'duck':
-            is_ducking_cmd = action_data.get('active', False)
-            if not player['is_jumping'] and not player['is_attacking']:
-                # FIXED: More explicit ducking state management
-                old_ducking_state = player['is_ducking']
-                player['is_ducking'] = is_ducking_cmd
-                if old_ducking_state != is_ducking_cmd:
-                    player['current_animation'] = 'duck' if is_ducking_cmd else 'idle'
-                    action_taken = True
-                    print(f"Player {player['id']} ducking state changed: {old_ducking_state} -> {is_ducking_cmd}")
-        elif action_type == 'attack':
-            if not player['is_attacking'] and player['cooldown_timer'] == 0 and not player['is_ducking']:
-                player['is_attacking'] = True; player['attack_timer'] = ATTACK_DURATION
-                player['current_animation'] = 'jump_attack' if player['is_jumping'] else 'attack'
-                player['has_hit_this_attack'] = False; player['is_ducking'] = False  # FIXED: Explicitly reset ducking
-                action_taken = True
-    
-    # FIXED: Human player walk animation - reset to idle when no movement input
-    if (not has_movement_action and not player['is_jumping'] and not player['is_attacking'] and 
-        not player['is_ducking'] and player['current_animation'] == 'walk'):
-        player['current_animation'] = 'idle'
-        print(f"HUMAN PLAYER: Reset walk animation to idle for {player['id']}")
-    
-    # IMPROVED: Better animation state management for human player
-    elif not action_taken and not player['is_jumping'] and not player['is_attacking'] and not player['is_ducking']:
-        # Only reset to idle if we're not in a valid animation state
-        if player['current_animation'] not in ['idle', 'walk']:
-            player['current_animation'] = 'idle'
-    
-    # ADDITIONAL SAFETY: Reset animation if state doesn't match
-    if not player['is_ducking'] and player['current_animation'] == 'duck':
-        print(f"SAFETY: Resetting duck animation for {player['id']} (not ducking but animation stuck)")
-        player['current_animation'] = 'idle' if not player['is_jumping'] and not player['is_attacking'] else player['current_animation']
+    if isinstance(data, (bytes, bytearray)):
+        data = wire_protocol.decode_player_actions(data)  # Binary protocol input
+    if not isinstance(data, dict) or not isinstance(data.get('actions'), list): return
+    client_frame = data.get('frame')
+    if not isinstance(client_frame, int): client_frame = None  # Older clients don't stamp frames
+    seen_frame = data.get('room_frame')  # Room frame on screen when the input was made
+    target_frame = seen_frame + 1 if isinstance(seen_frame, int) else None
+    pending_inputs.append((player_sid, client_frame,
+                           [action for action in data['actions'] if isinstance(action, dict)], target_frame))
 
 # IMPROVED: Background change functionality
 @socketio.on('change_background')
+@instrumented('change_background')
 def handle_background_change(data):
-    player_sid = request.sid; room = game_sessions.get(game_room_id)
+    player_sid = request.sid; room = room_manager.room_for_sid(player_sid)
     if not room or player_sid not in room['players']: 
-        print(f"Background change failed: room={room is not None}, player={player_sid in room.get('players', {})}")
         return
     
-    print(f"Background change requested. Current screen: {room['current_screen']}, Special level: {room.get('special_level_active', False)}")
-    
     # FIXED: Allow background change during gameplay, including special level (but in a limited way)
     if room['current_screen'] == 'PLAYING':
         if not room.get('special_level_active', False):
             # Normal gameplay - cycle through Paris backgrounds
-            old_index = room['current_background_index']
             room['current_background_index'] = (room['current_background_index'] + 1) % PARIS_BG_COUNT
-            print(f"Paris background changed from {old_index} to {room['current_background_index']}")
         else:
             # Special level - cycle through Church backgrounds
             current_church_index = room.get('current_background_index', 0)
             new_church_index = (current_church_index + 1) % CHURCH_BG_COUNT
             room['current_background_index'] = new_church_index
             room['current_background_key'] = 'church'  # Ensure it stays church
-            print(f"Special level background changed from {current_church_index} to {new_church_index}")
     elif room['current_screen'] == 'SPECIAL':
         # Also allow background change during special screen state
         current_church_index = room.get('current_background_index', 0)
         new_church_index = (current_church_index + 1) % CHURCH_BG_COUNT
         room['current_background_index'] = new_church_index
         room['current_background_key'] = 'church'  # Ensure it stays church
-        print(f"Special screen background changed from {current_church_index} to {new_church_index}")
     else:
-        print(f"Background change ignored for screen: {room['current_screen']}")
         return
     
-    print(f"Broadcasting background change: {room['current_background_key']} {room['current_background_index']}")
-    socketio.emit('update_room_state', room, room=game_room_id)
+    round_log.debug('background_changed', room=room['id'], background=room['current_background_key'],
+                    background_index=room['current_background_index'])
+    rollback_histories.drop(room['id'])  # A rewind must not undo a change made outside the simulation
+    record_replay_edit(room, room_fields={'current_background_key': room['current_background_key'],
+                                          'current_background_index': room['current_background_index']})
+    broadcast_room_state(room)
+
+last_overrun_report_frame = -TICK_RATE
+
+def report_tick_overrun(kind, detail):
+    """Scheduler callback for late frames; prints at most once per second of frames"""
+    global last_overrun_report_frame
+    if kind == 'step_overrun': tick_overruns.inc()
+    else: dropped_frames.inc(detail['dropped'])
+    if detail['frame'] - last_overrun_report_frame < TICK_RATE:
+        return
+    last_overrun_report_frame = detail['frame']
+    loop_log.warning('tick_overrun', kind=kind, **detail, totals=game_scheduler.stats())
+
+def on_tick_step(step_s):
+    """Scheduler callback after every frame: metrics, and a trace capture when the frame ran over budget"""
+    tick_seconds.observe(step_s)
+    if step_s > TRACE_BUDGET_S and tracing.TRACER.enabled:
+        capture = tracing.TRACER.auto_capture('over_budget', frame=game_scheduler.frame, step_ms=round(step_s * 1000, 3))
+        if capture is not None:
+            loop_log.warning('trace_captured', frame=game_scheduler.frame, step_ms=round(step_s * 1000, 3),
+                             spans=len(capture['spans']))
+
+game_scheduler = FixedTimestepScheduler(tick_all_rooms, tick_rate=TICK_RATE, max_catchup_frames=MAX_CATCHUP_FRAMES,
+                                        sleep=socketio.sleep, on_overrun=report_tick_overrun,
+                                        on_step=on_tick_step)
 
 def game_loop_task():
-    global last_broadcast_time
-    print("🚀 GAME LOOP TASK STARTING!")
-    print("🚀 GAME LOOP TASK STARTING!")  # Double print to make it obvious
-    loop_count = 0
+    loop_log.info('game_loop_started', tick_rate=TICK_RATE)
+    last_report_second = 0
     
     try:
         while True:
             try:
-                loop_count += 1
-                room = game_sessions.get(game_room_id)
-                
-                # Debug: Print every 60 loops (about once per second)
-                if loop_count % 60 == 0:
-                    if room:
-                        print(f"🎮 Loop {loop_count}: Screen={room.get('current_screen', 'UNKNOWN')}, Timer={room.get('state_timer_ms', 0):.1f}, Players={len(room.get('players', {}))}")
-                    else:
-                        print(f"🎮 Loop {loop_count}: NO ROOM FOUND!")
+                game_scheduler.run_pending()
                 
-                if room: 
-                    current_time = time.time()
-                    # Only broadcast at 60 FPS max
-                    if current_time - last_broadcast_time >= BROADCAST_INTERVAL:
-                        try:
-                            game_tick(room)
-                            last_broadcast_time = current_time
-                        except Exception as tick_error:
-                            print(f"❌ ERROR in game_tick: {tick_error}")
-                            import traceback
-                            traceback.print_exc()
+                # Once per second of simulated frames
+                if game_scheduler.frame // TICK_RATE != last_report_second:
+                    last_report_second = game_scheduler.frame // TICK_RATE
+                    if loop_log.enabled_for(game_log.DEBUG):
+                        loop_log.debug('loop_stats', **room_manager.stats(), **game_scheduler.stats())
                 
-                socketio.sleep(1 / 120)  # Sleep for half the target FPS
+                delay_s = game_scheduler.time_until_next_frame()
+                due = time.perf_counter() + delay_s
+                socketio.sleep(delay_s)
+                loop_lag_seconds.observe(time.perf_counter() - due)
                 
             except Exception as loop_error:
-                print(f"❌ ERROR in game loop: {loop_error}")
-                import traceback
-                traceback.print_exc()
+                loop_errors.labels('game_loop').inc()
+                loop_log.exception('game_loop_error', error=str(loop_error))
                 socketio.sleep(1)  # Wait before retrying
                 
     except Exception as fatal_error:
-        print(f"💀 FATAL ERROR in game_loop_task: {fatal_error}")
-        import traceback
-        traceback.print_exc()
+        loop_log.exception('game_loop_fatal', error=str(fatal_error))
 
 # Global flag to track if game loop is running
 game_loop_started = False
@@ -1142,43 +935,34 @@ def start_game_loop():
     """Start the game loop background task"""
     global game_loop_started
     if game_loop_started:
-        print("🔄 Game loop already started, skipping...")
         return True
         
     try:
-        print("🎬 Attempting to start background task...")
         socketio.start_background_task(target=game_loop_task)
         game_loop_started = True
-        print("✅ Background task started successfully!")
         return True
     except Exception as task_error:
-        print(f"❌ FAILED to start background task: {task_error}")
-        import traceback
-        traceback.print_exc()
+        loop_log.exception('game_loop_start_failed', error=str(task_error))
         return False
 
 # Production configuration
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    print(f"Server starting on port {port}...")
+    loop_log.info('server_starting', port=port)
     
-    # AGGRESSIVE: Try to start the game loop multiple times
-    print("🚀 AGGRESSIVE: Attempting to start game loop background task multiple ways...")
+    if sim_inputs is not None:
+        socketio.start_background_task(target=sim_inputs.run)  # Client events relayed by the I/O processes
     
+    # AGGRESSIVE: Try to start the game loop multiple times
     # Method 1: Start before server
-    print("Method 1: Starting before server...")
     start_game_loop()
     
     # Method 2: Start after a delay
     def delayed_start():
         import time
         time.sleep(2)  # Wait for server to be ready
-        print("Method 2: Delayed start...")
         start_game_loop()
     
-    # Start the server
-    print("🎯 Starting SocketIO server...")
-    
     # Start the delayed task
     import threading
     delayed_thread = threading.Thread(target=delayed_start)
@@ -0,0 +1,126 @@
+# Kylander: The Reckoning - Asset Tiers
+# The manifest the client loads progressively from, built once at startup by
+# scanning static/assets. Every asset is put in the tier of the first screen
+# that draws or plays it; each screen lists the tiers it needs. The client
+# waits only for those (the title screen's tier is a few hundred KB, not the
+# whole game) and prefetches the next tier in the background while the
+# player is on this one. Each entry gives the URL to fetch (the content-hashed
+# build from build_assets.py when there is one), its size and hash; a sprite
+# frame gives its rectangle in the fighter's atlas instead, and a sound effect
+# its offset in the audio sprite.
+#
+# Served at /assets/manifest and inlined into the page, which saves the client
+# a round trip before it can start loading.
+
+import fnmatch
+import hashlib
+import json
+import os
+
+from flask import request
+
+import game_log
+
+TIERS = ('TITLE', 'CHARACTER_SELECT', 'PLAYING', 'SPECIAL', 'SLIDESHOW')   # Load order
+
+# First match wins; paths are relative to static/. Anything unmatched is loaded with the PLAYING tier.
+TIER_RULES = (
+    ('assets/ui/title_screen.*', 'TITLE'),
+    ('assets/music/background_music.*', 'TITLE'),
+    ('assets/fonts/*', 'TITLE'),
+    ('assets/ui/characterselect.*', 'CHARACTER_SELECT'),
+    ('assets/backgrounds/church_bg*', 'SPECIAL'),
+    ('assets/ui/church*', 'SPECIAL'),
+    ('assets/ui/GameOver.*', 'SPECIAL'),
+    ('assets/sfx/Darius*', 'SPECIAL'),
+    ('assets/backgrounds/slideshow_*', 'SLIDESHOW'),
+    ('assets/music/background_music2.*', 'SLIDESHOW'),
+)
+DEFAULT_TIER = 'PLAYING'
+
+# current_screen -> tiers it draws from (the SPECIAL level still draws the fighters)
+SCREEN_TIERS = {
+    'TITLE': ['TITLE'], 'MODE_SELECT': ['TITLE'],
+    'CHARACTER_SELECT_P1': ['CHARACTER_SELECT'], 'CHARACTER_SELECT_P2': ['CHARACTER_SELECT'],
+    'CONTROLS': ['CHARACTER_SELECT'],
+    'PLAYING': ['PLAYING'], 'VICTORY': ['PLAYING'], 'FINAL': ['PLAYING'],
+    'CHURCH_INTRO': ['SPECIAL'], 'SPECIAL': ['PLAYING', 'SPECIAL'], 'SPECIAL_END': ['PLAYING', 'SPECIAL'],
+    'CHURCH_VICTORY': ['SPECIAL'], 'CHURCH_VICTORY_IMMEDIATE': ['SPECIAL'], 'GAME_OVER': ['SPECIAL'],
+    'SLIDESHOW': ['SLIDESHOW'], 'SLIDESHOW_TO_TITLE': ['SLIDESHOW'],
+}
+HASH_LENGTH = 10
+SCAN_DIR = 'assets'
+
+asset_log = game_log.get_logger('assets')
+
+
+def tier_of(rel_path):
+    for pattern, tier in TIER_RULES:
+        if fnmatch.fnmatchcase(rel_path, pattern):
+            return tier
+    return DEFAULT_TIER
+
+
+def _file_info(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return {'size': len(data), 'hash': hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}
+
+
+def build_manifest(static_dir, build=None):
+    """The tiered manifest for static_dir/assets; `build` is build_assets' manifest, when the tree is built"""
+    build = build or {}
+    files = build.get('files', {})
+    # Sprite frames and sound effects are cut from a shared file: (parts, shared file URLs, entry key, owner key, section)
+    packed = ((build.get('frames', {}), build.get('atlases', {}), 'frame', 'atlas', 'atlases'),
+              (build.get('sounds', {}), build.get('audio_sprites', {}), 'sound', 'sprite', 'audio_sprites'))
+    assets, shared = {}, {'atlases': {}, 'audio_sprites': {}}
+    tier_bytes = dict.fromkeys(TIERS, 0)
+    for directory, subdirs, names in os.walk(os.path.join(static_dir, SCAN_DIR)):
+        subdirs.sort()
+        for name in sorted(names):
+            if name.startswith('.'):
+                continue
+            rel_path = os.path.relpath(os.path.join(directory, name), static_dir).replace(os.sep, '/')
+            tier = tier_of(rel_path)
+            for parts, urls, part_key, owner_key, section in packed:
+                part = parts.get(rel_path)
+                if part is None:
+                    continue
+                owners = shared[section]
+                owner = owners.get(part[owner_key])
+                if owner is None:
+                    url = urls[part[owner_key]]
+                    owner = owners[part[owner_key]] = dict(_file_info(os.path.join(static_dir, url)), url=url, tier=tier)
+                elif TIERS.index(tier) < TIERS.index(owner['tier']):
+                    owner['tier'] = tier   # Downloaded once, with the earliest tier that uses it
+                assets[rel_path] = {'tier': tier, part_key: part, 'size': 0, 'hash': owner['hash']}
+                break
+            else:
+                url = files.get(rel_path, rel_path)
+                entry = assets[rel_path] = dict(_file_info(os.path.join(static_dir, url)), url=url, tier=tier)
+                tier_bytes[tier] += entry['size']
+    for owners in shared.values():
+        for owner in owners.values():
+            tier_bytes[owner['tier']] += owner['size']
+    body = dict(shared, tiers=list(TIERS), screens=SCREEN_TIERS, assets=assets, tier_bytes=tier_bytes)
+    body['version'] = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+    return body
+
+
+def install(app, build=None):
+    """Build the manifest for app's static folder, serve it at /assets/manifest and inline it into templates"""
+    manifest = build_manifest(app.static_folder, build)
+    body = json.dumps(manifest, separators=(',', ':'))
+    asset_log.info('asset_tiers_built', assets=len(manifest['assets']), version=manifest['version'],
+                   tier_bytes=manifest['tier_bytes'])
+
+    def asset_manifest_view():
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(manifest['version'])
+        response.cache_control.no_cache = True   # Changes with every deploy; revalidating is a 304
+        return response.make_conditional(request)
+
+    app.add_url_rule('/assets/manifest', 'asset_manifest', asset_manifest_view)
+    app.add_template_global(manifest, 'asset_manifest')
+    return manifest
@@ -0,0 +1,325 @@
+# Kylander: The Reckoning - Benchmarks
+# Drives scripted scenarios through the simulation core (no server, no
+# network) and reports ticks per second, tick latency, snapshot sizes and
+# allocations per tick. Results are compared with bench_baseline.json so a
+# balance patch or refactor that costs capacity shows up as a regression.
+#
+#   python bench.py                   run every scenario, compare with the baseline
+#   python bench.py clash crowd       run some scenarios
+#   python bench.py --save-baseline   record this machine's results as the new baseline
+#
+# Timings depend on the machine: record the baseline on the machine you
+# compare on. Sizes and allocations do not, but they are averages over the
+# frames run (a scenario's opening frames are not typical), so they are only
+# compared when the frame counts and scenario parameters match the baseline's.
+# Re-record the baseline with any change that alters what goes on the wire.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import game_core
+import game_log
+import wire_protocol
+from room_random import RoomRandom
+from snapshots import SnapshotChannel
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+WARMUP_FRAMES = 60
+TIMED_FRAMES = 1200
+ALLOC_FRAMES = 200       # Frames traced for allocations (tracing slows ticks, so it is a separate pass)
+CROWD_ROOMS = 200
+REPEAT = 3               # Fresh runs per scenario; timings keep the best (least disturbed) run
+
+# metric -> (which way is better, fraction it may get worse before it counts as a regression)
+THRESHOLDS = {
+    'ticks_per_s': ('higher', 0.20),
+    'p50_us': ('lower', 0.30),
+    'p99_us': ('lower', 0.50),
+    'encode_us': ('lower', 0.30),
+    'snapshot_bytes': ('lower', 0.05),
+    'keyframe_bytes': ('lower', 0.05),
+    'binary_bytes': ('lower', 0.05),
+    'alloc_kib': ('lower', 0.25),
+}
+# Averages that depend on how many frames ran (and of what) rather than on the machine
+FRAME_DEPENDENT = {'snapshot_bytes', 'keyframe_bytes', 'binary_bytes', 'alloc_kib'}
+
+SCRIPTED_ACTIONS = [[], [{'type': 'move', 'direction': 'left'}], [{'type': 'move', 'direction': 'right'}],
+                    [{'type': 'jump'}], [{'type': 'attack'}], [{'type': 'duck', 'active': True}],
+                    [{'type': 'duck', 'active': False}],
+                    [{'type': 'move', 'direction': 'right'}, {'type': 'attack'}]]
+
+
+# --- Scenarios ---
+# Each builds its rooms and returns (rooms, script); script(frame) returns the
+# input for the coming tick as (sid, client frame, actions, target frame).
+
+def screen_room(room_id, screen, **fields):
+    room_state = game_core.get_default_room_state(room_id)
+    room_state.update(current_screen=screen, **fields)
+    game_core.seed_room(room_id, 1)
+    return room_state
+
+def slideshow_room(room_id):
+    return screen_room(room_id, 'SLIDESHOW', current_background_key='slideshow', current_background_index=0,
+                       state_timer_frames=game_core.SLIDESHOW_DURATION_FRAMES, slideshow_music_started=True)
+
+def no_input(frame):
+    return ()
+
+def scenario_title():
+    return [screen_room('title', 'TITLE')], no_input
+
+def scenario_slideshow():
+    return [slideshow_room('slideshow')], no_input
+
+def scenario_clash():
+    """Two humans walking into each other swinging every frame; health is topped up so the round never ends"""
+    room_state = game_core.new_match_room('clash', 'The Kylander', 'The Potzer', seed=1)
+    p1 = game_core.get_player_by_id(room_state, 'player1'); p2 = game_core.get_player_by_id(room_state, 'player2')
+    p1['x'] = 350; p2['x'] = 450
+    def script(frame):
+        p1['health'] = p2['health'] = 100
+        toward_p2 = 'right' if p1['x'] < p2['x'] else 'left'
+        toward_p1 = 'left' if toward_p2 == 'right' else 'right'
+        return [('p1', None, [{'type': 'move', 'direction': toward_p2}, {'type': 'attack'}], None),
+                ('p2', None, [{'type': 'move', 'direction': toward_p1}, {'type': 'attack'}], None)]
+    return [room_state], script
+
+def scenario_special_ai():
+    """The special level against the AI, the human playing Darichris"""
+    room_state = game_core.new_match_room('special', 'The Kylander', 'The Potzer', ai_opponent=True, seed=1)
+    room_state.update({'special_level_active': True, 'special_swap_target_player_id': 'player1',
+                       'match_score_p2': game_core.SPECIAL_LEVEL_WINS})
+    game_core.initialize_round(room_state)
+    rng = RoomRandom(2)
+    def script(frame):
+        return [('p1', None, rng.choice(SCRIPTED_ACTIONS), None)]
+    return [room_state], script
+
+def scenario_crowd(room_count=CROWD_ROOMS):
+    """Many rooms at once: half AI matches, a third two-player matches with random input, the rest on menus"""
+    rooms = []; humans = []
+    for i in range(room_count):
+        room_id = f'crowd{i}'; kind = i % 10
+        if kind < 5:
+            rooms.append(game_core.new_match_room(room_id, 'The Kylander', 'The Potzer', ai_opponent=True,
+                                                  seed=i, sids=(f'{room_id}:p1', None)))
+            humans.append(f'{room_id}:p1')
+        elif kind < 8:
+            sids = (f'{room_id}:p1', f'{room_id}:p2')
+            rooms.append(game_core.new_match_room(room_id, 'The Kylander', 'Darichris', seed=i, sids=sids))
+            humans.extend(sids)
+        elif kind == 8:
+            rooms.append(screen_room(room_id, 'TITLE'))
+        else:
+            rooms.append(slideshow_room(room_id))
+    rng = RoomRandom(3)
+    def script(frame):
+        return [(sid, None, rng.choice(SCRIPTED_ACTIONS), None) for sid in humans if rng.random() < 0.3]
+    return rooms, script
+
+SCENARIOS = {
+    'title': scenario_title,
+    'slideshow': scenario_slideshow,
+    'clash': scenario_clash,
+    'special_ai': scenario_special_ai,
+    'crowd': scenario_crowd,
+}
+
+
+def release_rooms(rooms):
+    for room_state in rooms:
+        for sid in room_state['players']: game_core.input_buffer.remove(sid)
+        game_core.release_room_players(room_state)
+        game_core.forget_room(room_state['id'])
+
+
+# --- Measurement ---
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class SnapshotMeter:
+    """Encodes what the server would send each tick (one acking client per room): sizes and encode time"""
+
+    def __init__(self):
+        self.json_channels = {}; self.binary_channels = {}
+        self.delta_bytes = self.keyframe_bytes = self.binary_bytes = 0
+        self.messages = self.keyframes = self.encode_ns = 0
+
+    def channels_for(self, room_id):
+        channel = self.json_channels.get(room_id)
+        if channel is None:
+            channel = self.json_channels[room_id] = SnapshotChannel()
+            self.binary_channels[room_id] = SnapshotChannel(exclude_room_keys=wire_protocol.HOT_ROOM_KEYS,
+                                                            exclude_player_keys=wire_protocol.HOT_PLAYER_KEYS)
+            channel.add_client('bench'); self.binary_channels[room_id].add_client('bench')
+        return channel, self.binary_channels[room_id]
+
+    def encode(self, room_state):
+        start = time.perf_counter_ns()
+        channel, binary_channel = self.channels_for(room_state['id'])
+        for payload, _ in channel.publish(room_state):
+            size = len(json.dumps(payload))
+            if payload['base'] is None: self.keyframe_bytes += size; self.keyframes += 1
+            else: self.delta_bytes += size
+            channel.ack('bench', payload['seq'])
+        cold = binary_channel.publish(room_state)
+        cold_payload = cold[0][0] if cold else None
+        if cold_payload is not None: binary_channel.ack('bench', cold_payload['seq'])
+        self.binary_bytes += len(wire_protocol.encode_room_message(
+            room_state['frame'], wire_protocol.encode_hot_state(room_state), cold_payload))
+        self.encode_ns += time.perf_counter_ns() - start
+        self.messages += 1
+
+    def results(self):
+        deltas = self.messages - self.keyframes
+        return {
+            'snapshot_bytes': round(self.delta_bytes / max(1, deltas), 1),
+            'keyframe_bytes': round(self.keyframe_bytes / max(1, self.keyframes), 1),
+            'binary_bytes': round(self.binary_bytes / max(1, self.messages), 1),
+            'encode_us': round(self.encode_ns / 1000 / max(1, self.messages), 2),
+        }
+
+def measure_ticks(rooms, script, frames, meter=None):
+    """Tick latencies in microseconds; `meter` encodes the rooms each tick said to send (outside the timing)"""
+    durations = []
+    for frame in range(frames):
+        inputs = script(frame)
+        start = time.perf_counter_ns()
+        rooms_to_send, _ = game_core.tick_rooms(rooms, inputs)
+        durations.append((time.perf_counter_ns() - start) / 1000)
+        if meter is not None:
+            for room_state in rooms_to_send: meter.encode(room_state)
+    return durations
+
+def measure_allocations(rooms, script, frames):
+    """Peak traced memory a tick allocates above what was live before it (KiB), and blocks it leaves behind"""
+    peaks = [0] * frames  # Preallocated so the measurement itself does not count as retained
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    try:
+        for frame in range(frames):
+            inputs = script(frame)
+            tracemalloc.reset_peak()
+            live = tracemalloc.get_traced_memory()[0]
+            game_core.tick_rooms(rooms, inputs)
+            peaks[frame] = tracemalloc.get_traced_memory()[1] - live
+    finally:
+        tracemalloc.stop()
+    return {'alloc_kib': round(sum(peaks) / len(peaks) / 1024, 2),
+            'retained_blocks': round((sys.getallocatedblocks() - blocks_before) / frames, 2)}
+
+def run_scenario(name, frames=TIMED_FRAMES, alloc_frames=ALLOC_FRAMES, repeat=REPEAT):
+    """Metrics for one scenario; timings are the best of `repeat` fresh runs (sizes are the same every run)"""
+    best = None
+    for run in range(repeat):
+        rooms, script = SCENARIOS[name]()
+        try:
+            measure_ticks(rooms, script, WARMUP_FRAMES)
+            meter = SnapshotMeter()
+            ordered = sorted(measure_ticks(rooms, script, frames, meter))
+            if run == repeat - 1:
+                allocations = measure_allocations(rooms, script, alloc_frames)
+        finally:
+            release_rooms(rooms)
+        metrics = {
+            'rooms': len(rooms),
+            'ticks_per_s': round(len(ordered) / (sum(ordered) / 1e6), 1),
+            'p50_us': round(percentile(ordered, 0.50), 1),
+            'p99_us': round(percentile(ordered, 0.99), 1),
+            **meter.results(),
+        }
+        if best is None:
+            best = metrics
+        else:
+            best['ticks_per_s'] = max(best['ticks_per_s'], metrics['ticks_per_s'])
+            for metric in ('p50_us', 'p99_us', 'encode_us'): best[metric] = min(best[metric], metrics[metric])
+    return {**best, **allocations}
+
+
+# --- Baseline ---
+
+def parameters(frames, alloc_frames):
+    """What a run's frame-dependent averages depend on; recorded with the baseline"""
+    return {'frames': frames, 'alloc_frames': alloc_frames, 'warmup_frames': WARMUP_FRAMES, 'crowd_rooms': CROWD_ROOMS}
+
+def compare(results, baseline, run_parameters=None):
+    """[(scenario, metric, baseline value, current value, change)] for every metric past its threshold.
+
+    Sizes and allocations are skipped unless run_parameters match the baseline's."""
+    regressions = []
+    same_run = run_parameters is not None and baseline.get('parameters') == run_parameters
+    for name, metrics in results.items():
+        base_metrics = baseline.get('scenarios', {}).get(name)
+        if not base_metrics: continue
+        for metric, (better, tolerance) in THRESHOLDS.items():
+            if metric in FRAME_DEPENDENT and not same_run: continue
+            base = base_metrics.get(metric); current = metrics.get(metric)
+            if not base or current is None: continue
+            change = (current - base) / base
+            if (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance):
+                regressions.append((name, metric, base, current, change))
+    return regressions
+
+def machine_info():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()}
+
+def print_results(results):
+    columns = ['rooms', 'ticks_per_s', 'p50_us', 'p99_us', 'encode_us', 'snapshot_bytes', 'keyframe_bytes',
+               'binary_bytes', 'alloc_kib', 'retained_blocks']
+    print(f"{'scenario':<12}" + ''.join(f'{column:>16}' for column in columns))
+    for name, metrics in results.items():
+        print(f'{name:<12}' + ''.join(f'{metrics[column]:>16}' for column in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation core without a server')
+    parser.add_argument('scenarios', nargs='*', help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--frames', type=int, default=TIMED_FRAMES, help='timed frames per scenario')
+    parser.add_argument('--alloc-frames', type=int, default=ALLOC_FRAMES, help='frames traced for allocations')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per scenario (timings keep the best)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown: parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    # Round events would otherwise be written, and timed, every round
+    game_log.configure(os.environ.get('KYLANDER_LOG_LEVEL', 'WARNING'))
+    run_parameters = parameters(args.frames, args.alloc_frames)
+    results = {name: run_scenario(name, args.frames, args.alloc_frames, args.repeat)
+               for name in (args.scenarios or SCENARIOS)}
+    if args.json: print(json.dumps(results, indent=2))
+    else: print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': machine_info(), 'parameters': run_parameters, 'scenarios': results}, f, indent=2)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline to compare with (run with --save-baseline)')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('machine') != machine_info():
+        print(f"baseline was recorded on {baseline.get('machine')}; timings may not be comparable")
+    if baseline.get('parameters') != run_parameters:
+        print(f"baseline was recorded with {baseline.get('parameters')}, this run with {run_parameters}; "
+              f"only timings are compared")
+    regressions = compare(results, baseline, run_parameters)
+    for name, metric, base, current, change in regressions:
+        print(f'REGRESSION {name}.{metric}: {base} -> {current} ({change:+.0%})')
+    if not regressions: print('no regressions against the baseline')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# Kylander: The Reckoning - Asset Build
+# Turns static/ into what the client should actually download, in static/build/:
+#   - each fighter's sprite frames packed into one atlas (one request per
+#     fighter instead of nine), with every frame's rectangle in the manifest;
+#   - every sound effect packed into one MP3 audio sprite, with each sound's
+#     offset and length in the manifest, so the client decodes one buffer and
+#     plays any sound from it with Web Audio;
+#   - full-screen backgrounds and UI art re-encoded as WebP at the game's
+#     800x600 (the client stretches them to that size anyway);
+#   - everything else (sounds, the script, the stylesheet) copied as is, the
+#     stylesheet's url()s pointed at the built files;
+#   - every file named after a hash of its contents, so it can be cached forever,
+#     and text-like ones (script, stylesheet, font, WAVs) also written gzipped
+#     and, with the brotli package installed, brotli-compressed.
+# manifest.json maps each source path (relative to static/) to its built file.
+# The page template resolves its URLs through it, and asset_tiers.py gives
+# game.js the built URLs; a tree without a build keeps serving the source files.
+#
+#   python build_assets.py                # static/ -> static/build/
+#   python build_assets.py --quality 75
+
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+import game_log
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+BUILD_DIR_NAME = 'build'
+MANIFEST_NAME = 'manifest.json'
+GAME_SIZE = (800, 600)       # Canvas size in game.js; full-screen art is never drawn larger
+ATLAS_DIRS = ('assets/sprites',)   # Each subdirectory of these becomes one atlas
+ATLAS_MAX_WIDTH = 2048
+ATLAS_PADDING = 2
+SPRITE_DIRS = ('assets/sfx',)       # Each of these becomes one audio sprite
+SPRITE_RATE = 44100
+SPRITE_BITRATE = 80                 # kbit/s, mono
+SPRITE_GAP_S = 0.25                 # Silence around every sound
+# LAME's encoder delay plus the MP3 decoder's; no gapless header is written, so every decoder outputs it
+MP3_DELAY_SAMPLES = 576 + 529
+WEBP_QUALITY = 80
+HASH_LENGTH = 10
+SKIP_NAMES = {'.DS_Store', 'Thumbs.db'}
+# Precompressed next to the built file (static_files.py serves them); kept only when they save enough
+COMPRESSIBLE = ('.js', '.css', '.json', '.svg', '.html', '.ttf', '.otf', '.wav')
+MIN_COMPRESSION_SAVING = 0.1
+CSS_URL = re.compile(r"""url\((['"]?)([^'")]+)\1\)""")
+
+asset_log = game_log.get_logger('assets')
+
+
+def content_name(rel_path, data, extension=None):
+    """`dir/name.<hash>.ext` for the built copy of `rel_path`"""
+    stem, ext = os.path.splitext(rel_path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension or ext}"
+
+
+def _image_bytes(image, **save_args):
+    out = io.BytesIO()
+    image.save(out, **save_args)
+    return out.getvalue()
+
+
+def pack_shelves(sizes, max_width=ATLAS_MAX_WIDTH, padding=ATLAS_PADDING):
+    """Positions for rectangles packed into rows, tallest first; returns ([(x, y)], atlas width, atlas height)"""
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    positions = [None] * len(sizes)
+    x = y = row_height = width = 0
+    for i in order:
+        w, h = sizes[i]
+        if x and x + w > max_width:
+            y += row_height + padding; x = row_height = 0
+        positions[i] = (x, y)
+        x += w + padding
+        row_height = max(row_height, h); width = max(width, x - padding)
+    return positions, width, y + row_height
+
+
+def build_atlas(static_dir, atlas_dir, frame_paths):
+    """(atlas bytes, {frame path: rectangle}) for the frames of one atlas directory"""
+    from PIL import Image
+    frames = [Image.open(os.path.join(static_dir, path)).convert('RGBA') for path in frame_paths]
+    positions, width, height = pack_shelves([frame.size for frame in frames])
+    atlas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    rects = {}
+    for path, frame, (x, y) in zip(frame_paths, frames, positions):
+        atlas.paste(frame, (x, y))
+        rects[path] = {'atlas': atlas_dir, 'x': x, 'y': y, 'w': frame.width, 'h': frame.height}
+    # Lossless: sprite edges and colours stay exactly as drawn
+    return _image_bytes(atlas, format='WEBP', lossless=True, method=6), rects
+
+
+def build_audio_sprite(static_dir, sprite_dir, sound_paths):
+    """(MP3 bytes, {sound path: offset entry}) for the sounds of one sprite directory.
+
+    A sound's sprite id is its file name without the extension; start and
+    duration are seconds into the decoded sprite."""
+    import lameenc
+    import miniaudio
+    gap = b'\0\0' * int(SPRITE_GAP_S * SPRITE_RATE)
+    pcm = [gap]
+    position = len(gap) // 2   # Samples
+    sounds = {}
+    for path in sound_paths:
+        decoded = miniaudio.decode_file(os.path.join(static_dir, path), output_format=miniaudio.SampleFormat.SIGNED16,
+                                        nchannels=1, sample_rate=SPRITE_RATE)
+        samples = len(decoded.samples)
+        sounds[path] = {'sprite': sprite_dir, 'id': os.path.splitext(os.path.basename(path))[0],
+                        'start': round((position + MP3_DELAY_SAMPLES) / SPRITE_RATE, 6),
+                        'duration': round(samples / SPRITE_RATE, 6)}
+        pcm += [decoded.samples.tobytes(), gap]
+        position += samples + len(gap) // 2
+    encoder = lameenc.Encoder()
+    encoder.set_in_sample_rate(SPRITE_RATE); encoder.set_channels(1)
+    encoder.set_bit_rate(SPRITE_BITRATE); encoder.set_quality(2)
+    return bytes(encoder.encode(b''.join(pcm)) + encoder.flush()), sounds
+
+
+def encode_image(path, quality=WEBP_QUALITY):
+    """WebP bytes for one image; anything larger than the game canvas is resized to it"""
+    from PIL import Image
+    image = Image.open(path)
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    if image.width > GAME_SIZE[0] or image.height > GAME_SIZE[1]:
+        image = image.resize(GAME_SIZE, Image.LANCZOS)
+    return _image_bytes(image, format='WEBP', quality=quality, method=6)
+
+
+def precompressed(data):
+    """[(suffix, bytes)] of the compressed variants worth keeping; brotli when it is installed"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, packed) for suffix, packed in variants if len(packed) <= len(data) * (1 - MIN_COMPRESSION_SAVING)]
+
+
+def rewrite_css(text, rel_path, files):
+    """Stylesheet text with its url()s pointing at the built files (built CSS lands in the same layout under build/)"""
+    base = posixpath.dirname(rel_path)
+
+    def built(match):
+        target = files.get(posixpath.normpath(posixpath.join(base, match.group(2))))
+        if target is None:
+            return match.group(0)   # Absolute, external or missing: left alone
+        return f"url({match.group(1)}{posixpath.relpath(target, posixpath.dirname(BUILD_DIR_NAME + '/' + rel_path))}{match.group(1)})"
+    return CSS_URL.sub(built, text)
+
+
+def _source_files(static_dir):
+    for directory, subdirs, names in os.walk(static_dir):
+        subdirs[:] = sorted(d for d in subdirs if not (directory == static_dir and d == BUILD_DIR_NAME))
+        for name in sorted(names):
+            if name not in SKIP_NAMES:
+                yield os.path.relpath(os.path.join(directory, name), static_dir).replace(os.sep, '/')
+
+
+def build(static_dir=STATIC_DIR, quality=WEBP_QUALITY):
+    """Rebuild static_dir/build from static_dir; returns the manifest"""
+    out_dir = os.path.join(static_dir, BUILD_DIR_NAME)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    manifest = {'files': {}, 'frames': {}, 'atlases': {}, 'sounds': {}, 'audio_sprites': {},
+                'bytes': {'source': 0, 'built': 0, 'precompressed': 0}}
+
+    def emit(rel_path, data, extension=None):
+        built = BUILD_DIR_NAME + '/' + content_name(rel_path, data, extension)
+        out_path = os.path.join(static_dir, built)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+        manifest['bytes']['built'] += len(data)
+        if built.lower().endswith(COMPRESSIBLE):
+            for suffix, packed in precompressed(data):
+                with open(out_path + suffix, 'wb') as f:
+                    f.write(packed)
+                manifest['bytes']['precompressed'] += len(packed)
+        return built
+
+    atlas_frames = {}   # atlas directory -> frame paths
+    sprite_sounds = {}  # audio sprite directory -> sound paths
+    if importlib.util.find_spec('lameenc') and importlib.util.find_spec('miniaudio'):
+        sprite_dirs = SPRITE_DIRS
+    else:
+        asset_log.warning('audio_sprites_skipped', reason='the miniaudio and lameenc packages are not installed')
+        sprite_dirs = ()
+    stylesheets = []    # Built last, once what they refer to has its final name
+    for rel_path in _source_files(static_dir):
+        manifest['bytes']['source'] += os.path.getsize(os.path.join(static_dir, rel_path))
+        directory = os.path.dirname(rel_path)
+        if rel_path.endswith('.png') and os.path.dirname(directory) in ATLAS_DIRS:
+            atlas_frames.setdefault(directory, []).append(rel_path)
+        elif directory in sprite_dirs:
+            sprite_sounds.setdefault(directory, []).append(rel_path)
+        elif rel_path.endswith('.css'):
+            stylesheets.append(rel_path)
+        elif rel_path.endswith('.png'):
+            manifest['files'][rel_path] = emit(rel_path, encode_image(os.path.join(static_dir, rel_path), quality), '.webp')
+        else:
+            with open(os.path.join(static_dir, rel_path), 'rb') as f:
+                manifest['files'][rel_path] = emit(rel_path, f.read())
+    for atlas_dir, frame_paths in atlas_frames.items():
+        data, rects = build_atlas(static_dir, atlas_dir, frame_paths)
+        manifest['atlases'][atlas_dir] = emit(atlas_dir + '.webp', data)
+        manifest['frames'].update(rects)
+    for sprite_dir, sound_paths in sprite_sounds.items():
+        data, sounds = build_audio_sprite(static_dir, sprite_dir, sound_paths)
+        manifest['audio_sprites'][sprite_dir] = emit(sprite_dir + '.mp3', data)
+        manifest['sounds'].update(sounds)
+    for rel_path in stylesheets:
+        with open(os.path.join(static_dir, rel_path), encoding='utf-8') as f:
+            text = rewrite_css(f.read(), rel_path, manifest['files'])
+        manifest['files'][rel_path] = emit(rel_path, text.encode('utf-8'))
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+# --- Serving side ---
+
+def load_manifest(static_dir=STATIC_DIR):
+    """The manifest of the last build, or None when the tree hasn't been built"""
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR_NAME, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        asset_log.error('manifest_unreadable', error=str(e))
+        return None
+    asset_log.info('manifest_loaded', files=len(manifest['files']), atlases=len(manifest['atlases']),
+                   frames=len(manifest['frames']), sounds=len(manifest.get('sounds', ())))
+    return manifest
+
+
+def install(app, static_dir=STATIC_DIR):
+    """Give app's templates asset_url(); returns the manifest (None without a build)"""
+    from flask import url_for
+    manifest = load_manifest(static_dir)
+    files = manifest['files'] if manifest else {}
+
+    def asset_url(filename):
+        return url_for('static', filename=files.get(filename, filename))
+
+    app.add_template_global(asset_url)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build sprite atlases, compressed backgrounds and content-hashed assets')
+    parser.add_argument('--static', default=STATIC_DIR, help='static directory to build (default: %(default)s)')
+    parser.add_argument('--quality', type=int, default=WEBP_QUALITY, help='WebP quality of backgrounds and UI art')
+    args = parser.parse_args(argv)
+    game_log.configure(os.environ.get('KYLANDER_LOG_LEVEL', 'WARNING'))
+
+    if importlib.util.find_spec('PIL') is None:
+        print('build_assets needs Pillow (pip install Pillow)', file=sys.stderr)
+        return 1
+    manifest = build(args.static, args.quality)
+    sizes = manifest['bytes']
+    print(f"{len(manifest['files'])} files, {len(manifest['atlases'])} atlases ({len(manifest['frames'])} frames), "
+          f"{len(manifest['audio_sprites'])} audio sprites ({len(manifest['sounds'])} sounds): "
+          f"{sizes['source'] / 1e6:.1f} MB -> {sizes['built'] / 1e6:.1f} MB "
+          f"(+{sizes['precompressed'] / 1e6:.1f} MB precompressed) in "
+          f"{os.path.join(args.static, BUILD_DIR_NAME)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
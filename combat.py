@@ -0,0 +1,109 @@
+# Kylander: The Reckoning - Batched Combat Resolution
+# Resolves missed swings, sword clashes, duck/jump evasion and hits for every
+# active match in one vectorized pass over the player store. Column effects
+# (flags, health, knockback) are applied here; the per-room consequences
+# (sounds, knockouts, round victory) are left to the caller via the outcomes.
+
+from collections import namedtuple
+
+import numpy as np
+
+from player_store import (X, Y, VERTICAL_VELOCITY, HEALTH, FACING, ATTACK_TIMER, COOLDOWN_TIMER,
+                          KNOCKBACK_TIMER, IS_ATTACKING, IS_DUCKING, IS_JUMPING, HAS_HIT_THIS_ATTACK,
+                          MISS_SWING)
+
+# --- Geometry (sprites are centered horizontally and bottom-aligned) ---
+SPRITE_CENTER_OFFSET_Y = 25
+CLASH_DETECTION_RANGE = 110     # Horizontal distance between centers for a sword clash
+VERTICAL_CLASH_TOLERANCE = 80   # Vertical distance allowed for clashes and hits
+ATTACK_RANGE_EXTENSION = 50     # Attack point distance in front of the attacker's center
+HIT_BOX_WIDTH = 45              # Attack point must land this close to the defender's center
+
+# --- Effects ---
+HIT_DAMAGE = 10
+CLASH_ATTACK_TIMER_CAP = 3      # A clash cuts both swings short
+CLASH_KNOCKBACK_FRAMES = 35
+CLASH_BOUNCE_VELOCITY = -10     # Grounded players are popped into the air by a clash
+
+# Per-direction outcome codes (attacker -> defender)
+NO_CONTACT = 0
+EVADED_DUCK = 1   # Defender ducked under the swing
+EVADED_JUMP = 2   # Defender jumped over a grounded attacker's swing
+HIT = 3
+
+CombatOutcomes = namedtuple('CombatOutcomes', [
+    'missed',          # A swing ended without connecting (either player)
+    'engaged',         # Both players alive: the clash/hit rules applied
+    'clash',           # Both swords met: knockback, stun and flash
+    'p1_outcome',      # P1's swing against P2 (NO_CONTACT / EVADED_* / HIT)
+    'p2_outcome',      # P2's swing against P1
+    'p1_knocked_out',  # P1 took a hit that brought health to 0
+    'p2_knocked_out',
+    'both_attacking',  # Engaged with both swords swinging (sword effects sound)
+])
+
+
+def _swing(attacker, defender, open_pairs, dy_ok):
+    """Outcome codes for attacker's swing against defender in every pair"""
+    center_x = attacker[X]; defender_x = defender[X]
+    reach_x = center_x + np.where(attacker[FACING] == 1, ATTACK_RANGE_EXTENSION, -ATTACK_RANGE_EXTENSION)
+    contact = (open_pairs & (attacker[IS_ATTACKING] != 0) & (attacker[HAS_HIT_THIS_ATTACK] == 0) &
+               (np.abs(reach_x - defender_x) < HIT_BOX_WIDTH) & dy_ok)
+    ducked = defender[IS_DUCKING] != 0
+    jumped = (defender[IS_JUMPING] != 0) & (attacker[IS_JUMPING] == 0)
+    outcome = np.where(ducked, EVADED_DUCK, np.where(jumped, EVADED_JUMP, HIT))
+    return np.where(contact, outcome, NO_CONTACT).astype(np.int8)
+
+
+def resolve_combat(store, p1_slots, p2_slots, stun_frames, knockback_force, min_x, max_x):
+    """Resolve one frame of combat for every (p1_slots[i], p2_slots[i]) match.
+
+    Applies the column effects in place and returns CombatOutcomes arrays
+    indexed like the slot arrays."""
+    p1 = store.data[:, p1_slots]; p2 = store.data[:, p2_slots]
+
+    missed = (p1[MISS_SWING] != 0) | (p2[MISS_SWING] != 0)
+    p1[MISS_SWING] = 0; p2[MISS_SWING] = 0
+
+    engaged = (p1[HEALTH] > 0) & (p2[HEALTH] > 0)
+    p1_attacking = p1[IS_ATTACKING] != 0; p2_attacking = p2[IS_ATTACKING] != 0
+    dy_ok = np.abs((p1[Y] - SPRITE_CENTER_OFFSET_Y) - (p2[Y] - SPRITE_CENTER_OFFSET_Y)) < VERTICAL_CLASH_TOLERANCE
+
+    # Both swinging within reach of each other: a clash if both swings are live and
+    # unspent, otherwise nothing happens this frame (no hits either way)
+    clash_zone = (engaged & p1_attacking & p2_attacking &
+                  (np.abs(p1[X] - p2[X]) < CLASH_DETECTION_RANGE) & dy_ok)
+    clash = (clash_zone & (p1[ATTACK_TIMER] > 0) & (p2[ATTACK_TIMER] > 0) &
+             (p1[HAS_HIT_THIS_ATTACK] == 0) & (p2[HAS_HIT_THIS_ATTACK] == 0))
+
+    open_pairs = engaged & ~clash_zone
+    p1_outcome = _swing(p1, p2, open_pairs, dy_ok)
+    p2_outcome = _swing(p2, p1, open_pairs, dy_ok)
+
+    if clash.any():
+        p1_pushed_left = p1[X] < p2[X]
+        shift = np.where(clash, np.where(p1_pushed_left, -knockback_force, knockback_force), 0)
+        p1[X] += shift; p2[X] -= shift
+        for player in (p1, p2):
+            player[HAS_HIT_THIS_ATTACK][clash] = 1
+            player[COOLDOWN_TIMER] = np.where(clash, np.maximum(player[COOLDOWN_TIMER], stun_frames), player[COOLDOWN_TIMER])
+            player[ATTACK_TIMER] = np.where(clash, np.minimum(player[ATTACK_TIMER], CLASH_ATTACK_TIMER_CAP), player[ATTACK_TIMER])
+            player[KNOCKBACK_TIMER][clash] = CLASH_KNOCKBACK_FRAMES
+            bounce = clash & (player[IS_JUMPING] == 0)
+            player[VERTICAL_VELOCITY][bounce] = CLASH_BOUNCE_VELOCITY
+            player[IS_JUMPING][bounce] = 1
+            player[X] = np.where(clash, np.clip(player[X], min_x, max_x), player[X])
+
+    # Any contact (evaded or not) spends the swing; only a HIT deals damage
+    p1[HAS_HIT_THIS_ATTACK] |= p1_outcome != NO_CONTACT
+    p2[HAS_HIT_THIS_ATTACK] |= p2_outcome != NO_CONTACT
+    p2[HEALTH] -= np.where(p1_outcome == HIT, HIT_DAMAGE, 0)
+    p1[HEALTH] -= np.where(p2_outcome == HIT, HIT_DAMAGE, 0)
+
+    store.data[:, p1_slots] = p1; store.data[:, p2_slots] = p2
+    return CombatOutcomes(
+        missed=missed, engaged=engaged, clash=clash,
+        p1_outcome=p1_outcome, p2_outcome=p2_outcome,
+        p1_knocked_out=(p2_outcome == HIT) & (p1[HEALTH] <= 0),
+        p2_knocked_out=(p1_outcome == HIT) & (p2[HEALTH] <= 0),
+        both_attacking=engaged & p1_attacking & p2_attacking)
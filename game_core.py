@@ -0,0 +1,945 @@
+# Kylander: The Reckoning - Simulation Core
+# Everything that decides how a match plays out, with no Flask, sockets or
+# wall clock: tick_rooms takes the rooms and the input that arrived since the
+# last tick and returns the rooms to send plus the events that happened. Time
+# is the room frame counter and randomness comes from each room's own seeded
+# stream (see room_random.py), so the same seed and input always give the same
+# match - on the server, in a test or in an offline tool. app.py only moves
+# input in and state out.
+
+import os
+from collections.abc import Mapping
+import numpy as np
+import ai_scheduler
+import combat
+import game_log
+import metrics
+from input_buffer import InputBuffer, coalesce_actions
+from player_store import AI_ATTACK_ARMED, AI_DUCKED_ON, AI_INTENT, PlayerStore, step_physics, wrap_positions
+from replay_log import ReplayRecorder
+from rollback import RollbackHistories
+from room_random import RoomRandom, derive_seed
+from tracing import TRACER
+
+tick_log = game_log.get_logger('tick')
+round_log = game_log.get_logger('round')
+combat_log = game_log.get_logger('combat')
+input_log = game_log.get_logger('input')
+
+room_phase_failures = metrics.counter('room_phase_failures_total', 'Tick phases that raised (the room sat out the rest of the tick)',
+                                      labelnames=('phase',))
+
+# --- Game Constants ---
+GAME_WIDTH = 800; GAME_HEIGHT = 600; GROUND_LEVEL = GAME_HEIGHT - 50
+PLAYER_SPEED = 10 
+PLAYER_JUMP_VELOCITY = -15; GRAVITY = 1
+PLAYER_ATTACK_RANGE = 85  # INCREASED: More generous attack range
+PLAYER_SPRITE_HALF_WIDTH = 35 
+ATTACK_DURATION = 24      # Animation duration for attacks
+ATTACK_COOLDOWN = 15      # UPDATED: Shorter cooldown for human players (was 20)
+CLASH_STUN_DURATION = 30  # Longer stun for more dramatic effect
+KNOCKBACK_DISTANCE = 50   # INCREASED: Very noticeable knockback
+MAX_WINS = 5; SPECIAL_LEVEL_WINS = 3 
+SLIDESHOW_DURATION_MS = 6000; VICTORY_SCREEN_DURATION_MS = 4000
+CONTROLS_SCREEN_DURATION_MS = 1000; CHURCH_INTRO_DURATION_MS = 4000
+QUICKENING_FLASHES = 6; QUICKENING_FLASH_DURATION_MS = 100
+MAX_PLAYERS_PER_ROOM = 2
+
+PARIS_BG_COUNT = 7; CHURCH_BG_COUNT = 3; VICTORY_BG_COUNT = 10; SLIDESHOW_COUNT = 12
+CHARACTER_NAMES = ["The Potzer", "The Kylander", "Darichris"]
+AI_SID_PLACEHOLDER = "AI_PLAYER_SID" 
+
+# IMPROVED: Better balanced AI constants
+AI_SPEED_MULTIPLIER = 0.6  # Movement speed multiplier
+AI_PREFERRED_DISTANCE = 75  # REDUCED: Closer optimal fighting distance (was 85)
+AI_DISTANCE_BUFFER = 25     # REDUCED: Tighter distance tolerance (was 30)
+AI_ATTACK_FREQUENCY = 0.18  # REDUCED: Even less frequent attacks (was 0.22)
+AI_JUMP_FREQUENCY = 0.12    # REDUCED: Less jumping (was 0.15)
+AI_DUCK_FREQUENCY = 0.2     # More frequent ducking
+AI_ATTACK_COOLDOWN_BONUS = 45  # Much longer AI cooldown
+AI_DECISION_FREQUENCY = 0.6   # NEW: AI only makes movement decisions 60% of the time
+AI_DECISION_INTERVAL = 6      # Frames between AI decisions; the cached intent is followed in between
+AI_ATTACK_ZONE_BONUS = 35     # The AI swings from up to PLAYER_ATTACK_RANGE + this
+
+
+# --- Simulation Timing ---
+# The simulation steps at a fixed rate and every game timer counts frames, so
+# screen transitions, combat and AI cooldowns all advance on the same clock.
+TICK_RATE = 60              # Fixed simulation frames per second
+
+def ms_to_frames(duration_ms):
+    return max(1, round(duration_ms * TICK_RATE / 1000))
+
+SLIDESHOW_DURATION_FRAMES = ms_to_frames(SLIDESHOW_DURATION_MS)
+VICTORY_SCREEN_DURATION_FRAMES = ms_to_frames(VICTORY_SCREEN_DURATION_MS)
+CONTROLS_SCREEN_DURATION_FRAMES = ms_to_frames(CONTROLS_SCREEN_DURATION_MS)
+CHURCH_INTRO_DURATION_FRAMES = ms_to_frames(CHURCH_INTRO_DURATION_MS)
+QUICKENING_DURATION_FRAMES = ms_to_frames((QUICKENING_FLASHES * 2 * QUICKENING_FLASH_DURATION_MS) + 500)
+SLIDESHOW_TO_TITLE_DELAY_FRAMES = ms_to_frames(200)  # Lets slideshow music stop before TITLE
+AI_DUCK_COOLDOWN_FRAMES = ms_to_frames(2000)
+AI_JUMP_COOLDOWN_FRAMES = ms_to_frames(3500)
+
+def get_default_player_state(player_id_num, character_name_choice=None):
+    player_id_str = f"player{player_id_num}"
+    valid_char_name = character_name_choice if character_name_choice in CHARACTER_NAMES else None
+    return player_store.new_player({
+        'id': player_id_str, 'sid': None, 'name': player_id_str, 
+        'character_name': valid_char_name, 'original_character_name': valid_char_name, 'display_character_name': valid_char_name,
+        'x': 150 if player_id_num == 1 else GAME_WIDTH - 150, 'y': GROUND_LEVEL,
+        'health': 100, 'score': 0, 'facing': 1 if player_id_num == 1 else -1,
+        'current_animation': 'idle', 'animation_frame_server': 0, 
+        'is_attacking': False, 'attack_timer': 0, 'is_ducking': False, 'is_jumping': False,
+        'vertical_velocity': 0, 'cooldown_timer': 0, 'has_hit_this_attack': False,
+        'is_ready_next_round': False, '_ai_last_duck_frame': -1, '_ai_last_jump_frame': -1,
+        'miss_swing': False,  # Track missed swings for sound effects
+        'knockback_timer': 0  # Track knockback state
+    })
+
+def get_default_room_state(room_id):
+    return {
+        'id': room_id, 'players': {}, 'current_screen': 'TITLE', 'game_mode': None,
+        'player1_char_name_chosen': None, 'player2_char_name_chosen': None,
+        'p1_selection_complete': False, 'p2_selection_complete': False,
+        'p1_waiting_for_p2': False,  # NEW: Track if P1 is waiting for P2 to connect
+        'match_score_p1': 0, 'match_score_p2': 0,
+        'current_background_key': 'paris', 'current_background_index': 0,
+        'special_level_active': False, 'special_swap_target_player_id': None, 
+        'round_winner_player_id': None, 'game_winner_player_id': None,
+        'frame': 0, 'state_timer_frames': 0,  # Monotonic room frame counter; screen timer in frames
+        'ai_opponent_active': False, 'quickening_effect_active': False,
+        'dark_quickening_effect_active': False, 'final_sound_played': False, 
+        'available_victory_sfx_indices': list(range(5)), 
+        'used_victory_sfx_indices': [], 
+        'available_victory_bgs_player': list(range(VICTORY_BG_COUNT)), 
+        'used_special_bgs': [], 
+        'sfx_event_for_client': None,
+        'swordeffects_playing': False,  # Track sword effects sound
+        'clash_flash_timer': 0,  # NEW: Track clash flash effect
+        # ADDED: Track original character for special level reversion
+        'special_level_original_p1_char': None,
+        'special_level_original_p2_char': None,
+        'slideshow_music_started': False,  # Track slideshow music state
+        'church_victory_sound_triggered': False,  # Track when to play Darius sound
+        'church_victory_bg_index': 0  # NEW: Track which church victory background (0 or 1) for sound selection
+    }
+
+# Per-frame player fields for every room live in shared columns (see player_store.py);
+# room_state['players'] maps sid -> PlayerView into this store.
+player_store = PlayerStore()
+
+# Player input waits here until the next tick applies it
+input_buffer = InputBuffer()
+
+# Two-player rooms keep recent frames so late input can be applied where it was meant (see rollback.py)
+rollback_histories = RollbackHistories()
+
+# Each room draws its randomness from its own stream. With a base seed (KYLANDER_SEED,
+# seed_rooms) a room's stream depends only on the seed and the room id.
+room_rngs = {}   # room id -> RoomRandom
+base_seed = int(os.environ['KYLANDER_SEED']) if os.environ.get('KYLANDER_SEED') else None
+
+def seed_rooms(seed):
+    """Make every room created from now on draw from a stream derived from `seed` (None = unseeded)"""
+    global base_seed
+    base_seed = seed
+
+def seed_room(room_id, seed):
+    room_rngs[room_id] = RoomRandom(seed)
+
+def room_rng(room_state):
+    rng = room_rngs.get(room_state['id'])
+    if rng is None:
+        seed = derive_seed(base_seed, room_state['id']) if base_seed is not None else None
+        rng = room_rngs[room_state['id']] = RoomRandom(seed)
+    return rng
+
+# Offline tools: rooms whose player 1 is driven by update_ai as well (AI against AI),
+# and rooms that count their combat outcomes (room id -> Counter)
+self_play_rooms = set()
+combat_tallies = {}
+
+# With KYLANDER_REPLAY_DIR set, every match is recorded to a log file there (see replay_log.py, replay.py)
+replay_recorder = (ReplayRecorder.to_directory(os.environ['KYLANDER_REPLAY_DIR'])
+                   if os.environ.get('KYLANDER_REPLAY_DIR') else None)
+
+def start_replay(room_state):
+    """Start recording the match a room is about to play (call between ticks)"""
+    if replay_recorder is not None:
+        replay_recorder.start(room_state, player_store, room_rng(room_state))
+
+def end_replay(room_state, reason):
+    """Finish a room's recording, if it has one: reason is one of replay_log.END_REASONS"""
+    if replay_recorder is not None:
+        replay_recorder.end(room_state['id'], reason, room_state)
+
+def record_replay_edit(room_state, room_fields=None, players=None):
+    """Note fields a handler changed outside the simulation (players: {'player1': {field: value}})"""
+    if replay_recorder is not None:
+        replay_recorder.record_edit(room_state, room_fields, players)
+
+def forget_room(room_id):
+    """Drop everything the core keeps for a destroyed room"""
+    room_rngs.pop(room_id, None); rollback_histories.drop(room_id)
+    self_play_rooms.discard(room_id); combat_tallies.pop(room_id, None)
+    if replay_recorder is not None: replay_recorder.end(room_id, 'destroyed')
+
+# Events the current tick produced, handed back by tick_rooms
+events = []
+
+def record_event(room_state, event, **fields):
+    """Log a round event and hand it to the caller of tick_rooms"""
+    round_log.info(event, room=room_state['id'], **fields)
+    events.append({'room': room_state['id'], 'frame': room_state['frame'], 'event': event, **fields})
+
+def remove_player(room_state, sid):
+    """Take a player out of a room and hand its store slot back to the pool"""
+    player_state = room_state['players'].pop(sid, None)
+    if player_state is not None: player_state.release()
+    return player_state
+
+def release_room_players(room_state):
+    for player_state in room_state['players'].values(): player_state.release()
+    room_state['players'] = {}
+
+def serialize_room_state(room_state):
+    """JSON-ready copy of a room (players as plain dicts)"""
+    serialized = dict(room_state)
+    serialized['players'] = {sid: p_state.to_dict() for sid, p_state in room_state['players'].items()}
+    return serialized
+
+def new_match_room(room_id, p1_character, p2_character, ai_opponent=False, seed=None, sids=('p1', 'p2')):
+    """A room already in its first round, for running matches without a server.
+
+    The players get `sids` (player 2 is the AI placeholder when `ai_opponent`
+    is set). `seed` seeds the room's random stream."""
+    if seed is not None: seed_room(room_id, seed)
+    room_state = get_default_room_state(room_id)
+    room_state.update({'game_mode': 'ONE' if ai_opponent else 'TWO', 'ai_opponent_active': ai_opponent,
+                       'player1_char_name_chosen': p1_character, 'player2_char_name_chosen': p2_character,
+                       'p1_selection_complete': True, 'p2_selection_complete': True})
+    for player_id_num, sid, character in ((1, sids[0], p1_character),
+                                          (2, AI_SID_PLACEHOLDER if ai_opponent else sids[1], p2_character)):
+        player_state = get_default_player_state(player_id_num, character); player_state['sid'] = sid
+        room_state['players'][sid] = player_state
+    initialize_round(room_state)
+    return room_state
+
+def get_player_by_id(room_state, target_player_id):
+    if target_player_id == AI_SID_PLACEHOLDER and AI_SID_PLACEHOLDER in room_state['players']: return room_state['players'][AI_SID_PLACEHOLDER]
+    for p_state in room_state['players'].values():
+        if p_state['id'] == target_player_id: return p_state
+    return None
+
+def get_opponent_state(room_state, player_state_or_sid):
+    player_id_to_match = None; current_sid = None
+    if isinstance(player_state_or_sid, str): 
+        current_sid = player_state_or_sid
+        if current_sid in room_state['players']: player_id_to_match = room_state['players'][current_sid]['id']
+    elif isinstance(player_state_or_sid, Mapping): 
+        player_id_to_match = player_state_or_sid.get('id'); current_sid = player_state_or_sid.get('sid')
+    if player_id_to_match:
+        for p_sid_iter, p_data in room_state['players'].items():
+            if p_sid_iter != current_sid: return p_data
+    return None
+
+def cleanup_room_state(room_state):
+    """Clean up any accumulated state that might cause memory issues"""
+    for player_sid, player_state in room_state['players'].items():
+        if 'miss_swing' in player_state:
+            player_state['miss_swing'] = False
+        if '_temp_animation_data' in player_state:
+            del player_state['_temp_animation_data']
+        # Reset knockback
+        player_state['knockback_timer'] = 0
+        
+        # FIXED: Additional safeguards to prevent getting stuck in states
+        # If player is somehow ducking while jumping or attacking, reset ducking
+        if player_state.get('is_ducking') and (player_state.get('is_jumping') or player_state.get('is_attacking')):
+            round_log.debug('stuck_duck_reset', room=room_state['id'], player=player_state.get('id', 'unknown'))
+            player_state['is_ducking'] = False
+            if not player_state.get('is_jumping') and not player_state.get('is_attacking'):
+                player_state['current_animation'] = 'idle'
+    
+    room_state['sfx_event_for_client'] = None
+    room_state['swordeffects_playing'] = False
+    room_state['clash_flash_timer'] = 0  # Reset clash flash effect
+    room_state['church_victory_sound_triggered'] = False  # Reset church victory sound flag
+    room_state['church_victory_bg_index'] = 0  # NEW: Reset church victory background index
+
+def reset_player_for_round(player_state, room_state): 
+    player_state['health'] = 100
+    player_state['x'] = 150 if player_state['id'] == 'player1' else GAME_WIDTH - 150
+    player_state['y'] = GROUND_LEVEL
+    player_state.update({'is_attacking': False, 'attack_timer': 0, 'cooldown_timer': 0, 'is_jumping': False, 
+                         'is_ducking': False, 'vertical_velocity': 0, 'current_animation': 'idle', 
+                         'has_hit_this_attack': False, 'is_ready_next_round': False,
+                         'facing': 1 if player_state['id'] == 'player1' else -1,
+                         'miss_swing': False, 'knockback_timer': 0})  
+    
+    # FIXED: Proper asset swapping for special level
+    if room_state['special_level_active'] and player_state['id'] == room_state['special_swap_target_player_id']:
+        player_state['character_name'] = "Darichris" 
+        player_state['display_character_name'] = "Darichris"
+    else: 
+        player_state['character_name'] = player_state['original_character_name'] 
+        player_state['display_character_name'] = player_state['original_character_name']
+
+def initialize_round(room_state):
+    try:
+        cleanup_room_state(room_state)
+        
+        room_state.update({'round_winner_player_id': None, 'state_timer_frames': 0, 
+                           'quickening_effect_active': False, 'dark_quickening_effect_active': False,
+                           'sfx_event_for_client': None, 'swordeffects_playing': False})
+        
+        for p_state in room_state['players'].values(): 
+            reset_player_for_round(p_state, room_state)
+        
+        if room_state['special_level_active']:
+            available_church_bgs = [i for i in range(CHURCH_BG_COUNT) if i not in room_state.get('used_special_bgs', [])]
+            if not available_church_bgs: 
+                room_state['used_special_bgs'] = []
+                available_church_bgs = list(range(CHURCH_BG_COUNT))
+            chosen_church_idx = room_rng(room_state).choice(available_church_bgs)
+            room_state.update({'current_background_key': 'church', 'current_background_index': chosen_church_idx})
+            room_state.setdefault('used_special_bgs', []).append(chosen_church_idx)
+        else:
+            old_bg_index = room_state.get('current_background_index', -1)
+            new_bg_index = (old_bg_index + 1) % PARIS_BG_COUNT
+            room_state.update({'current_background_key': 'paris', 'current_background_index': new_bg_index})
+        
+        room_state['current_screen'] = 'PLAYING'
+        record_event(room_state, 'round_started', background=room_state['current_background_key'],
+                     background_index=room_state['current_background_index'],
+                     score=f"{room_state['match_score_p1']}-{room_state['match_score_p2']}")
+        
+    except Exception as e:
+        round_log.exception('initialize_round_failed', room=room_state['id'], error=str(e))
+
+def handle_round_victory(room_state, victor_player_id, loser_player_id):
+    if room_state['current_screen'] not in ['PLAYING', 'SPECIAL']: 
+        return
+    
+    cleanup_room_state(room_state)
+    record_event(room_state, 'round_over', winner=victor_player_id)
+    
+    if victor_player_id == 'player1': room_state['match_score_p1'] += 1
+    elif victor_player_id == 'player2': room_state['match_score_p2'] += 1
+
+    # Check for game winner IMMEDIATELY after score update
+    if room_state['match_score_p1'] >= MAX_WINS or room_state['match_score_p2'] >= MAX_WINS:
+        room_state['game_winner_player_id'] = victor_player_id
+        record_event(room_state, 'match_winner', winner=victor_player_id)
+    
+    room_state.update({'round_winner_player_id': victor_player_id, 'quickening_effect_active': True, 
+                       'state_timer_frames': QUICKENING_DURATION_FRAMES,
+                       'current_screen': room_state['current_screen']}) 
+
+def handle_special_level_loss_by_swapped(room_state, original_victor_id): 
+    record_event(room_state, 'darichris_defeated', victor=original_victor_id)
+    room_state.update({'dark_quickening_effect_active': True, 'game_winner_player_id': original_victor_id,
+                       'state_timer_frames': QUICKENING_DURATION_FRAMES,
+                       'current_screen': 'SPECIAL_END'})
+
+def end_special_level(room_state):
+    """Properly end special level and revert characters"""
+    round_log.debug('special_level_ended', room=room_state['id'])
+    room_state['special_level_active'] = False
+    room_state['special_swap_target_player_id'] = None
+    
+    # FIXED: Revert characters to their original forms
+    for player_sid, player_state in room_state['players'].items():
+        if player_state['id'] == 'player1':
+            orig_char = room_state.get('special_level_original_p1_char') or player_state['original_character_name']
+            player_state['character_name'] = orig_char
+            player_state['display_character_name'] = orig_char
+        elif player_state['id'] == 'player2':
+            orig_char = room_state.get('special_level_original_p2_char') or player_state['original_character_name']
+            player_state['character_name'] = orig_char
+            player_state['display_character_name'] = orig_char
+    
+    # Clear special level character tracking
+    room_state['special_level_original_p1_char'] = None
+    room_state['special_level_original_p2_char'] = None
+
+def update_ai(ai_state, target_state, room_state):
+    """An AI decision: duck, jump, arm an attack and pick a movement intent (followed by ai_scheduler until the next one)"""
+    if not ai_state or not target_state or ai_state['health'] <= 0: return
+    # Physics, screen wrap and following the intent run in the batched passes around this call
+    
+    # Skip AI updates during knockback (the next frame decides again)
+    if ai_state['knockback_timer'] > 0:
+        return
+    
+    # Calculate distance and direction
+    dx = target_state['x'] - ai_state['x']
+    distance = abs(dx)
+    current_frame = room_state['frame']
+    rng = room_rng(room_state)
+    slot = ai_state.slot
+    ai_scheduler.schedule_next_decision(player_store, slot, current_frame, AI_DECISION_INTERVAL, rng)
+    
+    # IMPROVED: More frequent ducking when threatened
+    if (target_state['is_attacking'] and distance < PLAYER_ATTACK_RANGE + 40 and 
+        not ai_state['is_jumping'] and
+        rng.random() < ai_scheduler.chance_per_decision(AI_DUCK_FREQUENCY, AI_DECISION_INTERVAL)):
+        last_duck_frame = ai_state.get('_ai_last_duck_frame', -1)
+        if last_duck_frame < 0 or current_frame - last_duck_frame > AI_DUCK_COOLDOWN_FRAMES:
+            ai_state.update({'is_ducking': True, 'current_animation': 'duck'})
+            ai_state['_ai_last_duck_frame'] = current_frame
+            player_store.data[AI_DUCKED_ON, slot] = current_frame
+    
+    # IMPROVED: Less aggressive attack frequency
+    attack_frequency = AI_ATTACK_FREQUENCY  # 0.18 - more conservative
+    if room_state.get('special_level_active') and ai_state.get('display_character_name') == 'Darichris':
+        attack_frequency = 0.45  # Still higher for special level
+    
+    # Only attack when in proper range and not too frequently: an armed attack is swung on the
+    # first frame before the next decision that it still can be
+    can_attack = (not ai_state['is_attacking'] and ai_state['cooldown_timer'] == 0 and not ai_state['is_ducking'] and
+                  AI_PREFERRED_DISTANCE - AI_DISTANCE_BUFFER <= distance <= PLAYER_ATTACK_RANGE + AI_ATTACK_ZONE_BONUS)
+    player_store.data[AI_ATTACK_ARMED, slot] = can_attack and \
+        rng.random() < ai_scheduler.chance_per_decision(attack_frequency, AI_DECISION_INTERVAL)
+    
+    # SIMPLIFIED: Movement decisions only some of the time; otherwise the AI pauses until the next decision
+    if rng.random() < AI_DECISION_FREQUENCY:
+        if distance > AI_PREFERRED_DISTANCE + AI_DISTANCE_BUFFER: intent = ai_scheduler.APPROACH
+        elif distance < AI_PREFERRED_DISTANCE - AI_DISTANCE_BUFFER: intent = ai_scheduler.RETREAT
+        else: intent = ai_scheduler.HOLD
+    else:
+        intent = ai_scheduler.PAUSE
+    player_store.data[AI_INTENT, slot] = intent
+    
+    # IMPROVED: Less frequent jumping
+    if (not ai_state['is_jumping'] and not ai_state['is_ducking'] and 
+        rng.random() < ai_scheduler.chance_per_decision(AI_JUMP_FREQUENCY, AI_DECISION_INTERVAL)):
+        last_jump_frame = ai_state.get('_ai_last_jump_frame', -1)
+        if last_jump_frame < 0 or current_frame - last_jump_frame > AI_JUMP_COOLDOWN_FRAMES:  # Longer cooldown
+            ai_state.update({
+                'is_jumping': True,
+                'vertical_velocity': PLAYER_JUMP_VELOCITY,
+                'current_animation': 'jump'
+            })
+            ai_state['_ai_last_jump_frame'] = current_frame
+
+def apply_player_actions(room_state, player, actions):
+    """Apply one tick's coalesced actions to a human player"""
+    if player['health'] <= 0 : return
+    action_taken = False
+    
+    # Skip processing actions during knockback
+    if player.get('knockback_timer', 0) > 0:
+        return
+    
+    # NEW: Check if there are any movement actions in this frame
+    has_movement_action = any(action.get('type') == 'move' for action in actions)
+    
+    for action_data in actions:
+        action_type = action_data.get('type')
+        if action_type == 'move':
+            if not player['is_attacking'] and not player['is_ducking']:
+                direction = action_data.get('direction')
+                if direction == 'left': player['x'] -= PLAYER_SPEED; player['facing'] = -1
+                elif direction == 'right': player['x'] += PLAYER_SPEED; player['facing'] = 1
+                if not player['is_jumping']: player['current_animation'] = 'walk'
+                action_taken = True
+        elif action_type == 'jump':
+            if not player['is_jumping'] and not player['is_ducking'] and not player['is_attacking']:
+                player['is_jumping'] = True; player['vertical_velocity'] = PLAYER_JUMP_VELOCITY
+                player['current_animation'] = 'jump'; player['is_ducking'] = False  # FIXED: Explicitly reset ducking
+                action_taken = True
+        elif action_type == 'duck':
+            is_ducking_cmd = action_data.get('active', False)
+            if not player['is_jumping'] and not player['is_attacking']:
+                # FIXED: More explicit ducking state management
+                old_ducking_state = player['is_ducking']
+                player['is_ducking'] = is_ducking_cmd
+                if old_ducking_state != is_ducking_cmd:
+                    player['current_animation'] = 'duck' if is_ducking_cmd else 'idle'
+                    action_taken = True
+                    input_log.debug('duck_changed', room=room_state['id'], player=player['id'], ducking=is_ducking_cmd)
+        elif action_type == 'attack':
+            if not player['is_attacking'] and player['cooldown_timer'] == 0 and not player['is_ducking']:
+                player['is_attacking'] = True; player['attack_timer'] = ATTACK_DURATION
+                player['current_animation'] = 'jump_attack' if player['is_jumping'] else 'attack'
+                player['has_hit_this_attack'] = False; player['is_ducking'] = False  # FIXED: Explicitly reset ducking
+                action_taken = True
+    
+    # FIXED: Human player walk animation - reset to idle when no movement input
+    if (not has_movement_action and not player['is_jumping'] and not player['is_attacking'] and 
+        not player['is_ducking'] and player['current_animation'] == 'walk'):
+        player['current_animation'] = 'idle'
+    
+    # IMPROVED: Better animation state management for human player
+    elif not action_taken and not player['is_jumping'] and not player['is_attacking'] and not player['is_ducking']:
+        # Only reset to idle if we're not in a valid animation state
+        if player['current_animation'] not in ['idle', 'walk']:
+            player['current_animation'] = 'idle'
+    
+    # ADDITIONAL SAFETY: Reset animation if state doesn't match
+    if not player['is_ducking'] and player['current_animation'] == 'duck':
+        input_log.debug('stuck_duck_animation_reset', room=room_state['id'], player=player['id'])
+        player['current_animation'] = 'idle' if not player['is_jumping'] and not player['is_attacking'] else player['current_animation']
+
+def rollback_lineup(room_state):
+    """(p1, p2) for a room whose play can be rewound (two humans fighting), else None"""
+    if room_state['ai_opponent_active'] or room_state['current_screen'] not in ('PLAYING', 'SPECIAL'):
+        return None
+    p1 = get_player_by_id(room_state, 'player1'); p2 = get_player_by_id(room_state, 'player2')
+    return (p1, p2) if p1 is not None and p2 is not None else None
+
+def save_rollback_frame(room_state):
+    """Record a rollback room as it stands at the start of its next frame"""
+    lineup = rollback_lineup(room_state)
+    if lineup is not None:
+        rollback_histories.for_room(room_state['id']).save(room_state['frame'] + 1, room_state, player_store, lineup,
+                                                           room_rng(room_state))
+
+def apply_saved_inputs(room_state, p1, p2, saved):
+    for player in (p1, p2):
+        actions = saved.inputs.get(player['sid'])
+        if actions is not None: apply_player_actions(room_state, player, actions)
+
+def apply_room_inputs(room_state, p1, p2, rewinds):
+    """Apply each player's queued input.
+
+    In a rollback room the input is recorded under the frame it was meant for
+    (messages for different frames separately, so a re-run matches on-time
+    play); if that frame has passed, the room is queued on `rewinds` instead
+    and resimulate_rooms applies this frame's input once it has caught up."""
+    frame = room_state['frame']
+    history = rollback_histories.get(room_state['id'])
+    saved = history.get(frame) if history is not None else None
+    taken = []   # (player, target frame, actions)
+    for player in (p1, p2):
+        if player is not None and input_buffer.has_pending(player['sid']):
+            if saved is None:
+                entry = input_buffer.take(player['sid'], frame)
+                if entry is not None: taken.append((player, *entry))
+            else:
+                taken.extend((player, *entry) for entry in input_buffer.take_frames(player['sid'], frame))
+    if saved is None:
+        for player, _, actions in taken:
+            if replay_recorder is not None: replay_recorder.record_input(room_state, player, frame, actions)
+            apply_player_actions(room_state, player, actions)
+        return
+
+    start = min([target_frame for _, target_frame, _ in taken], default=frame)
+    if start < frame:
+        oldest = history.oldest_frame(frame, [p1.slot, p2.slot])
+        if start < oldest:
+            rollback_histories.stats['clamped_inputs'] += 1
+            start = oldest
+        if start < frame and not rollback_histories.claim(frame - start):
+            start = frame
+    for player, target_frame, actions in taken:
+        target = history.get(max(target_frame, start))
+        prior = target.inputs.get(player['sid'])
+        target.inputs[player['sid']] = actions if prior is None else coalesce_actions([prior, actions])
+        if replay_recorder is not None:
+            replay_recorder.record_input(room_state, player, target.frame, target.inputs[player['sid']])
+    if start < frame:
+        rewinds.append((room_state, p1, p2, start))
+    else:
+        apply_saved_inputs(room_state, p1, p2, saved)
+
+def resimulate_rooms(rewinds):
+    """Rewind each (room, p1, p2, start frame) and re-run it up to the present, all rooms in lockstep.
+
+    Re-run frames go through the same batched passes as a live tick, so rooms
+    rewinding on the same tick share them. Each room ends with its input for
+    the present frame applied, ready for the live simulation; a sound from a
+    corrected frame that clients never got is carried into the present.
+    Returns the ids of rooms that failed a phase."""
+    failed = set(); depths = []; replayed_sfx = {}
+    for room_state, p1, p2, start in rewinds:
+        history = rollback_histories.get(room_state['id'])
+        depths.append(room_state['frame'] - start)
+        history.restore(history.get(start), room_state, player_store, (p1, p2), room_rng(room_state))
+    for step in range(max(depths), -1, -1):  # Frames still to go after this one
+        lineups = []
+        for (room_state, p1, p2, start), depth in zip(rewinds, depths):
+            if depth < step or room_state['id'] in failed: continue
+            history = rollback_histories.get(room_state['id'])
+            frame = start + depth - step
+            if frame > start:
+                history.save(frame, room_state, player_store, (p1, p2), room_rng(room_state), history.get(frame).inputs)
+            if not (run_room_phase(advance_room_timers, room_state) and
+                    (room_state['current_screen'] not in ('PLAYING', 'SPECIAL') or
+                     run_room_phase(apply_saved_inputs, room_state, p1, p2, history.get(frame)))):
+                failed.add(room_state['id']); continue
+            if step and room_state['current_screen'] in ('PLAYING', 'SPECIAL'):
+                lineups.append((room_state, p1, p2))
+        if not step:
+            break
+        failed |= simulate_lineups(lineups)
+        for room_state, _, _ in lineups:
+            sfx = room_state['sfx_event_for_client']
+            sent = rollback_histories.get(room_state['id']).get(room_state['frame'] + 1).room_fields['sfx_event_for_client']
+            if sfx is not None and sfx != sent:
+                replayed_sfx[room_state['id']] = sfx  # The corrected frame sounds different from what was sent
+    for room_state, _, _, _ in rewinds:
+        if room_state['id'] in replayed_sfx and room_state['id'] not in failed:
+            room_state['sfx_event_for_client'] = replayed_sfx[room_state['id']]
+    return failed
+
+def advance_room_timers(room_state):
+    """Frame counter, screen timers and screen transitions for one room"""
+    room_state['frame'] += 1
+    if tick_log.enabled_for(game_log.DEBUG):
+        tick_log.debug('room_tick', room=room_state['id'], frame=room_state['frame'],
+                       screen=room_state.get('current_screen', 'UNKNOWN'), timer=room_state.get('state_timer_frames', 0))
+    
+    # Clear previous frame's SFX events
+    room_state['sfx_event_for_client'] = None 
+    
+    # Handle clash flash effect
+    if room_state.get('clash_flash_timer', 0) > 0:
+        room_state['clash_flash_timer'] -= 1
+
+    # FIXED: Only handle timer once per frame
+    if room_state['state_timer_frames'] > 0:
+        room_state['state_timer_frames'] -= 1
+        
+        if room_state['state_timer_frames'] <= 0:
+            prev_screen_when_timer_expired = room_state['current_screen'] 
+            tick_log.debug('screen_timer_expired', room=room_state['id'], screen=prev_screen_when_timer_expired)
+            
+            if room_state['quickening_effect_active'] or room_state['dark_quickening_effect_active']:
+                room_state['quickening_effect_active'] = False; room_state['dark_quickening_effect_active'] = False
+                
+                # FIXED: Handle SPECIAL_END state for dark quickening
+                if prev_screen_when_timer_expired == 'SPECIAL_END':
+                    # Show GAME_OVER screen after dark quickening
+                    room_state.update({'current_screen': 'GAME_OVER', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES})
+                elif room_state['game_winner_player_id']:
+                    if prev_screen_when_timer_expired == 'SPECIAL_END':
+                        # Show GAME_OVER screen for special level defeat
+                        room_state.update({'current_screen': 'GAME_OVER', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES})
+                    else:
+                        room_state.update({'current_screen': 'FINAL', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES}) 
+                    if not room_state['final_sound_played']: room_state['final_sound_played'] = True 
+                # FIXED: Church victory handling - match original kylander2.py exactly
+                elif prev_screen_when_timer_expired == 'SPECIAL' and \
+                     room_state['round_winner_player_id'] == room_state['special_swap_target_player_id']:
+                    # Darichris (swapped player) won the special round. Show church victory screen.
+                    chosen_bg_index = room_rng(room_state).choice([0, 1])  # 0 = churchvictory.png, 1 = churchvictory2.png
+                    room_state.update({'current_screen': 'CHURCH_VICTORY', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES,
+                                      'church_victory_sound_triggered': True, 'church_victory_bg_index': chosen_bg_index})
+                    room_state['current_background_index'] = chosen_bg_index
+                    record_event(room_state, 'church_victory', winner='darichris', background_index=chosen_bg_index)
+                    # FIXED: End special level after Darichris wins
+                    end_special_level(room_state)
+                elif prev_screen_when_timer_expired == 'SPECIAL' and \
+                     room_state['round_winner_player_id'] != room_state['special_swap_target_player_id']:
+                    # Original character won special round. Back to normal gameplay.
+                    record_event(room_state, 'church_victory', winner='original', background_index=0)
+                    room_state.update({'current_screen': 'CHURCH_VICTORY', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES})
+                    # Use churchvictory.png (index 0) for original character win
+                    room_state['current_background_index'] = 0
+                    # FIXED: End special level after original character wins
+                    end_special_level(room_state)
+                # FIXED: Special level trigger logic - handle AI opponent winning 3 rounds
+                elif not room_state['special_level_active'] and \
+                     (room_state['match_score_p1'] == SPECIAL_LEVEL_WINS or room_state['match_score_p2'] == SPECIAL_LEVEL_WINS) and \
+                     room_state['round_winner_player_id']: 
+                     room_state['special_level_active'] = True 
+                     winner_of_trigger_round = room_state['round_winner_player_id']
+                     # Store original characters before swapping
+                     p1 = get_player_by_id(room_state, 'player1')
+                     p2 = get_player_by_id(room_state, 'player2')
+                     if p1: room_state['special_level_original_p1_char'] = p1['original_character_name']
+                     if p2: room_state['special_level_original_p2_char'] = p2['original_character_name']
+                     
+                     # CRITICAL FIX: The LOSER becomes Darichris!
+                     if room_state['match_score_p1'] == SPECIAL_LEVEL_WINS:
+                         # Player 1 won 3 rounds, so Player 2 (the opponent) becomes Darichris
+                         room_state['special_swap_target_player_id'] = 'player2'
+                     else:
+                         # Player 2 (AI) won 3 rounds, so Player 1 becomes Darichris  
+                         room_state['special_swap_target_player_id'] = 'player1'
+                     
+                     room_state.update({'current_screen': 'CHURCH_INTRO', 'state_timer_frames': CHURCH_INTRO_DURATION_FRAMES})
+                     record_event(room_state, 'special_level_triggered', trigger_winner=winner_of_trigger_round,
+                                  darichris=room_state['special_swap_target_player_id'])
+                else: 
+                    room_state.update({'current_screen': 'VICTORY', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES, 'current_background_key': 'victory'})
+                    if not room_state.get('available_victory_bgs_player'): room_state['available_victory_bgs_player'] = list(range(VICTORY_BG_COUNT))
+                    if room_state['available_victory_bgs_player']:
+                        idx = room_rng(room_state).choice(room_state['available_victory_bgs_player'])
+                        room_state['current_background_index'] = idx; room_state['available_victory_bgs_player'].remove(idx)
+                    else: room_state['current_background_index'] = room_rng(room_state).randint(0, VICTORY_BG_COUNT -1)
+                    
+                    if not room_state.get('available_victory_sfx_indices'): room_state['available_victory_sfx_indices'] = list(range(5))
+                    if room_state['available_victory_sfx_indices']:
+                        sfx_idx = room_rng(room_state).choice(room_state['available_victory_sfx_indices'])
+                        room_state['victory_sfx_to_play_index'] = sfx_idx
+                        room_state['available_victory_sfx_indices'].remove(sfx_idx)
+                    else: room_state['victory_sfx_to_play_index'] = room_rng(room_state).randint(0,4)
+            
+            elif prev_screen_when_timer_expired == 'CONTROLS': 
+                initialize_round(room_state)
+            elif prev_screen_when_timer_expired == 'CHURCH_INTRO': 
+                initialize_round(room_state)
+            # FIXED: Church victory timer handling - return to normal gameplay
+            elif prev_screen_when_timer_expired == 'CHURCH_VICTORY':
+                # After church victory screen, return to normal gameplay (not special level)
+                # Reset special level flags completely
+                room_state['special_level_active'] = False
+                room_state['special_swap_target_player_id'] = None
+                # Clear any special level character tracking
+                room_state['special_level_original_p1_char'] = None
+                room_state['special_level_original_p2_char'] = None
+                # NEW: Reset church victory sound flags
+                room_state['church_victory_sound_triggered'] = False
+                room_state['church_victory_bg_index'] = 0
+                # Initialize a new round in normal gameplay
+                initialize_round(room_state)
+            # FIXED: Handle immediate church victory (when Darichris wins in special level)
+            elif prev_screen_when_timer_expired == 'CHURCH_VICTORY_IMMEDIATE':
+                # After immediate church victory, return to normal gameplay
+                # NEW: Reset church victory sound flags
+                room_state['church_victory_sound_triggered'] = False
+                room_state['church_victory_bg_index'] = 0
+                # The special level was already ended, just start a new round
+                initialize_round(room_state)
+            elif prev_screen_when_timer_expired == 'VICTORY':
+                if not room_state['game_winner_player_id']: initialize_round(room_state)
+            elif prev_screen_when_timer_expired == 'FINAL': 
+                room_state.update({'current_screen': 'SLIDESHOW', 'current_background_key': 'slideshow', 
+                                   'current_background_index': 0, 'state_timer_frames': SLIDESHOW_DURATION_FRAMES,
+                                   'slideshow_music_started': True})
+            elif prev_screen_when_timer_expired == 'GAME_OVER':
+                room_state.update({'current_screen': 'SLIDESHOW', 'current_background_key': 'slideshow', 
+                                   'current_background_index': 0, 'state_timer_frames': SLIDESHOW_DURATION_FRAMES,
+                                   'slideshow_music_started': True})
+
+    # IMPROVED: Slideshow management with better music control
+    if room_state['current_screen'] == 'SLIDESHOW':
+        if room_state['state_timer_frames'] <= 0:
+            # Check if we've shown all slides
+            if room_state['current_background_index'] >= SLIDESHOW_COUNT - 1 and room_state['slideshow_music_started']:
+                # Slideshow completed naturally - this frame's update tells clients to stop the music
+                tick_log.debug('slideshow_finished', room=room_state['id'])
+                room_state['slideshow_music_started'] = False
+            elif room_state['current_background_index'] >= SLIDESHOW_COUNT - 1:
+                # Brief delay to let music stop, then transition
+                room_state['state_timer_frames'] = SLIDESHOW_TO_TITLE_DELAY_FRAMES
+                room_state['current_screen'] = 'SLIDESHOW_TO_TITLE'  # Intermediate state
+            else:
+                # Show next slide
+                room_state['current_background_index'] = (room_state['current_background_index'] + 1) % SLIDESHOW_COUNT
+                room_state['state_timer_frames'] = SLIDESHOW_DURATION_FRAMES
+    
+    # Handle slideshow completion transition
+    elif room_state['current_screen'] == 'SLIDESHOW_TO_TITLE':
+        if room_state['state_timer_frames'] <= 0:
+            # Now transition to title
+            room_state.update({'current_screen': 'TITLE', 'current_background_key': 'paris',
+                               'current_background_index': 0, 'slideshow_music_started': False})
+            # Reset game state
+            room_state['match_score_p1'] = 0
+            room_state['match_score_p2'] = 0
+            room_state['final_sound_played'] = False
+            end_replay(room_state, 'finished')
+
+def room_ai_players(room_state, p1, p2):
+    """[(AI player, its opponent)] for a room"""
+    if not room_state['ai_opponent_active'] or p1 is None or p2 is None:
+        return []
+    if room_state['id'] in self_play_rooms:
+        return [(p2, p1), (p1, p2)]
+    return [(p2, p1)]
+
+def update_room_ai(room_state, ai_players):
+    """Decisions for the room's AI players that are due this frame"""
+    for ai_state, target_state in ai_players:
+        if ai_scheduler.decision_due(player_store, ai_state.slot, room_state['frame']):
+            update_ai(ai_state, target_state, room_state)
+
+def run_ai(lineups):
+    """Due AI decisions room by room, then every AI follows its intent in one batched pass.
+
+    Returns the ids of rooms whose decisions raised."""
+    failed = set(); ai_slots = []; target_slots = []; frames = []
+    for room_state, p1, p2 in lineups:
+        ai_players = room_ai_players(room_state, p1, p2)
+        if not ai_players: continue
+        if not run_room_phase(update_room_ai, room_state, ai_players):
+            failed.add(room_state['id']); continue
+        for ai_state, target_state in ai_players:
+            ai_slots.append(ai_state.slot); target_slots.append(target_state.slot); frames.append(room_state['frame'])
+    if ai_slots:
+        ai_scheduler.follow_intents(
+            player_store, ai_slots, target_slots, frames,
+            move_speed=int(PLAYER_SPEED * AI_SPEED_MULTIPLIER), preferred_distance=AI_PREFERRED_DISTANCE,
+            distance_buffer=AI_DISTANCE_BUFFER, attack_range=PLAYER_ATTACK_RANGE + AI_ATTACK_ZONE_BONUS,
+            attack_duration=ATTACK_DURATION, attack_cooldown=ATTACK_COOLDOWN + AI_ATTACK_COOLDOWN_BONUS)
+    return failed
+
+# Sounds by audio sprite id: the sound file's name in static/assets/sfx (build_assets.py packs them into one sprite)
+SFX_WHOOSH = 'sword_whoosh'; SFX_CLASH = 'sword_clash'; SFX_SWING = 'sword_swing'; SFX_SWORD_EFFECTS = 'swordeffects'
+COMBAT_SFX = {combat.EVADED_DUCK: SFX_WHOOSH, combat.EVADED_JUMP: SFX_WHOOSH, combat.HIT: SFX_SWING}
+COMBAT_OUTCOME_NAMES = {combat.EVADED_DUCK: 'duck_evasion', combat.EVADED_JUMP: 'jump_evasion', combat.HIT: 'hit'}
+
+def handle_knockout(room_state, victor_player_id, loser_player_id, loser_state):
+    """A hit brought loser to 0 health: special-level endings or a normal round victory"""
+    if room_state['special_level_active']:
+        if room_state['special_swap_target_player_id'] == loser_player_id and loser_state.get('display_character_name') == "Darichris":
+            # Darichris was killed - trigger special ending (dark quickening)
+            handle_special_level_loss_by_swapped(room_state, victor_player_id)
+        else:
+            # The non-Darichris player was killed - this means Darichris won!
+            chosen_bg_index = room_rng(room_state).choice([0, 1])  # 0 = churchvictory.png, 1 = churchvictory2.png
+            room_state.update({'current_screen': 'CHURCH_VICTORY_IMMEDIATE', 'state_timer_frames': VICTORY_SCREEN_DURATION_FRAMES,
+                              'church_victory_sound_triggered': True, 'church_victory_bg_index': chosen_bg_index})
+            room_state['current_background_index'] = chosen_bg_index
+            room_state['round_winner_player_id'] = loser_player_id  # Not read again before the next round resets it
+            record_event(room_state, 'church_victory', winner='darichris', background_index=chosen_bg_index,
+                         immediate=True)
+            end_special_level(room_state)
+    else:
+        handle_round_victory(room_state, victor_player_id, loser_player_id)
+
+def apply_combat_outcome(room_state, p1, p2, outcomes, i):
+    """Sounds, clash flash and knockouts for one room, in the order the rules produce them"""
+    tally = combat_tallies.get(room_state['id'])
+    if outcomes.missed[i]:
+        room_state['sfx_event_for_client'] = SFX_WHOOSH
+        if tally is not None: tally['miss'] += 1
+    if outcomes.clash[i]:
+        if tally is not None: tally['clash'] += 1
+        combat_log.debug('clash', room=room_state['id'], p1_x=p1['x'], p2_x=p2['x'])
+        room_state['clash_flash_timer'] = 8
+        room_state['sfx_event_for_client'] = SFX_CLASH
+    for attacker_id, defender_id, defender, outcome, knocked_out in (
+            ('player1', 'player2', p2, outcomes.p1_outcome[i], outcomes.p2_knocked_out[i]),
+            ('player2', 'player1', p1, outcomes.p2_outcome[i], outcomes.p1_knocked_out[i])):
+        if outcome == combat.NO_CONTACT:
+            continue
+        if tally is not None: tally[COMBAT_OUTCOME_NAMES[outcome]] += 1
+        if combat_log.enabled_for(game_log.DEBUG):
+            combat_log.debug('swing', room=room_state['id'], attacker=attacker_id, outcome=COMBAT_OUTCOME_NAMES[outcome],
+                             defender_health=defender['health'])
+        room_state['sfx_event_for_client'] = COMBAT_SFX[outcome]
+        if knocked_out:
+            handle_knockout(room_state, attacker_id, defender_id, defender)
+
+def update_sword_effects(room_state, both_attacking):
+    if both_attacking and not room_state['swordeffects_playing']:
+        room_state['sfx_event_for_client'] = SFX_SWORD_EFFECTS
+        room_state['swordeffects_playing'] = True
+    elif not both_attacking:
+        room_state['swordeffects_playing'] = False
+
+def resolve_all_combat(lineups):
+    """Missed swings, clashes, evasion and hits for every (room, p1, p2) lineup in one batched call.
+
+    Returns the ids of rooms whose outcome handling raised."""
+    matches = []
+    for room_state, p1, p2 in lineups:
+        if p1 is not None and p2 is not None:
+            matches.append((room_state, p1, p2))
+            continue
+        for player in (p1, p2):  # A lone player can still whiff
+            if player is not None and player['miss_swing']:
+                room_state['sfx_event_for_client'] = SFX_WHOOSH; player['miss_swing'] = False
+    if not matches:
+        return set()
+
+    outcomes = combat.resolve_combat(
+        player_store,
+        np.array([p1.slot for _, p1, _ in matches], dtype=np.intp),
+        np.array([p2.slot for _, _, p2 in matches], dtype=np.intp),
+        stun_frames=CLASH_STUN_DURATION, knockback_force=KNOCKBACK_DISTANCE + 10,
+        min_x=PLAYER_SPRITE_HALF_WIDTH, max_x=GAME_WIDTH - PLAYER_SPRITE_HALF_WIDTH)
+    eventful = outcomes.missed | outcomes.clash | (outcomes.p1_outcome != combat.NO_CONTACT) | \
+               (outcomes.p2_outcome != combat.NO_CONTACT)
+    failed = set()
+    for i in np.flatnonzero(eventful).tolist():
+        room_state, p1, p2 = matches[i]
+        if not run_room_phase(apply_combat_outcome, room_state, p1, p2, outcomes, i):
+            failed.add(room_state['id'])
+    both_attacking = outcomes.both_attacking.tolist()
+    for i in np.flatnonzero(outcomes.engaged).tolist():
+        room_state = matches[i][0]
+        if room_state['id'] not in failed:
+            update_sword_effects(room_state, both_attacking[i])
+    return failed
+
+def collect_player_slots(lineups):
+    """Store slots for the batched passes: (stepped by physics, screen-wrapped)"""
+    physics_slots = []; wrap_slots = []
+    for room_state, p1, p2 in lineups:
+        if p1 is not None: physics_slots.append(p1.slot); wrap_slots.append(p1.slot)
+        if p2 is not None:
+            wrap_slots.append(p2.slot)
+            # A knocked-out or unopposed AI is frozen (update_ai skips it entirely)
+            if not room_state['ai_opponent_active'] or (p1 is not None and p2['health'] > 0):
+                physics_slots.append(p2.slot)
+    return np.array(physics_slots, dtype=np.intp), np.array(wrap_slots, dtype=np.intp)
+
+def run_room_phase(phase, room_state, *args):
+    """Run one tick phase for a room; False (and the room sits out the rest of the tick) if it raised"""
+    try:
+        phase(room_state, *args)
+        return True
+    except Exception as e:
+        room_phase_failures.labels(phase.__name__).inc()
+        tick_log.exception('room_phase_failed', phase=phase.__name__, room=room_state.get('id'), error=str(e))
+        return False
+
+def simulate_lineups(lineups):
+    """Physics for every player, AI decisions, screen wrap and combat for every match at once.
+
+    Returns the ids of rooms that failed a phase."""
+    laps = TRACER.enabled and TRACER.laps()
+    physics_slots, wrap_slots = collect_player_slots(lineups)
+    step_physics(player_store, physics_slots, GRAVITY, GROUND_LEVEL, ATTACK_COOLDOWN)
+    if laps: laps.lap('step_physics')
+    failed = run_ai(lineups)
+    if laps: laps.lap('update_ai')
+    wrap_positions(player_store, wrap_slots, GAME_WIDTH, PLAYER_SPRITE_HALF_WIDTH)
+    if laps: laps.lap('wrap_positions')
+    failed |= resolve_all_combat([lineup for lineup in lineups if lineup[0]['id'] not in failed])
+    if laps: laps.lap('combat')
+    return failed
+
+def tick_rooms(rooms, inputs=()):
+    """Advance rooms by one frame; one bad room never stalls the rest.
+
+    `inputs` is (sid, client frame, actions, target frame) for input that has
+    not been queued yet. Returns (rooms whose new state should be sent, events
+    this tick produced).
+
+    Per-room logic runs in phases around batched passes over the player store:
+    rollback rooms save their state, queued input is applied once screen timers
+    have settled (rooms with input meant for an earlier frame are rewound and
+    re-run to the present together), then the batched simulation runs for
+    every match at once."""
+    laps = TRACER.enabled and TRACER.laps()
+    rollback_histories.start_tick()
+    del events[:]
+    if inputs:
+        arrival_frames = {sid: room_state['frame'] for room_state in rooms for sid in room_state['players']}
+        for sid, client_frame, actions, target_frame in inputs:
+            if sid in arrival_frames:
+                input_buffer.push(sid, client_frame, arrival_frames[sid], actions, target_frame)
+        if laps: laps.lap('queue_inputs', inputs=len(inputs))
+    for room_state in rooms:
+        run_room_phase(save_rollback_frame, room_state)
+    if laps: laps.lap('save_rollback')
+    rooms = [room_state for room_state in rooms if run_room_phase(advance_room_timers, room_state)]
+    if laps: laps.lap('advance_room_timers')
+    lineups = [(room_state, get_player_by_id(room_state, 'player1'), get_player_by_id(room_state, 'player2'))
+               for room_state in rooms if room_state['current_screen'] in ('PLAYING', 'SPECIAL')]
+    rewinds = []
+    failed = {lineup[0]['id'] for lineup in lineups if not run_room_phase(apply_room_inputs, *lineup, rewinds)}
+    if laps: laps.lap('apply_room_inputs')
+    if rewinds:
+        failed |= resimulate_rooms(rewinds)
+        if laps: laps.lap('resimulate_rooms', rooms=len(rewinds))
+    failed |= simulate_lineups([lineup for lineup in lineups if lineup[0]['id'] not in failed and
+                                lineup[0]['current_screen'] in ('PLAYING', 'SPECIAL')])
+    return [room_state for room_state in rooms if room_state['id'] not in failed], list(events)
+
@@ -0,0 +1,224 @@
+# Kylander: The Reckoning - Structured Game Logging
+# Every log call is one structured event (a name plus key=value fields) in a
+# category. A call whose category/level is off returns before building a
+# record; enabled records pass per-category sampling and rate limits and go
+# onto a bounded queue that a background writer drains, so the tick never
+# waits on stdout. Levels, sampling and limits can be changed at runtime.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+ROOT_LOGGER = 'kylander'
+QUEUE_SIZE = 10000                 # Records waiting for the writer; beyond this new records are dropped
+DEFAULT_RATE_LIMIT = 200           # Records per second per category
+LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING,
+          'ERROR': logging.ERROR, 'CRITICAL': logging.CRITICAL}
+
+DEBUG = logging.DEBUG; INFO = logging.INFO; WARNING = logging.WARNING; ERROR = logging.ERROR
+
+
+def _category(record):
+    return record.name[len(ROOT_LOGGER) + 1:] or 'root'
+
+
+class SamplingFilter(logging.Filter):
+    """Per-category 1-in-N sampling (below WARNING) and a records-per-second cap (all levels)"""
+
+    def __init__(self, default_rate_limit=DEFAULT_RATE_LIMIT, clock=time.monotonic):
+        super().__init__()
+        self.default_rate_limit = default_rate_limit
+        self.clock = clock
+        self.sample_every = {}   # category -> keep one record in N
+        self.rate_limits = {}    # category -> records per second (None = unlimited)
+        self._seen = {}          # category -> records offered (for sampling)
+        self._windows = {}       # category -> [window start, records passed, records suppressed]
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def filter(self, record):
+        category = _category(record)
+        every = self.sample_every.get(category, 1)
+        if every > 1 and record.levelno < logging.WARNING:
+            seen = self._seen.get(category, 0)
+            self._seen[category] = seen + 1
+            if seen % every:
+                self.sampled_out += 1
+                return False
+        limit = self.rate_limits.get(category, self.default_rate_limit)
+        if limit is None:
+            return True
+        now = self.clock()
+        window = self._windows.get(category)
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window else 0
+            window = self._windows[category] = [now, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed  # Reported on the first record of the next window
+        if window[1] >= limit:
+            window[2] += 1
+            self.rate_limited += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record and counts it"""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # Formatting happens on the writer side, not in the caller
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per line: t, level, cat, event, then the event's fields"""
+
+    def format(self, record):
+        entry = {'t': round(record.created, 3), 'level': record.levelname,
+                 'cat': _category(record), 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', None) or {})
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed_before'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable: time level category event key=value ..."""
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        line = (f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {_category(record):<7} "
+                f"{record.getMessage()}" + ''.join(f" {k}={v}" for k, v in fields.items()))
+        if getattr(record, 'suppressed', 0):
+            line += f" (suppressed {record.suppressed} before)"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class EventLogger:
+    """log.info('event_name', key=value, ...) for one category"""
+    __slots__ = ('logger',)
+
+    def __init__(self, category):
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+    def enabled_for(self, level):
+        """Guard for hot paths where even building the fields costs too much"""
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, event, **fields): self._log(logging.DEBUG, event, fields)
+    def info(self, event, **fields): self._log(logging.INFO, event, fields)
+    def warning(self, event, **fields): self._log(logging.WARNING, event, fields)
+    def error(self, event, **fields): self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """ERROR with the current exception's traceback"""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+_sampler = SamplingFilter()
+_handler = None
+_listener = None
+
+
+def get_logger(category):
+    return EventLogger(category)
+
+
+def parse_level_spec(spec):
+    """'INFO' or 'INFO,tick=DEBUG,combat=WARNING' -> {category or None: level}"""
+    levels = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        category, _, level = part.rpartition('=')
+        levels[category.strip() or None] = LEVELS[level.strip().upper()]
+    return levels
+
+
+def set_level(level, category=None):
+    """Change a category's level (or the default for all categories) at runtime"""
+    if isinstance(level, str): level = LEVELS[level.upper()]
+    name = f"{ROOT_LOGGER}.{category}" if category else ROOT_LOGGER
+    logging.getLogger(name).setLevel(level)
+
+
+def set_sampling(category, every):
+    """Keep one in `every` DEBUG/INFO records of a category (1 = keep all)"""
+    if every <= 1: _sampler.sample_every.pop(category, None)
+    else: _sampler.sample_every[category] = int(every)
+
+
+def set_rate_limit(category, per_second):
+    """Cap a category's records per second (None = unlimited)"""
+    _sampler.rate_limits[category] = per_second
+
+
+def configure(level_spec=None, json_format=None, stream=None, queue_size=QUEUE_SIZE):
+    """Install the queue handler and start the background writer (idempotent).
+
+    Defaults come from KYLANDER_LOG_LEVEL (e.g. 'INFO,tick=DEBUG') and
+    KYLANDER_LOG_FORMAT ('json' or 'text')."""
+    global _handler, _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    root.propagate = False
+    levels = {None: logging.INFO}
+    levels.update(parse_level_spec(level_spec if level_spec is not None else os.environ.get('KYLANDER_LOG_LEVEL')))
+    for category, level in levels.items():
+        set_level(level, category)
+    if _handler is not None:
+        return
+    if json_format is None:
+        json_format = os.environ.get('KYLANDER_LOG_FORMAT', 'json').lower() != 'text'
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonLineFormatter() if json_format else TextFormatter())
+    _handler = DroppingQueueHandler(queue.Queue(queue_size))
+    _handler.addFilter(_sampler)
+    root.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(_handler.queue, writer)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Flush queued records and stop the writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    root = logging.getLogger(ROOT_LOGGER)
+    categories = {name[len(ROOT_LOGGER) + 1:]: logging.getLevelName(logger.level)
+                  for name, logger in logging.Logger.manager.loggerDict.items()
+                  if name.startswith(ROOT_LOGGER + '.') and isinstance(logger, logging.Logger) and logger.level}
+    return {'level': logging.getLevelName(root.level), 'category_levels': categories,
+            'sample_every': dict(_sampler.sample_every),
+            'rate_limits': {'default': _sampler.default_rate_limit, **_sampler.rate_limits},
+            'queued': _handler.queue.qsize() if _handler else 0,
+            'dropped': {'sampled_out': _sampler.sampled_out, 'rate_limited': _sampler.rate_limited,
+                        'queue_full': _handler.dropped if _handler else 0}}
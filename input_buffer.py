@@ -0,0 +1,101 @@
+# Kylander: The Reckoning - Per-Tick Input Buffer
+# Player input is queued as it arrives and applied once per tick at a fixed
+# point of the simulation, so sending faster than the tick rate buys nothing.
+# Each player's queue is bounded; entries carry the client's frame stamp
+# (repeated or out-of-order stamps are dropped), the room frame they arrived
+# on (entries that waited too long are dropped) and the room frame they were
+# meant for (used by rollback), and whatever is still pending at the tick is
+# coalesced into a single list of actions. Rollback rooms take it per target
+# frame instead, so late messages meant for different frames stay apart and a
+# re-run applies each at the frame it was made for.
+
+from collections import deque
+
+MAX_PENDING = 8          # Queued messages per player; older ones are overwritten
+MAX_AGE_FRAMES = 6       # Room frames an entry may wait before it is too stale to apply
+MAX_ACTIONS_PER_MESSAGE = 8
+
+
+def coalesce_actions(messages):
+    """Merge one tick's action lists (oldest first) into one.
+
+    Moves follow the newest message (the keys held now), a jump or attack in
+    any message is kept once, and the newest duck command wins."""
+    merged = [action for action in messages[-1] if action.get('type') == 'move']
+    jump = attack = False; duck = None
+    for actions in messages:
+        for action in actions:
+            action_type = action.get('type')
+            if action_type == 'jump': jump = True
+            elif action_type == 'attack': attack = True
+            elif action_type == 'duck': duck = action
+    if jump: merged.append({'type': 'jump'})
+    if duck is not None: merged.append(duck)
+    if attack: merged.append({'type': 'attack'})
+    return merged
+
+
+class InputBuffer:
+    """Bounded, frame-stamped input queues for every player, drained once per tick"""
+
+    def __init__(self, max_pending=MAX_PENDING, max_age_frames=MAX_AGE_FRAMES):
+        self.max_pending = max_pending
+        self.max_age_frames = max_age_frames
+        self.queues = {}              # sid -> deque of (arrival room frame, target room frame, actions)
+        self.last_client_frame = {}   # sid -> newest accepted client frame stamp
+        self.stats = {'received': 0, 'applied': 0, 'coalesced': 0,
+                      'stale_dropped': 0, 'expired_dropped': 0, 'overflow_dropped': 0}
+
+    def push(self, sid, client_frame, arrival_frame, actions, target_frame=None):
+        """Queue one message; False if it was dropped as stale.
+
+        target_frame is the room frame the input was meant for (default: the
+        frame after it arrived, i.e. the next tick); it is never later than that."""
+        if client_frame is not None:
+            last_frame = self.last_client_frame.get(sid)
+            if last_frame is not None and client_frame <= last_frame:
+                self.stats['stale_dropped'] += 1
+                return False
+            self.last_client_frame[sid] = client_frame
+        pending = self.queues.get(sid)
+        if pending is None:
+            pending = self.queues[sid] = deque(maxlen=self.max_pending)
+        elif len(pending) == self.max_pending:
+            self.stats['overflow_dropped'] += 1
+        next_frame = arrival_frame + 1
+        target_frame = next_frame if target_frame is None else min(target_frame, next_frame)
+        pending.append((arrival_frame, target_frame, actions[:MAX_ACTIONS_PER_MESSAGE]))
+        self.stats['received'] += 1
+        return True
+
+    def has_pending(self, sid):
+        return sid in self.queues
+
+    def _take_fresh(self, sid, current_frame):
+        pending = self.queues.pop(sid, None)
+        if not pending:
+            return []
+        fresh = [entry for entry in pending if current_frame - entry[0] <= self.max_age_frames]
+        self.stats['expired_dropped'] += len(pending) - len(fresh)
+        return fresh
+
+    def take(self, sid, current_frame):
+        """Remove sid's queued input; (earliest target frame, coalesced actions) or None if nothing fresh is left"""
+        fresh = self._take_fresh(sid, current_frame)
+        if not fresh:
+            return None
+        self.stats['applied'] += 1
+        self.stats['coalesced'] += len(fresh) - 1
+        return min(entry[1] for entry in fresh), coalesce_actions([entry[2] for entry in fresh])
+
+    def take_frames(self, sid, current_frame):
+        """Remove sid's queued input; [(target frame, coalesced actions)], earliest first, one per target frame"""
+        by_frame = {}
+        for _, target_frame, actions in self._take_fresh(sid, current_frame):
+            by_frame.setdefault(target_frame, []).append(actions)
+        self.stats['applied'] += len(by_frame)
+        self.stats['coalesced'] += sum(len(messages) - 1 for messages in by_frame.values())
+        return [(target_frame, coalesce_actions(by_frame[target_frame])) for target_frame in sorted(by_frame)]
+
+    def remove(self, sid):
+        self.queues.pop(sid, None); self.last_client_frame.pop(sid, None)
@@ -0,0 +1,266 @@
+# Kylander: The Reckoning - Split Simulation / I/O Processes
+# Optional deployment in which the simulation gets a core to itself. The
+# simulation process runs app.py as usual, but owns no client sockets: every
+# Socket.IO emit it makes (room updates included, one record per group of
+# recipients) is pickled into a shared-memory BroadcastRing (shm_ring.py).
+# One or more I/O processes hold the client connections. Each reads the ring,
+# encodes every message once and fans it out to whichever recipients are
+# connected to it, and passes client events (connects, disconnects, input)
+# back through its own shared-memory ShmQueue. A burst of connects or a slow
+# client then costs an I/O process time, not the tick.
+#
+# The simulation process still serves HTTP on its own port (health, admin);
+# players connect to the I/O processes.
+#
+#   python io_process.py serve --io-processes 2      # simulation on :5000, I/O on :5001-5002
+#   python io_process.py io --ring NAME --queue NAME --port 5001
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+from urllib.parse import urlencode
+
+import socketio
+
+import asset_tiers
+import build_assets
+import game_log
+import static_files
+from packet_cache import EncodedJSON, encode_json
+from shm_ring import BroadcastRing, ShmQueue
+
+RING_BYTES = 64 << 20        # Simulation -> I/O ring; a reader more than this far behind loses updates
+QUEUE_BYTES = 8 << 20        # I/O -> simulation queue, per I/O process
+POLL_S = 0.001               # Idle wait between looks at the ring / the input queues
+INPUT_BATCH = 2000           # Inputs dispatched before yielding to the game loop
+DEFAULT_SIM_PORT = 5000
+
+net_log = game_log.get_logger('net')
+
+
+# --- Simulation side ---
+
+class RingEmitManager(socketio.PubSubManager):
+    """Client manager of the simulation process: emits go into the ring, for the I/O processes to deliver.
+
+    The simulation never sees the clients' transports, so a client exists here
+    only as the bookkeeping register() sets up when its I/O process reports it."""
+    name = 'shm-ring'
+
+    def __init__(self, ring_name, channel='kylander'):
+        super().__init__(channel=channel, write_only=True)
+        self.ring = BroadcastRing(ring_name)
+        self.stats = {'published': 0, 'bytes': 0, 'too_large': 0}
+
+    def register(self, sid):
+        """Make a client reported by an I/O process connected to the default namespace"""
+        # As BaseManager.connect, with the I/O process's sid doubling as the engine.io sid (nothing is sent on it here)
+        self.enter_room(sid, '/', None, eio_sid=sid)
+        self.enter_room(sid, '/', sid, eio_sid=sid)
+
+    def can_disconnect(self, sid, namespace):
+        # The I/O process holding the client drops it, then reports the disconnect back
+        self._publish({'method': 'disconnect', 'sid': sid, 'namespace': namespace or '/'})
+        return False
+
+    def _publish(self, data):
+        body = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            self.ring.write(body)
+        except ValueError as error:
+            self.stats['too_large'] += 1
+            net_log.error('ring_publish_failed', method=data.get('method'), event=data.get('event'), error=str(error))
+            return
+        self.stats['published'] += 1; self.stats['bytes'] += len(body)
+
+
+def _environ_for(app, query_string, remote_addr):
+    from werkzeug.test import EnvironBuilder
+    environ = EnvironBuilder(path='/socket.io/', query_string=query_string).get_environ()
+    environ['REMOTE_ADDR'] = remote_addr or ''
+    environ['flask.app'] = app   # Flask-SocketIO builds each handler's request context from this
+    return environ
+
+
+class SimInputs:
+    """The simulation's end of the I/O processes' input queues: replays their client events into app.py's handlers"""
+
+    def __init__(self, socketio_ext, app, queue_names):
+        self.socketio = socketio_ext
+        self.app = app
+        self.queues = [ShmQueue(name) for name in queue_names]
+        self.stats = {'connects': 0, 'disconnects': 0, 'events': 0}
+
+    def dispatch(self, message):
+        kind, sid = message[0], message[1]
+        server = self.socketio.server
+        if kind == 'event':
+            self.stats['events'] += 1
+            server._trigger_event(message[2], '/', sid, *message[3])
+        elif kind == 'connect':
+            self.stats['connects'] += 1
+            server.manager.register(sid)
+            environ = server.environ[sid] = _environ_for(self.app, message[2], message[3])
+            server._trigger_event('connect', '/', sid, environ, None)
+        elif kind == 'disconnect':
+            self.stats['disconnects'] += 1
+            if server.manager.is_connected(sid, '/'):
+                server._trigger_event('disconnect', '/', sid)
+                server.manager.disconnect(sid, '/', ignore_queue=True)
+            server.environ.pop(sid, None)
+
+    def run(self):
+        """Background task: dispatch queued client events as they arrive"""
+        while True:
+            dispatched = 0
+            for queue in self.queues:
+                for record in queue.get_all(limit=INPUT_BATCH):
+                    try:
+                        self.dispatch(pickle.loads(record))
+                    except Exception as e:
+                        net_log.exception('sim_input_failed', error=str(e))
+                    dispatched += 1
+            self.socketio.sleep(0 if dispatched else POLL_S)
+
+    def report(self):
+        return dict(self.stats, queues=[queue.stats() for queue in self.queues])
+
+
+# --- I/O side ---
+
+class RingFanoutManager(socketio.PubSubManager):
+    """Client manager of an I/O process: delivers what the simulation published to the clients connected here"""
+    name = 'shm-ring'
+
+    def __init__(self, ring_name, channel='kylander'):
+        super().__init__(channel=channel)
+        self.reader = BroadcastRing(ring_name).reader()
+        self.stats = {'messages': 0, 'encoded': 0}
+
+    def _publish(self, data):
+        # This process only relays what the simulation published; it has nothing of its own to send
+        raise RuntimeError("an I/O process doesn't publish to the simulation ring")
+
+    def _listen(self):
+        while True:
+            records = self.reader.read(limit=INPUT_BATCH)
+            if not records:
+                self.server.sleep(POLL_S)
+            for record in records:
+                yield record
+
+    def _handle_emit(self, message):
+        self.stats['messages'] += 1
+        data = message['data']
+        if not isinstance(data, (EncodedJSON, bytes, bytearray, str)) and data is not None:
+            data = encode_json(data)   # Once for every recipient of this message
+            self.stats['encoded'] += 1
+        socketio.base_manager.BaseManager.emit(self, message['event'], data, namespace=message.get('namespace'),
+                                               room=message.get('room'), skip_sid=message.get('skip_sid'))
+
+    def report(self):
+        return dict(self.stats, lapped=self.reader.lapped, lost_bytes=self.reader.lost_bytes)
+
+
+def create_io_app(ring_name, queue_name):
+    """Flask app of one I/O process: serves the client page and assets and relays Socket.IO traffic"""
+    from flask import Flask, render_template, request
+    from flask_socketio import SocketIO
+    from packet_cache import packet_json
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    app = Flask(__name__, static_folder=os.path.join(root, 'static'), template_folder=os.path.join(root, 'templates'))
+    asset_tiers.install(app, build_assets.install(app, os.path.join(root, 'static')))
+    static_server = static_files.install(app)
+    manager = RingFanoutManager(ring_name)
+    io = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", logger=False, engineio_logger=False,
+                  json=packet_json, client_manager=manager)
+    inputs = ShmQueue(queue_name)
+
+    def forward(message):
+        if not inputs.put(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)):
+            net_log.warning('sim_queue_full', kind=message[0], sid=message[1])
+
+    @app.route('/')
+    def index(): return render_template('index.html')
+
+    @app.route('/health')
+    def health():
+        return {'status': 'ok', 'role': 'io', 'clients': len(manager.rooms.get('/', {}).get(None, ())),
+                'ring': manager.report(), 'queue': inputs.stats(), 'static': static_server.report()}
+
+    @io.on('connect')
+    def on_connect():
+        forward(('connect', request.sid, urlencode(request.args), request.remote_addr))
+
+    @io.on('disconnect')
+    def on_disconnect():
+        forward(('disconnect', request.sid))
+
+    def on_event(event, sid, *args):
+        forward(('event', sid, event, args))
+    # Straight on the python-socketio server: Flask-SocketIO's wrapper mistakes a catch-all's event name for the sid
+    io.server.on('*', on_event, namespace='/')
+
+    return app, io
+
+
+# --- Launcher ---
+
+def serve(io_processes, base_port, sim_port):
+    """Run the simulation and `io_processes` I/O processes until interrupted; owns the shared memory"""
+    import signal
+    ring = BroadcastRing(capacity=RING_BYTES, create=True)
+    queues = [ShmQueue(capacity=QUEUE_BYTES, create=True) for _ in range(io_processes)]
+    here = os.path.dirname(os.path.abspath(__file__))
+    sim_env = dict(os.environ, PORT=str(sim_port), KYLANDER_SIM_RING=ring.name,
+                   KYLANDER_SIM_INPUTS=','.join(queue.name for queue in queues))
+    processes = [subprocess.Popen([sys.executable, os.path.join(here, 'app.py')], env=sim_env)]
+    print(f"simulation: port {sim_port} (pid {processes[0].pid})", file=sys.stderr)
+    for i, queue in enumerate(queues):
+        port = base_port + i
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), 'io', '--ring', ring.name,
+                                           '--queue', queue.name, '--port', str(port)]))
+        print(f"I/O {i}: port {port} (pid {processes[-1].pid})", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None: process.terminate()
+        for process in processes:
+            process.wait()
+        for shared in [ring] + queues:
+            shared.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the simulation and the client I/O in separate processes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='start the simulation and N I/O processes')
+    serve_parser.add_argument('--io-processes', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    serve_parser.add_argument('--base-port', type=int, default=5001, help='first I/O port (clients connect here)')
+    serve_parser.add_argument('--sim-port', type=int, default=DEFAULT_SIM_PORT, help='simulation HTTP port (health, admin)')
+    io_parser = commands.add_parser('io', help='run one I/O process (started by serve)')
+    io_parser.add_argument('--ring', required=True)
+    io_parser.add_argument('--queue', required=True)
+    io_parser.add_argument('--port', type=int, required=True)
+    args = parser.parse_args(argv)
+    game_log.configure(os.environ.get('KYLANDER_LOG_LEVEL', 'WARNING'))
+
+    if args.command == 'serve':
+        return serve(args.io_processes, args.base_port, args.sim_port)
+    app, io = create_io_app(args.ring, args.queue)
+    net_log.info('io_process_starting', port=args.port, ring=args.ring)
+    io.run(app, host='0.0.0.0', port=args.port, debug=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
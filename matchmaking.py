@@ -0,0 +1,181 @@
+# Kylander: The Reckoning - Matchmaking
+# Players who ask for a match wait in an indexed queue instead of walking into
+# whichever room is open. Tickets are filed by game mode and rating band, and
+# within a band by preferred character, oldest first. Pairing looks at the
+# player's own band and then the bands around it, nearest first, so the work
+# doesn't depend on how many players are waiting. The band window widens the
+# longer a player waits (a heap says whose window is due), and a player who
+# waits past the AI fallback is handed back for a match against the AI.
+# app.py owns the sockets and rooms; this module only decides who meets whom.
+
+import heapq
+import itertools
+import time
+from collections import OrderedDict, deque
+
+RATING_BAND = 100            # Rating points per band; players in the same band are an equal match
+DEFAULT_RATING = 1000
+WIDEN_EVERY_S = 5.0          # A waiting player accepts one more band either side this often
+MAX_SPREAD = 10              # Bands either side a player will ever accept
+AI_FALLBACK_S = 30.0         # Waiting this long gets a match against the AI
+TIME_TO_MATCH_SAMPLES = 1000
+
+
+class Ticket:
+    __slots__ = ('sid', 'mode', 'character', 'rating', 'band', 'enqueued_at', 'spread', 'widen_at')
+
+    def __init__(self, sid, mode, character, rating, band, enqueued_at):
+        self.sid = sid
+        self.mode = mode
+        self.character = character   # Preferred character, or None
+        self.rating = rating
+        self.band = band
+        self.enqueued_at = enqueued_at
+        self.spread = 1              # Bands either side this player accepts right now
+        self.widen_at = None         # When the window next widens
+
+
+def _oldest_other(waiting, ticket):
+    # The players in one index slot, oldest first; skips the one doing the looking
+    for candidate in waiting.values():
+        if candidate is not ticket:
+            return candidate
+    return None
+
+
+class MatchmakingQueue:
+    """Waiting players by (mode, rating band) -> preferred character -> oldest first"""
+
+    def __init__(self, rating_band=RATING_BAND, widen_every_s=WIDEN_EVERY_S, max_spread=MAX_SPREAD,
+                 ai_fallback_s=AI_FALLBACK_S, clock=time.monotonic):
+        self.rating_band = rating_band
+        self.widen_every_s = widen_every_s
+        self.max_spread = max_spread
+        self.ai_fallback_s = ai_fallback_s
+        self.clock = clock
+        self.tickets = OrderedDict()  # sid -> Ticket, in the order they joined
+        self.index = {}               # (mode, band) -> {character: OrderedDict(sid -> Ticket)}
+        self.depth_by_mode = {}
+        self._widen_heap = []         # (due time, seq, sid); stale entries are skipped when popped
+        self._seq = itertools.count()
+        self.time_to_match = deque(maxlen=TIME_TO_MATCH_SAMPLES)   # Seconds, human pairs and AI fallbacks
+        self.stats = {'queued': 0, 'matched_pairs': 0, 'ai_fallbacks': 0, 'cancelled': 0}
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, sid):
+        return sid in self.tickets
+
+    def enqueue(self, sid, mode, character=None, rating=DEFAULT_RATING):
+        """Queue a player; returns (ticket, opponent ticket) when someone suitable is already waiting, else None"""
+        self.cancel(sid)
+        now = self.clock()
+        ticket = Ticket(sid, mode, character, rating, int(rating // self.rating_band), now)
+        self.stats['queued'] += 1
+        opponent = self._find_opponent(ticket)
+        if opponent is not None:
+            self._remove(opponent)
+            self._record_match(now, opponent, ticket)
+            return opponent, ticket
+        self._add(ticket)
+        return None
+
+    def cancel(self, sid):
+        """Take a player out of the queue (left, or gave up); True if they were waiting"""
+        ticket = self.tickets.get(sid)
+        if ticket is None:
+            return False
+        self._remove(ticket)
+        self.stats['cancelled'] += 1
+        return True
+
+    def poll(self):
+        """Widen the windows that are due and retry them; returns ([(ticket, opponent)], [tickets for the AI])"""
+        now = self.clock()
+        pairs = []
+        heap = self._widen_heap
+        while heap and heap[0][0] <= now:
+            due, _, sid = heapq.heappop(heap)
+            ticket = self.tickets.get(sid)
+            if ticket is None or ticket.widen_at != due:
+                continue
+            ticket.spread += 1
+            opponent = self._find_opponent(ticket)
+            if opponent is None:
+                self._schedule_widen(ticket, now + self.widen_every_s)
+            else:
+                self._remove(opponent); self._remove(ticket)
+                self._record_match(now, opponent, ticket)
+                pairs.append((opponent, ticket))
+        fallbacks = []
+        while self.tickets:
+            ticket = next(iter(self.tickets.values()))
+            if now - ticket.enqueued_at < self.ai_fallback_s:
+                break
+            self._remove(ticket)
+            self.time_to_match.append(now - ticket.enqueued_at)
+            self.stats['ai_fallbacks'] += 1
+            fallbacks.append(ticket)
+        return pairs, fallbacks
+
+    def position(self, sid):
+        """How many players are waiting in this player's mode"""
+        ticket = self.tickets.get(sid)
+        return self.depth_by_mode.get(ticket.mode, 0) if ticket else 0
+
+    def _find_opponent(self, ticket):
+        # Own band first, then one band further out either side; a different character beats a mirror match
+        for distance in range(ticket.spread + 1):
+            for band in ((ticket.band,) if distance == 0 else (ticket.band - distance, ticket.band + distance)):
+                by_character = self.index.get((ticket.mode, band))
+                if not by_character:
+                    continue
+                mirror = None
+                for character, waiting in by_character.items():
+                    candidate = _oldest_other(waiting, ticket)
+                    if candidate is None:
+                        continue
+                    if character != ticket.character or ticket.character is None:
+                        return candidate
+                    mirror = candidate
+                if mirror is not None:
+                    return mirror
+        return None
+
+    def _schedule_widen(self, ticket, due):
+        ticket.widen_at = None
+        if ticket.spread < self.max_spread:
+            ticket.widen_at = due
+            heapq.heappush(self._widen_heap, (due, next(self._seq), ticket.sid))
+
+    def _add(self, ticket):
+        self.tickets[ticket.sid] = ticket
+        self.index.setdefault((ticket.mode, ticket.band), {}).setdefault(ticket.character, OrderedDict())[ticket.sid] = ticket
+        self.depth_by_mode[ticket.mode] = self.depth_by_mode.get(ticket.mode, 0) + 1
+        self._schedule_widen(ticket, ticket.enqueued_at + self.widen_every_s)
+
+    def _remove(self, ticket):
+        del self.tickets[ticket.sid]
+        key = (ticket.mode, ticket.band)
+        by_character = self.index[key]
+        waiting = by_character[ticket.character]
+        del waiting[ticket.sid]
+        if not waiting:
+            del by_character[ticket.character]
+            if not by_character: del self.index[key]
+        self.depth_by_mode[ticket.mode] -= 1
+
+    def _record_match(self, now, *tickets):
+        self.stats['matched_pairs'] += 1
+        for ticket in tickets:
+            self.time_to_match.append(now - ticket.enqueued_at)
+
+    def report(self):
+        waits = sorted(self.time_to_match)
+        return dict(self.stats, depth=len(self.tickets), depth_by_mode=dict(self.depth_by_mode),
+                    oldest_wait_s=round(self.clock() - next(iter(self.tickets.values())).enqueued_at, 2)
+                    if self.tickets else None,
+                    time_to_match_s={'samples': len(waits),
+                                     'p50': round(waits[len(waits) // 2], 2) if waits else None,
+                                     'p95': round(waits[int(len(waits) * 0.95)], 2) if waits else None})
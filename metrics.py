@@ -0,0 +1,168 @@
+# Kylander: The Reckoning - Metrics
+# Counters and fixed-bucket histograms for /metrics, rendered in the
+# Prometheus text format. Recording is a dict-free attribute update on an
+# object bound once at import (a histogram adds a bisect over its bucket
+# bounds), so the tick can afford it on every frame. There are no locks: the
+# server runs on eventlet green threads, which only switch at I/O, so no
+# update is ever interleaved with another. Gauges (rooms by screen and the
+# like) are functions read at scrape time and cost the tick nothing.
+#
+# A histogram's _sum and _count give totals too: kylander_broadcast_payload_bytes_sum
+# is bytes broadcast, its _count the messages.
+
+import bisect
+import functools
+import math
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'kylander_'
+
+# Bucket bounds (upper, inclusive); everything above the last lands in +Inf
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+TICK_BUCKETS = (0.0005, 0.001, 0.002, 0.004, 0.008, 1 / 60, 1 / 30, 0.0667, 0.133, 0.25)   # 1/60 s: the frame budget
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # Per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Family:
+    """One metric name: its children by label values (a single unlabelled child when it has no labels)"""
+
+    def __init__(self, kind, name, documentation, labelnames, make_child):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.make_child = make_child
+        self.children = {}
+
+    def labels(self, *values):
+        """The child for these label values; look it up once and keep it rather than on every update"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self.children[values] = self.make_child()
+        return child
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.gauges = {}   # name -> (documentation, labelnames, fn)
+
+    def _family(self, kind, name, documentation, labelnames, make_child):
+        if name in self.families or name in self.gauges:
+            raise ValueError(f"metric {name} is already registered")
+        family = self.families[name] = Family(kind, PREFIX + name, documentation, labelnames, make_child)
+        return family.labels() if not family.labelnames else family
+
+    def counter(self, name, documentation, labelnames=()):
+        """A Counter, or a Family of them when labelnames are given"""
+        return self._family('counter', name, documentation, labelnames, Counter)
+
+    def histogram(self, name, documentation, buckets=SECONDS_BUCKETS, labelnames=()):
+        """A Histogram, or a Family of them when labelnames are given"""
+        buckets = tuple(sorted(buckets))
+        return self._family('histogram', name, documentation, labelnames, lambda: Histogram(buckets))
+
+    def gauge(self, name, documentation, fn, labelnames=()):
+        """A gauge read at scrape time: fn() returns a number, or {label values: number} with labelnames"""
+        if name in self.families or name in self.gauges:
+            raise ValueError(f"metric {name} is already registered")
+        self.gauges[name] = (documentation, tuple(labelnames), fn)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {_escape_help(family.documentation)}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children.items():
+                labels = list(zip(family.labelnames, values))
+                if family.kind == 'counter':
+                    lines.append(_sample(family.name, labels, child.value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(child.bounds + (math.inf,), child.counts):
+                    cumulative += count
+                    lines.append(_sample(family.name + '_bucket', labels + [('le', _number(bound))], cumulative))
+                lines.append(_sample(family.name + '_sum', labels, child.sum))
+                lines.append(_sample(family.name + '_count', labels, cumulative))
+        for name, (documentation, labelnames, fn) in self.gauges.items():
+            name = PREFIX + name
+            lines.append(f"# HELP {name} {_escape_help(documentation)}")
+            lines.append(f"# TYPE {name} gauge")
+            value = fn()
+            if labelnames:
+                for values, sample in sorted(value.items()):
+                    values = values if isinstance(values, tuple) else (values,)
+                    lines.append(_sample(name, list(zip(labelnames, values)), sample))
+            else:
+                lines.append(_sample(name, [], value))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return f"{name} {_number(value)}"
+    label_text = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for key, label in labels)
+    return f"{name}{{{label_text}}} {_number(value)}"
+
+
+def timed(histogram, clock=time.perf_counter):
+    """Decorator: observe each call's duration in `histogram` (a Histogram child)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(clock() - start)
+        return wrapper
+    return decorator
+
+
+# The process's metrics; game modules register theirs here at import
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+render = REGISTRY.render
@@ -0,0 +1,76 @@
+# Kylander: The Reckoning - Packet Cache
+# Room updates are encoded once and the encoded text or bytes go to every
+# recipient. A payload's JSON is wrapped in EncodedJSON; packet_json, which is
+# installed as Socket.IO's json module, splices that text into each packet as is
+# instead of encoding the payload again for every sid. PacketCache keeps a room's
+# encoded payloads for one room frame, so emits later in the same frame
+# (handlers, then the tick) reuse them too.
+
+import json
+
+SEPARATORS = (',', ':')   # What Socket.IO packets use
+
+
+class EncodedJSON(str):
+    """JSON text encoded once; packet_json puts it into packets unchanged"""
+    __slots__ = ()
+
+
+def encode_json(value):
+    return EncodedJSON(json.dumps(value, separators=SEPARATORS))
+
+
+def join_object(**fields):
+    """JSON object text from a mix of plain values and EncodedJSON members"""
+    return EncodedJSON('{' + ','.join(
+        json.dumps(key) + ':' + (value if isinstance(value, EncodedJSON) else json.dumps(value, separators=SEPARATORS))
+        for key, value in fields.items()) + '}')
+
+
+class packet_json:
+    """Drop-in json module for SocketIO(json=...): EncodedJSON event arguments are spliced, not re-encoded"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if type(obj) is list and any(isinstance(item, EncodedJSON) for item in obj):
+            return '[' + ','.join(item if isinstance(item, EncodedJSON) else json.dumps(item, **kwargs)
+                                  for item in obj) + ']'
+        return json.dumps(obj, **kwargs)
+
+    loads = staticmethod(json.loads)
+
+
+class PacketCache:
+    """Encoded payloads per room, kept for the room frame they were built in"""
+
+    def __init__(self):
+        self.rooms = {}   # room id -> (frame, {key: encoded payload})
+        self.hits = 0
+        self.misses = 0
+        self.bytes_encoded = 0
+        self.bytes_reused = 0
+
+    def get(self, room_id, frame, key, encode, recipients=1):
+        """Encoded payload for `key` in this room and frame; `encode()` builds it on a miss.
+
+        Counts one use per recipient: every use after the first encode is a hit."""
+        entry = self.rooms.get(room_id)
+        if entry is None or entry[0] != frame:
+            entry = self.rooms[room_id] = (frame, {})
+        packet = entry[1].get(key)
+        reused = recipients
+        if packet is None:
+            packet = entry[1][key] = encode()
+            self.misses += 1; self.bytes_encoded += len(packet)
+            reused -= 1
+        self.hits += reused; self.bytes_reused += reused * len(packet)
+        return packet
+
+    def drop(self, room_id):
+        self.rooms.pop(room_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'rooms': len(self.rooms), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'bytes_encoded': self.bytes_encoded, 'bytes_reused': self.bytes_reused}
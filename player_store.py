@@ -0,0 +1,202 @@
+# Kylander: The Reckoning - Struct-of-Arrays Player Store
+# Every player in every room lives in one slot of a shared block of int32
+# columns, so per-frame physics can run as a single NumPy pass over all
+# players. Handlers, AI and combat keep using player['x']-style access through
+# PlayerView; plain dicts are only built when a player is serialized.
+
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from wire_protocol import ANIMATIONS, ANIMATION_IDS
+
+# --- Column layout (row index into PlayerStore.data) ---
+X, Y, VERTICAL_VELOCITY, HEALTH, FACING, ATTACK_TIMER, COOLDOWN_TIMER, KNOCKBACK_TIMER, \
+    IS_ATTACKING, IS_DUCKING, IS_JUMPING, HAS_HIT_THIS_ATTACK, IS_READY_NEXT_ROUND, MISS_SWING, \
+    ANIMATION = range(15)
+NUM_COLUMNS = 15
+# Rows after the player fields hold AI scheduler state (see ai_scheduler.py); they are
+# not player fields, so views and snapshots never show them, and a released slot clears them
+AI_INTENT, AI_ATTACK_ARMED, AI_NEXT_DECISION, AI_DUCKED_ON = range(NUM_COLUMNS, NUM_COLUMNS + 4)
+NUM_ROWS = NUM_COLUMNS + 4
+
+_INT, _BOOL, _ANIM = 0, 1, 2
+COLUMNS = {  # field name -> (row, kind)
+    'x': (X, _INT), 'y': (Y, _INT), 'vertical_velocity': (VERTICAL_VELOCITY, _INT),
+    'health': (HEALTH, _INT), 'facing': (FACING, _INT), 'attack_timer': (ATTACK_TIMER, _INT),
+    'cooldown_timer': (COOLDOWN_TIMER, _INT), 'knockback_timer': (KNOCKBACK_TIMER, _INT),
+    'is_attacking': (IS_ATTACKING, _BOOL), 'is_ducking': (IS_DUCKING, _BOOL),
+    'is_jumping': (IS_JUMPING, _BOOL), 'has_hit_this_attack': (HAS_HIT_THIS_ATTACK, _BOOL),
+    'is_ready_next_round': (IS_READY_NEXT_ROUND, _BOOL), 'miss_swing': (MISS_SWING, _BOOL),
+    'current_animation': (ANIMATION, _ANIM),
+}
+COLUMN_NAMES = sorted(COLUMNS, key=lambda name: COLUMNS[name][0])  # In row order
+
+
+def _to_python(kind, value):
+    if kind == _INT: return value
+    if kind == _BOOL: return value != 0
+    return ANIMATIONS[value]
+
+
+def _to_column(kind, value):
+    if kind == _INT: return int(value)
+    if kind == _BOOL: return 1 if value else 0
+    return ANIMATION_IDS[value]
+
+
+class PlayerStore:
+    """Pooled column storage for all players; slots are reused after release"""
+
+    def __init__(self, capacity=256):
+        self.data = np.zeros((NUM_ROWS, capacity), dtype=np.int32)
+        self.in_use = np.zeros(capacity, dtype=bool)
+        self.free_slots = list(range(capacity - 1, -1, -1))  # Pop from the end -> lowest slot first
+
+    @property
+    def capacity(self):
+        return self.data.shape[1]
+
+    def _grow(self):
+        old_capacity = self.capacity
+        new_capacity = old_capacity * 2
+        data = np.zeros((NUM_ROWS, new_capacity), dtype=np.int32); data[:, :old_capacity] = self.data
+        in_use = np.zeros(new_capacity, dtype=bool); in_use[:old_capacity] = self.in_use
+        self.data = data; self.in_use = in_use
+        self.free_slots[:0] = range(new_capacity - 1, old_capacity - 1, -1)
+
+    def allocate(self):
+        if not self.free_slots: self._grow()
+        slot = self.free_slots.pop()
+        self.in_use[slot] = True
+        return slot
+
+    def release(self, slot):
+        if not self.in_use[slot]:
+            return
+        self.in_use[slot] = False
+        self.data[:, slot] = 0
+        self.free_slots.append(slot)
+
+    def new_player(self, initial_state):
+        """Allocate a slot and return a PlayerView holding initial_state"""
+        player = PlayerView(self, self.allocate())
+        player.update(initial_state)
+        return player
+
+    def stats(self):
+        in_use = int(self.in_use.sum())
+        return {'capacity': self.capacity, 'in_use': in_use, 'free': self.capacity - in_use}
+
+
+class PlayerView(MutableMapping):
+    """Dict-style access to one player: column fields live in the store, the rest in a small dict"""
+    __slots__ = ('store', 'slot', 'fields')
+
+    def __init__(self, store, slot):
+        self.store = store
+        self.slot = slot
+        self.fields = {}  # Names, sid, AI bookkeeping and other cold fields
+
+    def __getitem__(self, key):
+        column = COLUMNS.get(key)
+        if column is None: return self.fields[key]
+        return _to_python(column[1], self.store.data.item(column[0], self.slot))
+
+    def __setitem__(self, key, value):
+        column = COLUMNS.get(key)
+        if column is None: self.fields[key] = value
+        else: self.store.data[column[0], self.slot] = _to_column(column[1], value)
+
+    def __delitem__(self, key):
+        if key in COLUMNS: raise KeyError(f"column field {key!r} can't be deleted")
+        del self.fields[key]
+
+    def __contains__(self, key):
+        return key in COLUMNS or key in self.fields
+
+    def __iter__(self):
+        yield from self.fields
+        yield from COLUMN_NAMES
+
+    def __len__(self):
+        return len(self.fields) + NUM_COLUMNS
+
+    def __bool__(self):
+        return True  # Never empty; skips the __len__ call in `if player:` checks
+
+    def get(self, key, default=None):
+        column = COLUMNS.get(key)
+        if column is None: return self.fields.get(key, default)
+        return _to_python(column[1], self.store.data.item(column[0], self.slot))
+
+    def update(self, other=(), **kwargs):
+        for key, value in (other.items() if hasattr(other, 'items') else other):
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def to_dict(self):
+        """Plain dict copy of the player (for snapshots and JSON)"""
+        state = dict(self.fields)
+        for name, value in zip(COLUMN_NAMES, self.store.data[:NUM_COLUMNS, self.slot].tolist()):
+            state[name] = _to_python(COLUMNS[name][1], value)
+        return state
+
+    def release(self):
+        """Return the slot to the pool; the view must not be used afterwards"""
+        self.store.release(self.slot)
+
+    def __repr__(self):
+        return f"PlayerView(slot={self.slot}, {self.to_dict()!r})"
+
+
+# --- Batched per-frame passes (slots: int array of player slots to step) ---
+
+def step_physics(store, slots, gravity, ground_level, attack_cooldown):
+    """Knockback, gravity and landing, cooldown and attack timers for every slot at once.
+
+    Matches the per-player rules: a player in knockback only counts it down and
+    falls; everyone else also runs cooldown/attack timers, and an attack that
+    ends without a hit sets miss_swing."""
+    if len(slots) == 0:
+        return
+    cols = store.data[:, slots]
+    knockback = cols[KNOCKBACK_TIMER] > 0
+    free = ~knockback
+    attacking = cols[IS_ATTACKING] != 0
+    jumping = cols[IS_JUMPING] != 0
+
+    cols[KNOCKBACK_TIMER] -= knockback
+    cols[IS_DUCKING] &= ~(knockback | jumping | attacking)
+    attacking &= free
+
+    cols[Y] += np.where(jumping, cols[VERTICAL_VELOCITY], 0)
+    cols[VERTICAL_VELOCITY] += np.where(jumping, gravity, 0)
+    landed = jumping & (cols[Y] >= ground_level)
+    cols[Y][landed] = ground_level
+    cols[VERTICAL_VELOCITY][landed] = 0
+    jumping &= ~landed
+    cols[ANIMATION][landed & free & ~attacking] = ANIMATION_IDS['idle']
+
+    cols[COOLDOWN_TIMER] -= free & (cols[COOLDOWN_TIMER] > 0)
+    cols[ATTACK_TIMER] -= attacking
+    finished = attacking & (cols[ATTACK_TIMER] <= 0)
+    cols[MISS_SWING] |= finished & (cols[HAS_HIT_THIS_ATTACK] == 0)
+    attacking &= ~finished
+    cols[HAS_HIT_THIS_ATTACK][finished] = 0
+    cols[COOLDOWN_TIMER][finished] = attack_cooldown
+    cols[ANIMATION][finished] = np.where(jumping[finished], ANIMATION_IDS['jump'], ANIMATION_IDS['idle'])
+
+    cols[IS_ATTACKING] = attacking
+    cols[IS_JUMPING] = jumping
+    store.data[:, slots] = cols
+
+
+def wrap_positions(store, slots, width, half_width):
+    """Screen wrap for every slot at once: leaving one edge re-enters at the other"""
+    if len(slots) == 0:
+        return
+    x = store.data[X, slots]
+    x = np.where(x > width + half_width, -half_width + 1, np.where(x < -half_width, width + half_width - 1, x))
+    store.data[X, slots] = x
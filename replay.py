@@ -0,0 +1,174 @@
+# Kylander: The Reckoning - Replay Playback
+# Re-simulates recorded matches (see replay_log.py) through the simulation
+# core, as fast as the core runs, and jumps to any frame: forward by
+# simulating, backward by restoring the nearest checkpoint taken on the way.
+# A match that ran to its end is checked against the checksum recorded live.
+#
+#   python replay.py replays/kylander-20261018-201500-4242.kyr --list
+#   python replay.py LOG --match 3 --events
+#   python replay.py LOG --match 3 --seek 5400 --state
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import game_core
+import game_log
+from replay_log import read_replay_log, state_checksum
+
+CHECKPOINT_FRAMES = 600   # A checkpoint every 10 s of match; seeking back re-simulates at most this many frames
+
+
+class Playback:
+    """One recorded match, re-simulated frame by frame; seek() jumps to any frame"""
+
+    def __init__(self, match, checkpoint_frames=CHECKPOINT_FRAMES):
+        self.match = match
+        self.checkpoint_frames = checkpoint_frames
+        self.checkpoints = {}   # frame -> saved playback state
+        self.room_state = None
+        self.events = []        # Events tick_rooms produced so far
+        self.sids = {}          # player number -> sid
+        self._restart()
+
+    @property
+    def frame(self):
+        return self.room_state['frame']
+
+    def _restart(self):
+        match = self.match
+        if self.room_state is not None:
+            game_core.release_room_players(self.room_state)
+        room_state = copy.deepcopy(match.snapshot['room'])
+        room_state['players'] = {}
+        for recorded in match.snapshot['players']:
+            player = game_core.player_store.new_player({})
+            player.fields.update(copy.deepcopy(recorded['fields']))
+            game_core.player_store.data[:, player.slot] = recorded['rows']
+            room_state['players'][player['sid']] = player
+            self.sids[1 if player['id'] == 'player1' else 2] = player['sid']
+        game_core.forget_room(room_state['id'])
+        game_core.seed_room(room_state['id'], match.seed)
+        game_core.room_rng(room_state).position = match.rng_position
+        self.room_state = room_state
+        self.events = []
+        self._apply_edits(match.start_frame)
+
+    def _apply_edits(self, frame):
+        for edit in self.match.edits.get(frame, ()):
+            self.room_state.update(edit['room'])
+            for player_id, fields in edit['players'].items():
+                player = game_core.get_player_by_id(self.room_state, player_id)
+                if player is not None: player.update(fields)
+            game_core.rollback_histories.drop(self.room_state['id'])
+
+    def step(self):
+        """Simulate the next frame with the input recorded for it"""
+        frame = self.frame + 1
+        inputs = [(self.sids[number], None, actions, frame)
+                  for number, actions in self.match.inputs.get(frame, {}).items() if number in self.sids]
+        _, events = game_core.tick_rooms([self.room_state], inputs)
+        self.events.extend(events)
+        self._apply_edits(frame)
+        if frame % self.checkpoint_frames == 0 and frame not in self.checkpoints:
+            self.checkpoints[frame] = self._save()
+
+    def _save(self):
+        room_state = self.room_state
+        return {'room': copy.deepcopy({key: value for key, value in room_state.items() if key != 'players'}),
+                'players': [(player.slot, copy.deepcopy(player.fields),
+                             game_core.player_store.data[:, player.slot].copy())
+                            for player in room_state['players'].values()],
+                'rng_position': game_core.room_rng(room_state).position,
+                'events': len(self.events)}
+
+    def _load(self, saved):
+        room_state = self.room_state; players = room_state['players']
+        room_state.clear(); room_state.update(copy.deepcopy(saved['room'])); room_state['players'] = players
+        for player, (slot, fields, rows) in zip(players.values(), saved['players']):
+            player.fields.clear(); player.fields.update(copy.deepcopy(fields))
+            game_core.player_store.data[:, slot] = rows
+        game_core.room_rng(room_state).position = saved['rng_position']
+        game_core.rollback_histories.drop(room_state['id'])
+        for sid in players: game_core.input_buffer.remove(sid)
+        del self.events[saved['events']:]
+
+    def seek(self, frame):
+        """Jump to the end of `frame` (clamped to the match)"""
+        frame = max(self.match.start_frame, min(frame, self.match.end_frame))
+        if frame < self.frame:
+            earlier = [checkpoint for checkpoint in self.checkpoints if checkpoint <= frame]
+            if earlier:
+                self._load(self.checkpoints[max(earlier)])
+            else:
+                self._restart()
+        while self.frame < frame:
+            self.step()
+
+    def verify(self):
+        """At the match's end: True if the state matches the live checksum (None if there is nothing to check)"""
+        end = self.match.end
+        if end is None or end[2] is None or self.frame != end[0]:
+            return None
+        return state_checksum(self.room_state) == end[2]
+
+
+def describe(match):
+    characters = match.characters()
+    end = match.end
+    return {'match': match.match_id, 'room': match.room_id, 'start_frame': match.start_frame,
+            'frames': match.end_frame - match.start_frame,
+            'mode': 'one player' if match.snapshot['room'].get('ai_opponent_active') else 'two players',
+            'player1': characters.get('player1'), 'player2': characters.get('player2'),
+            'input_runs': match.input_runs, 'bytes': match.stored_bytes,
+            'end': end[1] if end else 'incomplete', 'damaged': match.damaged}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play back recorded matches through the simulation core')
+    parser.add_argument('log', help='replay log file (KYLANDER_REPLAY_DIR/*.kyr)')
+    parser.add_argument('--list', action='store_true', help='list the matches in the log')
+    parser.add_argument('--match', type=int, help='match to play (default: the first)')
+    parser.add_argument('--seek', type=int, help='stop at this room frame (default: the end of the match)')
+    parser.add_argument('--events', action='store_true', help='print the events up to that frame')
+    parser.add_argument('--state', action='store_true', help='print the room state at that frame as JSON')
+    args = parser.parse_args(argv)
+    game_log.configure(os.environ.get('KYLANDER_LOG_LEVEL', 'WARNING'))
+
+    matches = read_replay_log(args.log)
+    if args.list:
+        for match in matches:
+            print(json.dumps(describe(match)))
+        return 0
+    if not matches:
+        print(f'{args.log}: no matches', file=sys.stderr)
+        return 1
+    match = matches[0] if args.match is None else next((m for m in matches if m.match_id == args.match), None)
+    if match is None:
+        print(f'{args.log}: no match {args.match}', file=sys.stderr)
+        return 1
+
+    playback = Playback(match)
+    started = time.perf_counter()
+    playback.seek(match.end_frame if args.seek is None else args.seek)
+    elapsed = time.perf_counter() - started
+    frames = playback.frame - match.start_frame
+    if args.events:
+        for event in playback.events:
+            print(json.dumps(event))
+    if args.state:
+        print(json.dumps(game_core.serialize_room_state(playback.room_state), indent=2, default=str))
+    verified = playback.verify()
+    print(f"match {match.match_id} room {match.room_id}: frame {playback.frame} "
+          f"({frames} frames in {elapsed:.3f} s, {frames / max(elapsed, 1e-9):.0f} frames/s), "
+          f"screen {playback.room_state['current_screen']}, "
+          f"score {playback.room_state['match_score_p1']}-{playback.room_state['match_score_p2']}"
+          + ('' if verified is None else ', checksum ' + ('ok' if verified else 'MISMATCH')), file=sys.stderr)
+    return 1 if verified is False else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+# Kylander: The Reckoning - Match Replay Log
+# Every match can be recorded as a compact, append-only binary log: the room
+# as it stood when the match began (its random stream's seed and position
+# included), each player's input as runs of frames it was applied on, edits
+# made between ticks (background changes) and an end record carrying a
+# checksum of the final state. Recording an input costs a dict lookup and a
+# comparison; a match's records go onto a bounded queue in chunks and a
+# background writer compresses and appends them, so the tick never waits on
+# the disk. replay.py plays a log back.
+#
+# File: MAGIC, VERSION byte, then chunks of (match id, length, zlib payload);
+# a match's payloads, in order, are its records:
+#   START  frame, seed (u64), rng position, JSON room snapshot
+#   INPUT  player number, frame, frame count, actions   (a later run for the same frame wins)
+#   EDIT   frame, JSON {'room': {...}, 'players': {'player1': {...}}}   (applied after that frame)
+#   END    frame, reason, has-checksum, CRC-32 of the frame and packed hot state (wire_protocol)
+# Frames are zigzag varints relative to the previous record's frame.
+
+import atexit
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import wire_protocol
+from wire_protocol import ACTION_ATTACK, ACTION_DUCK, ACTION_DUCK_ACTIVE, ACTION_JUMP, ACTION_LEFT, ACTION_RIGHT
+
+MAGIC = b'KYRP'
+VERSION = 1
+QUEUE_SIZE = 256          # Chunks waiting for the writer; beyond this the match is dropped
+CHUNK_BYTES = 16384       # A match's records are handed to the writer once this much has built up, and at its end
+
+START, INPUT, EDIT, END = 1, 2, 3, 4
+END_REASONS = ('finished', 'left', 'reset', 'destroyed', 'shutdown', 'restarted')
+
+ACTIONS_LISTED = 64       # Moves other than left/right/both follow as a count and one code each
+MOVE_CODES = {'left': 0, 'right': 1}   # Any other direction is code 2
+MOVE_DIRECTIONS = ('left', 'right', None)
+_SIMPLE_MOVES = {(): 0, ('left',): ACTION_LEFT, ('right',): ACTION_RIGHT, ('left', 'right'): ACTION_LEFT | ACTION_RIGHT}
+
+_SEED = struct.Struct('<Q')
+_CRC = struct.Struct('<I')
+
+
+def _put_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _put_signed(out, value):
+    _put_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _put_json(out, value):
+    payload = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+    _put_varint(out, len(payload)); out += payload
+
+
+class _Reader:
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        value = self.data[self.pos]; self.pos += 1
+        return value
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            byte = self.data[self.pos]; self.pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self):
+        value = self.varint()
+        return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+    def take(self, count):
+        if self.pos + count > len(self.data):
+            raise IndexError('record runs past the end of the data')
+        value = self.data[self.pos:self.pos + count]; self.pos += count
+        return value
+
+    def json(self):
+        return json.loads(self.take(self.varint()).decode('utf-8'))
+
+
+def encode_actions(out, actions):
+    """Append one tick's actions as coalesce_actions leaves them (moves, then jump, duck, attack)"""
+    bits = 0; moves = []
+    for action in actions:
+        action_type = action.get('type')
+        if action_type == 'move': moves.append(action.get('direction'))
+        elif action_type == 'jump': bits |= ACTION_JUMP
+        elif action_type == 'attack': bits |= ACTION_ATTACK
+        elif action_type == 'duck':
+            bits = (bits & ~ACTION_DUCK_ACTIVE) | ACTION_DUCK | (ACTION_DUCK_ACTIVE if action.get('active', False) else 0)
+    simple = _SIMPLE_MOVES.get(tuple(moves))
+    if simple is not None:
+        out.append(bits | simple)
+        return
+    out.append(bits | ACTIONS_LISTED)
+    _put_varint(out, len(moves))
+    out += bytes(MOVE_CODES.get(direction, 2) for direction in moves)
+
+
+def decode_actions(reader):
+    bits = reader.byte()
+    if bits & ACTIONS_LISTED:
+        directions = [MOVE_DIRECTIONS[code] for code in reader.take(reader.varint())]
+    else:
+        directions = [direction for direction, bit in (('left', ACTION_LEFT), ('right', ACTION_RIGHT)) if bits & bit]
+    actions = [{'type': 'move', 'direction': direction} for direction in directions]
+    if bits & ACTION_JUMP: actions.append({'type': 'jump'})
+    if bits & ACTION_DUCK: actions.append({'type': 'duck', 'active': bool(bits & ACTION_DUCK_ACTIVE)})
+    if bits & ACTION_ATTACK: actions.append({'type': 'attack'})
+    return actions
+
+
+def state_checksum(room_state):
+    """CRC-32 of a room's frame and packed per-frame state (screen, timers, scores, both players)"""
+    return zlib.crc32(_CRC.pack(room_state['frame'] & 0xFFFFFFFF) + wire_protocol.encode_hot_state(room_state))
+
+
+class ReplayWriter:
+    """Appends chunks to one log file from a background thread; never blocks the caller"""
+
+    def __init__(self, path, queue_size=QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.thread = None
+        self.stats = {'chunks': 0, 'bytes_written': 0, 'dropped_chunks': 0, 'write_errors': 0}
+
+    def write(self, match_id, payload):
+        """Queue a chunk of a match's records; False if the queue is full and it was dropped"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='replay-writer', daemon=True)
+            self.thread.start()
+        try:
+            self.queue.put_nowait((match_id, bytes(payload)))
+        except queue.Full:
+            self.stats['dropped_chunks'] += 1
+            return False
+        return True
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as log_file:
+            if log_file.tell() == 0:
+                log_file.write(MAGIC + bytes([VERSION]))
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                match_id, payload = item
+                data = zlib.compress(payload)
+                chunk = bytearray(); _put_varint(chunk, match_id); _put_varint(chunk, len(data)); chunk += data
+                try:
+                    log_file.write(chunk); log_file.flush()
+                except OSError:
+                    self.stats['write_errors'] += 1
+                    continue
+                self.stats['chunks'] += 1
+                self.stats['bytes_written'] += len(chunk)
+
+    def close(self):
+        """Write out everything queued and stop the writer"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class _Match:
+    __slots__ = ('match_id', 'buffer', 'cursor', 'runs')
+
+    def __init__(self, match_id, frame):
+        self.match_id = match_id
+        self.buffer = bytearray()
+        self.cursor = frame    # Frame of the previous record (frames are written relative to it)
+        self.runs = {}         # player number -> [first frame, frame count, actions] not yet written
+
+    def put_frame(self, frame):
+        _put_signed(self.buffer, frame - self.cursor)
+        self.cursor = frame
+
+
+class ReplayRecorder:
+    """Records every match it is told about, one room at a time, into a ReplayWriter"""
+
+    def __init__(self, writer, chunk_bytes=CHUNK_BYTES):
+        self.writer = writer
+        self.chunk_bytes = chunk_bytes
+        self.matches = {}        # room id -> _Match
+        self.next_match_id = 1
+        self.counts = {'started': 0, 'ended': 0, 'lost': 0, 'input_runs': 0}
+
+    @classmethod
+    def to_directory(cls, directory):
+        """A recorder appending to a new log file in `directory`, closed at exit"""
+        path = os.path.join(directory, f"kylander-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.kyr")
+        recorder = cls(ReplayWriter(path))
+        atexit.register(recorder.close)
+        return recorder
+
+    def start(self, room_state, store, rng):
+        """Begin recording a room's match from its state now (between ticks)"""
+        room_id = room_state['id']
+        if room_id in self.matches:
+            self.end(room_id, 'restarted', room_state)
+        match = self.matches[room_id] = _Match(self.next_match_id, room_state['frame'])
+        self.next_match_id += 1
+        self.counts['started'] += 1
+        snapshot = {'room': {key: value for key, value in room_state.items() if key != 'players'},
+                    'players': [{'fields': player.fields, 'rows': store.data[:, player.slot].tolist()}
+                                for player in room_state['players'].values()]}
+        out = match.buffer
+        out.append(START); _put_varint(out, room_state['frame'])
+        out += _SEED.pack(rng.seed); _put_varint(out, rng.position)
+        _put_json(out, snapshot)
+
+    def record_input(self, room_state, player, frame, actions):
+        """The actions a player has for `frame` (called again if late input changes them)"""
+        match = self.matches.get(room_state['id'])
+        if match is None:
+            return
+        number = 1 if player['id'] == 'player1' else 2
+        run = match.runs.get(number)
+        if run is not None:
+            if frame == run[0] + run[1] and actions == run[2]:
+                run[1] += 1
+                return
+            self._write_run(match, number, run)
+        match.runs[number] = [frame, 1, actions]
+
+    def _write_run(self, match, number, run):
+        out = match.buffer
+        out.append(INPUT); out.append(number); match.put_frame(run[0]); _put_varint(out, run[1])
+        encode_actions(out, run[2])
+        self.counts['input_runs'] += 1
+        if len(out) >= self.chunk_bytes:
+            self._hand_off(match)
+
+    def record_edit(self, room_state, room_fields=None, players=None):
+        """Fields changed outside the simulation since the last tick ({'player1': {...}} for players)"""
+        match = self.matches.get(room_state['id'])
+        if match is None:
+            return
+        match.buffer.append(EDIT); match.put_frame(room_state['frame'])
+        _put_json(match.buffer, {'room': room_fields or {}, 'players': players or {}})
+
+    def end(self, room_id, reason, room_state=None):
+        """Finish a room's match (with a checksum of room_state when given) and hand it to the writer"""
+        match = self.matches.pop(room_id, None)
+        if match is None:
+            return
+        for number, run in match.runs.items():
+            self._write_run(match, number, run)
+        match.runs = {}
+        out = match.buffer
+        out.append(END); match.put_frame(room_state['frame'] if room_state is not None else match.cursor)
+        out.append(END_REASONS.index(reason))
+        out.append(1 if room_state is not None else 0)
+        out += _CRC.pack(state_checksum(room_state) if room_state is not None else 0)
+        self.counts['ended'] += 1
+        self._hand_off(match)
+
+    def _hand_off(self, match):
+        if match.buffer and not self.writer.write(match.match_id, match.buffer):
+            # The log would have a hole in it: stop recording this match
+            for room_id, recorded in list(self.matches.items()):
+                if recorded is match: del self.matches[room_id]
+            self.counts['lost'] += 1
+        match.buffer = bytearray()
+
+    def close(self):
+        for room_id in list(self.matches):
+            self.end(room_id, 'shutdown')
+        self.writer.close()
+
+    def stats(self):
+        return {'recording': len(self.matches), 'path': self.writer.path, **self.counts, **self.writer.stats}
+
+
+# --- Reading ---
+
+class RecordedMatch:
+    """One match read back from a log"""
+
+    def __init__(self, match_id):
+        self.match_id = match_id
+        self.start_frame = None
+        self.seed = None
+        self.rng_position = 0
+        self.snapshot = None
+        self.inputs = {}       # frame -> {player number: actions}
+        self.edits = {}        # frame -> [{'room': ..., 'players': ...}]
+        self.end = None        # (frame, reason, checksum or None)
+        self.input_runs = 0
+        self.stored_bytes = 0  # Compressed size in the log
+        self.damaged = False   # Records after a bad one were skipped
+
+    @property
+    def room_id(self):
+        return self.snapshot['room']['id']
+
+    @property
+    def end_frame(self):
+        if self.end is not None:
+            return self.end[0]
+        return max([self.start_frame, *self.inputs, *self.edits])
+
+    def characters(self):
+        return {player['fields'].get('id'): player['fields'].get('original_character_name')
+                for player in self.snapshot['players']}
+
+    def _parse(self, data):
+        reader = _Reader(data); frame = 0
+        while reader.pos < len(data):
+            kind = reader.byte()
+            if kind == START:
+                frame = self.start_frame = reader.varint()
+                self.seed = _SEED.unpack(reader.take(_SEED.size))[0]
+                self.rng_position = reader.varint()
+                self.snapshot = reader.json()
+            elif kind == INPUT:
+                number = reader.byte(); frame += reader.signed(); count = reader.varint()
+                actions = decode_actions(reader)
+                for run_frame in range(frame, frame + count):
+                    self.inputs.setdefault(run_frame, {})[number] = actions
+                self.input_runs += 1
+            elif kind == EDIT:
+                frame += reader.signed()
+                self.edits.setdefault(frame, []).append(reader.json())
+            elif kind == END:
+                frame += reader.signed(); reason = END_REASONS[reader.byte()]
+                has_checksum = reader.byte(); checksum = _CRC.unpack(reader.take(_CRC.size))[0]
+                self.end = (frame, reason, checksum if has_checksum else None)
+            else:
+                raise ValueError(f'unknown record type {kind} in match {self.match_id}')
+
+
+def read_replay_log(path):
+    """Every match in a log file (a chunk cut short by a crash ends the read), in the order they started"""
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+    if data[:len(MAGIC)] != MAGIC or len(data) <= len(MAGIC) or data[len(MAGIC)] != VERSION:
+        raise ValueError(f'{path} is not a version {VERSION} replay log')
+    reader = _Reader(data); reader.pos = len(MAGIC) + 1
+    payloads = {}; matches = {}
+    while reader.pos < len(data):
+        try:
+            match_id = reader.varint(); compressed = reader.take(reader.varint())
+            payload = zlib.decompress(compressed)
+        except (IndexError, zlib.error):
+            break
+        payloads.setdefault(match_id, bytearray()).extend(payload)
+        if match_id not in matches: matches[match_id] = RecordedMatch(match_id)
+        matches[match_id].stored_bytes += len(compressed)
+    for match_id, match in matches.items():
+        try:
+            match._parse(bytes(payloads[match_id]))
+        except (IndexError, ValueError):
+            match.damaged = True
+    return [match for match in matches.values() if match.snapshot is not None]
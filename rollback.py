@@ -0,0 +1,116 @@
+# Kylander: The Reckoning - Rollback Frame History
+# Two-player rooms keep the last few frames of state so input that arrives
+# stamped for an earlier frame can be applied where it belongs: the room is
+# rewound to that frame and re-simulated up to the present. Frames are saved
+# compactly (both players' store columns as one small int32 block plus flat
+# copies of the room's and players' other fields, plus the room's random
+# stream position), so saving every frame costs a few microseconds and a
+# rewind never deep-copies anything.
+
+ROLLBACK_FRAMES = 8          # Frames of history per room (~130 ms at 60 fps); older input is applied at the oldest
+RESIMULATION_BUDGET = 300    # Room-frames re-run per tick across all rooms; past it, late input applies now
+
+
+class SavedFrame:
+    """One room at the start of a frame, plus the input applied during that frame"""
+    __slots__ = ('frame', 'room_fields', 'slots', 'columns', 'player_fields', 'rng_position', 'inputs')
+
+    def __init__(self):
+        self.frame = -1
+        self.inputs = {}   # sid -> actions
+
+
+class FrameHistory:
+    """Ring buffer of a room's last `size` frames"""
+
+    def __init__(self, size=ROLLBACK_FRAMES):
+        self.size = size
+        self.frames = [SavedFrame() for _ in range(size)]
+        self._list_keys = ()       # Room fields holding lists (copied, not shared, between frames)
+        self._list_keys_for = -1   # Room field count the list keys were found for
+
+    def _copy_fields(self, state):
+        """Copy of a room's own fields: lists are copied, 'players' is left out"""
+        fields = state.copy()
+        fields.pop('players', None)
+        if len(fields) != self._list_keys_for:
+            self._list_keys = [key for key, value in fields.items() if type(value) is list]
+            self._list_keys_for = len(fields)
+        for key in self._list_keys:
+            fields[key] = fields[key].copy()
+        return fields
+
+    def save(self, frame, room_state, store, players, rng, inputs=None):
+        """Record room_state as it stands at the start of `frame` (before that frame's timers run)"""
+        saved = self.frames[frame % self.size]
+        saved.frame = frame
+        saved.room_fields = self._copy_fields(room_state)
+        saved.slots = [player.slot for player in players]
+        saved.columns = store.data.take(saved.slots, axis=1)  # A copy; cheaper than fancy indexing
+        saved.player_fields = [dict(player.fields) for player in players]
+        saved.rng_position = rng.position
+        saved.inputs = inputs if inputs is not None else {}
+        return saved
+
+    def get(self, frame):
+        saved = self.frames[frame % self.size]
+        return saved if saved.frame == frame else None
+
+    def oldest_frame(self, present, slots):
+        """Oldest frame the room can be rewound to from `present` (unbroken history, same players)"""
+        frame = present
+        while present - frame < self.size - 1:
+            saved = self.get(frame - 1)
+            if saved is None or saved.slots != slots:
+                break
+            frame -= 1
+        return frame
+
+    def restore(self, saved, room_state, store, players, rng):
+        """Put room_state and its players back to a saved frame (the players dict itself is kept)"""
+        room_players = room_state['players']
+        room_state.clear()
+        room_state.update(self._copy_fields(saved.room_fields))
+        room_state['players'] = room_players
+        store.data[:, saved.slots] = saved.columns
+        for player, fields in zip(players, saved.player_fields):
+            player.fields.clear(); player.fields.update(fields)
+        rng.position = saved.rng_position
+
+
+class RollbackHistories:
+    """Frame histories for every rollback room, with shared counters and the per-tick resimulation budget"""
+
+    def __init__(self, size=ROLLBACK_FRAMES, resimulation_budget=RESIMULATION_BUDGET):
+        self.size = size
+        self.resimulation_budget = resimulation_budget
+        self.budget_left = resimulation_budget
+        self.rooms = {}   # room id -> FrameHistory
+        self.stats = {'rollbacks': 0, 'resimulated_frames': 0, 'max_depth': 0,
+                      'clamped_inputs': 0, 'over_budget': 0}
+
+    def for_room(self, room_id):
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = self.rooms[room_id] = FrameHistory(self.size)
+        return history
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def drop(self, room_id):
+        self.rooms.pop(room_id, None)
+
+    def start_tick(self):
+        self.budget_left = self.resimulation_budget
+
+    def claim(self, depth):
+        """Reserve `depth` re-run frames from this tick's budget; False (and counted) if it is spent"""
+        if depth > self.budget_left:
+            self.stats['over_budget'] += 1
+            return False
+        self.budget_left -= depth
+        self.stats['rollbacks'] += 1
+        self.stats['resimulated_frames'] += depth
+        if depth > self.stats['max_depth']: self.stats['max_depth'] = depth
+        return True
@@ -0,0 +1,111 @@
+# Kylander: The Reckoning - Room Manager
+# Hosts every concurrent match in one process. Rooms are created on demand and
+# destroyed when their last human leaves; every lookup is a dict hit.
+
+import itertools
+
+
+class RoomManager:
+    """Owns all room states and the sid -> room index"""
+
+    def __init__(self, room_factory, max_humans_per_room, ai_sid, max_rooms=None, owns_room_id=None):
+        self.room_factory = room_factory  # room_id -> fresh room_state dict
+        self.owns_room_id = owns_room_id  # room_id -> bool; generated ids skip rooms another shard owns
+        self.max_humans_per_room = max_humans_per_room
+        self.ai_sid = ai_sid
+        self.max_rooms = max_rooms
+        self.rooms = {}          # room_id -> room_state
+        self.sid_to_room = {}    # sid -> room_id
+        # Rooms with a free human slot, oldest first (dict keeps insertion order)
+        self.open_rooms = {}
+        self._room_counter = itertools.count(1)
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def create_room(self, room_id=None):
+        """Create an empty room and return its state"""
+        if room_id is None:
+            room_id = f"room_{next(self._room_counter)}"
+            while room_id in self.rooms or (self.owns_room_id and not self.owns_room_id(room_id)):
+                room_id = f"room_{next(self._room_counter)}"
+        room_state = self.room_factory(room_id)
+        self.rooms[room_id] = room_state
+        self.open_rooms[room_id] = None
+        return room_state
+
+    def destroy_room(self, room_id):
+        """Drop a room and every sid still mapped to it"""
+        room_state = self.rooms.pop(room_id, None)
+        self.open_rooms.pop(room_id, None)
+        if room_state:
+            for sid in room_state['players']:
+                if self.sid_to_room.get(sid) == room_id:
+                    del self.sid_to_room[sid]
+        return room_state
+
+    def reset_room(self, room_id):
+        """Replace a room's state with a fresh one under the same id (players must be re-added)"""
+        room_state = self.room_factory(room_id)
+        self.rooms[room_id] = room_state
+        return room_state
+
+    def get_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    def room_for_sid(self, sid):
+        room_id = self.sid_to_room.get(sid)
+        return self.rooms.get(room_id) if room_id is not None else None
+
+    def human_count(self, room_state):
+        return sum(1 for sid in room_state['players'] if sid != self.ai_sid)
+
+    def is_open(self, room_state):
+        """A room takes another human while it has a free slot and no AI opponent"""
+        return (not room_state.get('ai_opponent_active') and
+                self.human_count(room_state) < self.max_humans_per_room)
+
+    def refresh_open_state(self, room_state):
+        """Keep the open-room index in sync after players or game mode change"""
+        room_id = room_state['id']
+        if room_id not in self.rooms:
+            return
+        if self.is_open(room_state):
+            self.open_rooms.setdefault(room_id, None)
+        else:
+            self.open_rooms.pop(room_id, None)
+
+    def find_room_for_new_player(self, requested_room_id=None):
+        """Pick the room a new connection should join, creating one if needed.
+
+        Returns None when the requested room is full or the server is at capacity."""
+        if requested_room_id:
+            room_state = self.rooms.get(requested_room_id)
+            if room_state is None:
+                if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+                    return None
+                return self.create_room(requested_room_id)
+            return room_state if self.is_open(room_state) else None
+        # Oldest open room first so a second visitor pairs with whoever is waiting
+        for room_id in self.open_rooms:
+            return self.rooms[room_id]
+        if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+            return None
+        return self.create_room()
+
+    def add_sid(self, sid, room_state):
+        self.sid_to_room[sid] = room_state['id']
+        self.refresh_open_state(room_state)
+
+    def remove_sid(self, sid):
+        """Unmap a sid; returns the room it was in (or None)"""
+        room_id = self.sid_to_room.pop(sid, None)
+        return self.rooms.get(room_id) if room_id is not None else None
+
+    def stats(self):
+        screens = {}
+        for room_state in self.rooms.values():
+            screen = room_state.get('current_screen', 'UNKNOWN')
+            screens[screen] = screens.get(screen, 0) + 1
+        return {'rooms': len(self.rooms), 'open_rooms': len(self.open_rooms),
+                'connected_sids': len(self.sid_to_room), 'rooms_by_screen': screens}
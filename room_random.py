@@ -0,0 +1,74 @@
+# Kylander: The Reckoning - Per-Room Random Numbers
+# Each room draws from its own seeded generator, so a room's match plays out
+# the same way for the same seed and input no matter what other rooms do. The
+# generator is SplitMix64, whose n-th number depends only on the seed and n:
+# numbers are generated a block at a time in one NumPy pass, and the stream's
+# whole state is its position, which makes saving and restoring it (rollback,
+# replays) as cheap as copying an int.
+
+import os
+
+import numpy as np
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+_MIX1 = 0xBF58476D1CE4E5B9
+_MIX2 = 0x94D049BB133111EB
+BLOCK_SIZE = 64   # Numbers generated per refill
+
+
+def _mix(z):
+    z = ((z ^ (z >> 30)) * _MIX1) & _MASK64
+    z = ((z ^ (z >> 27)) * _MIX2) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _generate(seed, start, count):
+    """Numbers start .. start + count - 1 of the stream for `seed`, as Python ints"""
+    z = np.arange(start + 1, start + count + 1, dtype=np.uint64) * np.uint64(_GOLDEN_GAMMA) + np.uint64(seed)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(_MIX1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(_MIX2)
+    return (z ^ (z >> np.uint64(31))).tolist()
+
+
+def derive_seed(base_seed, name):
+    """Stable 64-bit seed for one room (or other stream) of a seeded run"""
+    state = base_seed & _MASK64
+    for byte in str(name).encode('utf-8'):
+        state = ((state ^ byte) + _GOLDEN_GAMMA) & _MASK64
+    state = (state + _GOLDEN_GAMMA) & _MASK64
+    return _mix(state)
+
+
+class RoomRandom:
+    """random.Random-style choice/randint/random over a pre-generated SplitMix64 stream"""
+    __slots__ = ('seed', 'position', 'block', 'block_start')
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), 'little')
+        self.seed = seed & _MASK64
+        self.position = 0       # Numbers drawn so far; setting it rewinds or skips the stream
+        self.block = []         # Pre-generated numbers block_start .. block_start + len(block) - 1
+        self.block_start = 0
+
+    def next_u64(self):
+        index = self.position - self.block_start
+        if index >= len(self.block) or index < 0:
+            self.block = _generate(self.seed, self.position, BLOCK_SIZE)
+            self.block_start = self.position; index = 0
+        self.position += 1
+        return self.block[index]
+
+    def random(self):
+        """Float in [0, 1)"""
+        return (self.next_u64() >> 11) * (1.0 / (1 << 53))
+
+    def randint(self, low, high):
+        """Integer in [low, high], both ends included"""
+        return low + self.next_u64() % (high - low + 1)
+
+    def choice(self, seq):
+        if not seq:
+            raise IndexError('cannot choose from an empty sequence')
+        return seq[self.next_u64() % len(seq)]
@@ -0,0 +1,77 @@
+# Kylander: The Reckoning - Fixed-Timestep Scheduler
+# Steps the simulation at a fixed rate from a wall-clock accumulator. A slow
+# host runs a bounded number of catch-up frames and then drops the backlog, so
+# simulation time never spirals and every timer can be counted in frames.
+
+import time
+
+
+class FixedTimestepScheduler:
+    """Calls step_fn() exactly once per fixed frame of elapsed time"""
+
+    def __init__(self, step_fn, tick_rate=60, max_catchup_frames=5,
+                 clock=time.perf_counter, sleep=time.sleep, on_overrun=None, on_step=None):
+        self.step_fn = step_fn
+        self.tick_rate = tick_rate
+        self.frame_duration_s = 1.0 / tick_rate
+        self.max_catchup_frames = max_catchup_frames
+        self.clock = clock
+        self.sleep = sleep
+        self.on_overrun = on_overrun  # Called as on_overrun(kind, detail) when a frame runs late
+        self.on_step = on_step        # Called as on_step(step_s) after every frame
+        self.accumulator_s = 0.0
+        self.last_time = None
+        self.frame = 0               # Monotonic count of frames stepped
+        self.overruns = 0            # Steps that took longer than one frame
+        self.dropped_frames = 0      # Frames skipped because catch-up hit its limit
+        self.last_step_s = 0.0
+        self.max_step_s = 0.0
+        self.running = False
+
+    def run_pending(self):
+        """Step every frame that is due (up to the catch-up limit); returns frames stepped"""
+        now = self.clock()
+        if self.last_time is None:
+            self.last_time = now
+            self.accumulator_s = self.frame_duration_s  # Step once straight away
+        self.accumulator_s += now - self.last_time
+        self.last_time = now
+
+        steps = 0
+        while self.accumulator_s >= self.frame_duration_s and steps < self.max_catchup_frames:
+            step_start = self.clock()
+            self.step_fn()
+            step_s = self.clock() - step_start
+            self.frame += 1; steps += 1
+            self.accumulator_s -= self.frame_duration_s
+            self.last_step_s = step_s
+            if step_s > self.max_step_s: self.max_step_s = step_s
+            if self.on_step: self.on_step(step_s)
+            if step_s > self.frame_duration_s:
+                self.overruns += 1
+                if self.on_overrun: self.on_overrun('step_overrun', {'frame': self.frame, 'step_ms': step_s * 1000})
+
+        if self.accumulator_s >= self.frame_duration_s:
+            # Too far behind to catch up: drop the backlog rather than spiral
+            behind = int(self.accumulator_s / self.frame_duration_s)
+            self.dropped_frames += behind
+            self.accumulator_s -= behind * self.frame_duration_s
+            if self.on_overrun: self.on_overrun('frames_dropped', {'frame': self.frame, 'dropped': behind})
+        return steps
+
+    def time_until_next_frame(self):
+        return max(0.0, self.frame_duration_s - self.accumulator_s - (self.clock() - self.last_time))
+
+    def run_forever(self):
+        self.running = True
+        while self.running:
+            self.run_pending()
+            self.sleep(self.time_until_next_frame())
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {'tick_rate': self.tick_rate, 'frame': self.frame, 'overruns': self.overruns,
+                'dropped_frames': self.dropped_frames, 'last_step_ms': round(self.last_step_s * 1000, 3),
+                'max_step_ms': round(self.max_step_s * 1000, 3)}
@@ -0,0 +1,278 @@
+# Kylander: The Reckoning - Self-Play Simulator
+# Plays full matches (special level included) with no server and no clock,
+# AI against AI or AI against a scripted human profile, across a process
+# pool. A sweep runs every combination of a parameter grid and writes one
+# CSV row per combination: win rates, round lengths, clash/evasion/hit rates
+# and simulation speed.
+#
+#   python selfplay.py --matches 2000 --grid AI_ATTACK_FREQUENCY=0.12,0.18,0.25 \
+#       --grid AI_PREFERRED_DISTANCE=60,75,90 --opponent aggressive --out sweep.csv
+#
+# Grid names are game_core constants (AI_*, PLAYER_ATTACK_RANGE, ...) or
+# combat constants written as combat.NAME. Player 2 is always update_ai;
+# player 1 is update_ai too (--opponent ai) or a scripted profile.
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+import combat
+import game_core
+import game_log
+from room_random import RoomRandom, derive_seed
+
+BATCH_SIZE = 64                           # Matches a worker plays side by side (one tick_rooms call steps them all)
+MAX_MATCH_SECONDS = 600                   # A match still running after this much simulated time is a stalemate
+FINISHED_SCREENS = ('GAME_OVER', 'FINAL')
+PLAY_SCREENS = ('PLAYING', 'SPECIAL')
+ROUND_END_EVENTS = ('round_over', 'darichris_defeated', 'church_victory')  # church_victory only when immediate
+TUNABLE_MODULES = {'combat': combat}
+
+
+# --- Scripted player 1 profiles ---
+# Each returns player 1's actions for the coming frame.
+
+def toward(player, opponent):
+    return {'type': 'move', 'direction': 'right' if opponent['x'] > player['x'] else 'left'}
+
+def profile_idle(player, opponent, rng):
+    return []
+
+def profile_aggressive(player, opponent, rng):
+    """Closes in and swings whenever in range"""
+    if abs(opponent['x'] - player['x']) > game_core.PLAYER_ATTACK_RANGE:
+        return [toward(player, opponent)]
+    return [{'type': 'attack'}]
+
+def profile_turtle(player, opponent, rng):
+    """Ducks under every swing in range, counters in between"""
+    in_range = abs(opponent['x'] - player['x']) <= game_core.PLAYER_ATTACK_RANGE
+    if opponent['is_attacking'] and in_range:
+        return [{'type': 'duck', 'active': True}]
+    actions = [{'type': 'duck', 'active': False}]
+    actions.append({'type': 'attack'} if in_range else toward(player, opponent))
+    return actions
+
+def profile_jumper(player, opponent, rng):
+    """Jump attacks from just outside range"""
+    distance = abs(opponent['x'] - player['x'])
+    if distance > game_core.PLAYER_ATTACK_RANGE + 40:
+        return [toward(player, opponent)]
+    if not player['is_jumping']:
+        return [{'type': 'jump'}]
+    return [{'type': 'attack'}]
+
+RANDOM_ACTIONS = [[], [{'type': 'move', 'direction': 'left'}], [{'type': 'move', 'direction': 'right'}],
+                  [{'type': 'jump'}], [{'type': 'attack'}], [{'type': 'duck', 'active': True}],
+                  [{'type': 'duck', 'active': False}]]
+
+def profile_random(player, opponent, rng):
+    return rng.choice(RANDOM_ACTIONS)
+
+PROFILES = {
+    'idle': profile_idle,
+    'aggressive': profile_aggressive,
+    'turtle': profile_turtle,
+    'jumper': profile_jumper,
+    'random': profile_random,
+}
+OPPONENTS = ['ai'] + list(PROFILES)
+
+
+# --- Parameters ---
+
+def resolve_parameter(name):
+    """(module, attribute) for a grid name; ValueError if there is no such constant"""
+    module_name, _, attribute = name.rpartition('.')
+    module = TUNABLE_MODULES.get(module_name) if module_name else game_core
+    if module is None or not attribute.isupper() or not hasattr(module, attribute):
+        raise ValueError(f'unknown parameter: {name}')
+    return module, attribute
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parse_grid(specs):
+    """['NAME=v1,v2', ...] -> (names, [combination, ...]) covering every combination"""
+    names = []; values = []
+    for spec in specs:
+        name, sep, listed = spec.partition('=')
+        if not sep or not listed: raise ValueError(f'expected NAME=v1,v2,...: {spec}')
+        resolve_parameter(name)
+        names.append(name); values.append([parse_value(value) for value in listed.split(',')])
+    return names, list(itertools.product(*values))
+
+def apply_parameters(params):
+    """Set constants for this process; returns the previous values"""
+    previous = {}
+    for name, value in params.items():
+        module, attribute = resolve_parameter(name)
+        previous[name] = getattr(module, attribute)
+        setattr(module, attribute, value)
+    return previous
+
+
+# --- Matches ---
+
+def new_tally():
+    return Counter({'matches': 0, 'p1_wins': 0, 'p2_wins': 0, 'stalemates': 0, 'rounds': 0, 'special_levels': 0,
+                    'darichris_wins': 0, 'frames': 0, 'clash': 0, 'duck_evasion': 0, 'jump_evasion': 0,
+                    'hit': 0, 'miss': 0})
+
+def skip_screen_timers(room_state):
+    """Cut victory/intro screens and knockout effects to one frame; nothing is decided while they run"""
+    if room_state['state_timer_frames'] > 1 and (room_state['current_screen'] not in PLAY_SCREENS or
+                                                 room_state['round_winner_player_id'] is not None):
+        room_state['state_timer_frames'] = 1
+
+def play_batch(task):
+    """Play one batch of matches for one grid point; (point index, tally, round lengths, cpu seconds)"""
+    point, params, first_match, count, options = task
+    previous = apply_parameters(params)
+    tally = new_tally(); round_lengths = []
+    rooms = []; profile_rngs = {}; round_starts = {}
+    started = time.process_time()
+    try:
+        for match in range(first_match, first_match + count):
+            room_id = f'{point}:{match}'
+            seed = derive_seed(options['seed'], room_id)
+            room_state = game_core.new_match_room(room_id, options['p1_character'], options['p2_character'],
+                                                  ai_opponent=True, seed=seed, sids=(f'{room_id}:p1', None))
+            game_core.combat_tallies[room_id] = Counter()
+            if options['opponent'] == 'ai':
+                game_core.self_play_rooms.add(room_id)
+            else:
+                profile_rngs[room_id] = RoomRandom(seed ^ 1)
+            round_starts[room_id] = 0
+            rooms.append(room_state)
+        profile = PROFILES.get(options['opponent'])
+        max_frames = options['max_match_seconds'] * game_core.TICK_RATE
+        active = list(rooms)
+        while active:
+            inputs = []
+            for room_state in active:
+                if options['skip_screens']: skip_screen_timers(room_state)
+                if profile is not None and room_state['current_screen'] in PLAY_SCREENS:
+                    p1 = game_core.get_player_by_id(room_state, 'player1')
+                    p2 = game_core.get_player_by_id(room_state, 'player2')
+                    actions = profile(p1, p2, profile_rngs[room_state['id']])
+                    if actions: inputs.append((p1['sid'], None, actions, None))
+            _, events = game_core.tick_rooms(active, inputs)
+            for event in events:
+                name = event['event']
+                if name == 'round_started':
+                    round_starts[event['room']] = event['frame']
+                elif name in ROUND_END_EVENTS and (name != 'church_victory' or event.get('immediate')):
+                    tally['rounds'] += 1; round_lengths.append(event['frame'] - round_starts[event['room']])
+                elif name == 'special_level_triggered':
+                    tally['special_levels'] += 1
+                if name == 'church_victory' and event.get('winner') == 'darichris':
+                    tally['darichris_wins'] += 1
+            tally['frames'] += len(active)
+            still_active = []
+            for room_state in active:
+                if room_state['current_screen'] in FINISHED_SCREENS:
+                    winner = room_state['game_winner_player_id']
+                    tally['p1_wins' if winner == 'player1' else 'p2_wins'] += 1
+                elif room_state['frame'] >= max_frames:
+                    tally['stalemates'] += 1
+                else:
+                    still_active.append(room_state)
+            active = still_active
+        for room_state in rooms:
+            tally.update(game_core.combat_tallies[room_state['id']])
+        tally['matches'] += count
+    finally:
+        for room_state in rooms:
+            game_core.release_room_players(room_state); game_core.forget_room(room_state['id'])
+        apply_parameters(previous)
+    return point, tally, round_lengths, time.process_time() - started
+
+
+# --- Sweeps ---
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def summarize(params, tally, round_lengths, cpu_seconds):
+    matches = max(1, tally['matches']); rounds = max(1, tally['rounds'])
+    round_lengths.sort()
+    return {
+        **params,
+        'matches': tally['matches'],
+        'p1_win_rate': round(tally['p1_wins'] / matches, 4),
+        'p2_win_rate': round(tally['p2_wins'] / matches, 4),
+        'stalemate_rate': round(tally['stalemates'] / matches, 4),
+        'special_level_rate': round(tally['special_levels'] / matches, 4),
+        'darichris_win_rate': round(tally['darichris_wins'] / max(1, tally['special_levels']), 4),
+        'rounds_per_match': round(tally['rounds'] / matches, 2),
+        'round_s_mean': round(sum(round_lengths) / rounds / game_core.TICK_RATE, 2),
+        'round_s_p50': round(percentile(round_lengths, 0.5) / game_core.TICK_RATE, 2),
+        'round_s_p90': round(percentile(round_lengths, 0.9) / game_core.TICK_RATE, 2),
+        'clashes_per_round': round(tally['clash'] / rounds, 2),
+        'duck_evasions_per_round': round(tally['duck_evasion'] / rounds, 2),
+        'jump_evasions_per_round': round(tally['jump_evasion'] / rounds, 2),
+        'hits_per_round': round(tally['hit'] / rounds, 2),
+        'misses_per_round': round(tally['miss'] / rounds, 2),
+        'ticks_per_s': round(tally['frames'] / max(cpu_seconds, 1e-9)),  # Room-frames per CPU second
+    }
+
+def sweep(names, combinations, matches, options, workers=None, batch_size=BATCH_SIZE):
+    """Play `matches` per grid combination across a process pool; one summary dict per combination"""
+    tasks = []
+    for point, combination in enumerate(combinations):
+        params = dict(zip(names, combination))
+        for first in range(0, matches, batch_size):
+            tasks.append((point, params, first, min(batch_size, matches - first), options))
+    totals = [[new_tally(), [], 0.0] for _ in combinations]
+    with multiprocessing.Pool(workers, initializer=game_log.configure, initargs=('WARNING',)) as pool:
+        for point, tally, round_lengths, cpu_seconds in pool.imap_unordered(play_batch, tasks):
+            totals[point][0].update(tally); totals[point][1].extend(round_lengths); totals[point][2] += cpu_seconds
+    return [summarize(dict(zip(names, combination)), *totals[point])
+            for point, combination in enumerate(combinations)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play AI matches in bulk and sweep balance parameters')
+    parser.add_argument('--matches', type=int, default=1000, help='matches per grid combination')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=v1,v2',
+                        help='parameter values to sweep (repeatable; every combination is played)')
+    parser.add_argument('--opponent', choices=OPPONENTS, default='ai', help="player 1: 'ai' or a scripted profile")
+    parser.add_argument('--p1-character', default='The Kylander', choices=game_core.CHARACTER_NAMES)
+    parser.add_argument('--p2-character', default='The Potzer', choices=game_core.CHARACTER_NAMES)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='matches per worker task')
+    parser.add_argument('--seed', type=int, default=1, help='base seed; same seed and grid give the same results')
+    parser.add_argument('--max-match-seconds', type=int, default=MAX_MATCH_SECONDS,
+                        help='simulated seconds after which an unfinished match counts as a stalemate')
+    parser.add_argument('--real-screens', action='store_true',
+                        help='run victory/intro screens for their full length instead of skipping them')
+    parser.add_argument('--out', default='selfplay_results.csv', help='results file (CSV, one row per combination)')
+    args = parser.parse_args(argv)
+    try:
+        names, combinations = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = {'opponent': args.opponent, 'p1_character': args.p1_character, 'p2_character': args.p2_character,
+               'seed': args.seed, 'skip_screens': not args.real_screens, 'max_match_seconds': args.max_match_seconds}
+    started = time.perf_counter()
+    rows = sweep(names, combinations, args.matches, options, args.workers, args.batch_size)
+    elapsed = time.perf_counter() - started
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader(); writer.writerows(rows)
+    total = args.matches * len(combinations)
+    print(f'{total} matches in {elapsed:.1f} s ({total / elapsed:.0f} matches/s), results in {args.out}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
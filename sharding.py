@@ -0,0 +1,365 @@
+# Kylander: The Reckoning - Room Sharding
+# One process simulates every room it hosts on one core. A sharded deployment
+# runs several app.py workers instead, each its own process and port:
+# KYLANDER_SHARDS lists their public URLs and KYLANDER_SHARD says which one a
+# process is. Every room belongs to exactly one worker, chosen by consistent
+# hashing of the room id, so adding a worker moves only its share of the rooms.
+# Whichever worker serves the page sends the browser on to the room's owner, and
+# a worker turns away sockets for rooms it doesn't own. All of a room's clients
+# are therefore connected to the worker that ticks it.
+#
+# Emits for clients on another worker (or from tools outside any worker) go
+# through a message queue (KYLANDER_MESSAGE_QUEUE). Redis, Kafka, ZeroMQ and
+# Kombu URLs use python-socketio's managers. local://host:port uses the small
+# broker below, which stands in for one on a single host and in tests. It is
+# for development only: it passes pickles between processes without any
+# authentication, so it (and a worker connecting to it) only accepts a
+# loopback address, where the only clients are this machine's. Emits
+# whose recipients are all connected locally, i.e. every room update, skip the
+# queue.
+#
+#   python sharding.py serve --workers 4                # broker + 4 workers on ports 5001-5004
+#   python sharding.py broker --port 5600
+#   python sharding.py owner room_42 --shards http://127.0.0.1:5001,http://127.0.0.1:5002
+
+import argparse
+import bisect
+import hashlib
+import ipaddress
+import itertools
+import os
+import pickle
+import secrets
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+from urllib.parse import urlparse
+
+import socketio
+
+import game_log
+
+VNODES = 160                 # Points per worker on the ring; more = a more even split
+DEFAULT_BROKER_PORT = 5600
+FRAME = struct.Struct('>I')  # Broker frames: big-endian length, then the pickled message
+
+net_log = game_log.get_logger('net')
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hashing: a key belongs to the first worker point clockwise of its hash"""
+
+    def __init__(self, nodes, vnodes=VNODES):
+        if not nodes:
+            raise ValueError("a hash ring needs at least one node")
+        points = sorted((_ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key):
+        i = bisect.bisect(self._hashes, _ring_hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+
+class ShardMap:
+    """Which worker owns which room, as seen from one worker"""
+
+    def __init__(self, shards, shard):
+        self.shards = [url.rstrip('/') for url in shards]
+        self.shard = shard.rstrip('/')
+        if self.shard not in self.shards:
+            raise ValueError(f"KYLANDER_SHARD {shard!r} is not one of KYLANDER_SHARDS")
+        self.ring = HashRing(self.shards)
+
+    def owner(self, room_id):
+        return self.ring.owner(room_id)
+
+    def owns(self, room_id):
+        return self.ring.owner(room_id) == self.shard
+
+    def stats(self):
+        return {'shard': self.shard, 'shards': len(self.shards)}
+
+
+class RoomRouter:
+    """Room ids for visitors who didn't ask for one.
+
+    Each id is handed to two visitors in turn, so quick-play players meet in the
+    same room wherever the ring puts it."""
+
+    def __init__(self, shard_map):
+        self.shard_map = shard_map
+        self.prefix = f"q{secrets.token_hex(2)}_"   # Ids minted by another worker or an earlier run never clash
+        self._counter = itertools.count(1)
+        self.waiting_room_id = None
+        self.stats = {'routed': 0, 'quick_play_rooms': 0}
+
+    def quick_play_room(self):
+        room_id = self.waiting_room_id
+        if room_id is None:
+            room_id = self.waiting_room_id = f"{self.prefix}{next(self._counter)}"
+            self.stats['quick_play_rooms'] += 1
+        else:
+            self.waiting_room_id = None
+        return room_id
+
+    def route(self, room_id=None):
+        """(room id, owning worker URL) for a visitor, minting a quick-play room when room_id is None"""
+        if room_id is None:
+            room_id = self.quick_play_room()
+        self.stats['routed'] += 1
+        return room_id, self.shard_map.owner(room_id)
+
+
+# --- Message queue ---
+
+class LocalFirstEmitMixin:
+    """Emits whose recipients are all connected to this process skip the queue.
+
+    Rooms never span workers, so this covers every per-room update; only emits
+    for clients elsewhere (or for everyone) are published."""
+
+    def emit(self, event, data, namespace=None, room=None, skip_sid=None, callback=None, **kwargs):
+        if room is not None and callback is None and not kwargs.get('ignore_queue'):
+            connected = self.rooms.get(namespace or '/', {})
+            if room in connected if isinstance(room, str) else all(r in connected for r in room):
+                kwargs['ignore_queue'] = True
+        return super().emit(event, data, namespace=namespace, room=room, skip_sid=skip_sid,
+                            callback=callback, **kwargs)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("broker connection closed")
+        data += chunk
+    return data
+
+
+def _require_loopback(host):
+    """The local broker's frames are unauthenticated pickles: refuse anything but a loopback address"""
+    try:
+        loopback = host == 'localhost' or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"the local broker is for development on one host and only uses loopback addresses, "
+                         f"not {host!r}; use Redis, Kafka, ZeroMQ or Kombu across hosts")
+    return host
+
+
+class LocalBrokerManager(LocalFirstEmitMixin, socketio.PubSubManager):
+    """Socket.IO client manager for the local broker (local://host:port)"""
+    name = 'local'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        parsed = urlparse(url)
+        self.address = (_require_loopback(parsed.hostname or '127.0.0.1'), parsed.port or DEFAULT_BROKER_PORT)
+        self._publisher = None
+
+    def _socket_module(self):
+        # Under eventlet (without monkey patching) a plain socket would block the whole hub
+        if self.server is not None and self.server.async_mode == 'eventlet':
+            from eventlet.green import socket as green_socket
+            return green_socket
+        return socket
+
+    def _connect(self, mode):
+        sock = self._socket_module().create_connection(self.address)
+        sock.sendall(mode + self.channel.encode('utf-8') + b'\n')
+        return sock
+
+    def _publish(self, data):
+        body = pickle.dumps(data)
+        for attempt in range(2):
+            try:
+                if self._publisher is None:
+                    self._publisher = self._connect(b'P')
+                self._publisher.sendall(FRAME.pack(len(body)) + body)
+                return
+            except OSError as error:
+                self._publisher = None
+                if attempt:
+                    net_log.error('queue_publish_failed', broker=f"{self.address[0]}:{self.address[1]}",
+                                  error=str(error))
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                sock = self._connect(b'S')
+                retry_sleep = 1
+                while True:
+                    (size,) = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+                    yield _recv_exactly(sock, size)
+            except (OSError, ConnectionError) as error:
+                net_log.warning('queue_listen_retry', broker=f"{self.address[0]}:{self.address[1]}",
+                                error=str(error), retry_s=retry_sleep)
+                self.server.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 30)
+
+
+def make_client_manager(url, channel='kylander'):
+    """Socket.IO client manager for a message queue URL (local://, redis://, kafka://, zmq+..., or Kombu)"""
+    if url.startswith('local://'):
+        return LocalBrokerManager(url, channel=channel)
+    if url.startswith(('redis://', 'rediss://')):
+        base = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        base = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        base = socketio.ZmqManager
+    else:
+        base = socketio.KombuManager
+    manager_class = type(f"LocalFirst{base.__name__}", (LocalFirstEmitMixin, base), {})
+    return manager_class(url, channel=channel)
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        mode = self.rfile.read(1)
+        channel = self.rfile.readline().strip()
+        broker = self.server.broker
+        if mode == b'S':
+            broker.subscribe(channel, self.connection)
+        try:
+            while True:
+                header = self.rfile.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    return
+                (size,) = FRAME.unpack(header)
+                body = self.rfile.read(size)
+                if len(body) < size:
+                    return
+                broker.publish(channel, header + body)
+        finally:
+            broker.unsubscribe(channel, self.connection)
+
+
+class _BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalBroker:
+    """Minimal pub/sub broker: every frame published on a channel goes to each subscriber of that channel.
+
+    Development only, and loopback only: frames are pickles and nothing is authenticated."""
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_BROKER_PORT):
+        self.server = _BrokerServer((_require_loopback(host), port), _BrokerHandler)
+        self.server.broker = self
+        self.address = self.server.server_address
+        self.subscribers = {}   # channel -> set of sockets
+        self.lock = threading.Lock()
+        self.stats = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0}
+
+    @property
+    def url(self):
+        return f"local://{self.address[0]}:{self.address[1]}"
+
+    def subscribe(self, channel, sock):
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(sock)
+
+    def unsubscribe(self, channel, sock):
+        with self.lock:
+            self.subscribers.get(channel, set()).discard(sock)
+
+    def publish(self, channel, frame):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+            self.stats['published'] += 1
+        for sock in subscribers:
+            try:
+                sock.sendall(frame)
+                self.stats['delivered'] += 1
+            except OSError:
+                self.unsubscribe(channel, sock)
+                self.stats['dropped_subscribers'] += 1
+
+    def start(self):
+        """Serve from a daemon thread; returns self"""
+        threading.Thread(target=self.server.serve_forever, name='kylander-broker', daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve(workers, public_host, base_port, broker_port):
+    """Run the broker here and one app.py worker process per port until interrupted"""
+    broker = LocalBroker('127.0.0.1', broker_port).start()
+    shards = [f"http://{public_host}:{base_port + i}" for i in range(workers)]
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    processes = []
+    for i, shard in enumerate(shards):
+        env = dict(os.environ, PORT=str(base_port + i), KYLANDER_SHARDS=','.join(shards),
+                   KYLANDER_SHARD=shard, KYLANDER_MESSAGE_QUEUE=broker.url)
+        processes.append(subprocess.Popen([sys.executable, app_path], env=env))
+        print(f"worker {i}: {shard} (pid {processes[-1].pid})", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Stop the workers too when stopped
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None: process.terminate()
+        for process in processes:
+            process.wait()
+        broker.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run Kylander as several room-sharded worker processes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='start a local broker and N workers')
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument('--public-host', default='127.0.0.1', help='host name browsers use to reach the workers')
+    serve_parser.add_argument('--base-port', type=int, default=5001)
+    serve_parser.add_argument('--broker-port', type=int, default=DEFAULT_BROKER_PORT)
+    broker_parser = commands.add_parser('broker', help='run only the local message broker (development, loopback only)')
+    broker_parser.add_argument('--port', type=int, default=DEFAULT_BROKER_PORT)
+    owner_parser = commands.add_parser('owner', help='print the worker that owns a room')
+    owner_parser.add_argument('room')
+    owner_parser.add_argument('--shards', default=os.environ.get('KYLANDER_SHARDS', ''))
+    args = parser.parse_args(argv)
+    game_log.configure(os.environ.get('KYLANDER_LOG_LEVEL', 'WARNING'))
+
+    if args.command == 'serve':
+        return serve(args.workers, args.public_host, args.base_port, args.broker_port)
+    if args.command == 'broker':
+        broker = LocalBroker('127.0.0.1', args.port)
+        print(f"broker listening on {broker.url}", file=sys.stderr)
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            broker.close()
+        return 0
+    shards = [url for url in args.shards.split(',') if url]
+    if not shards:
+        parser.error('owner needs --shards or KYLANDER_SHARDS')
+    print(HashRing([url.rstrip('/') for url in shards]).owner(args.room))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
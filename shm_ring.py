@@ -0,0 +1,181 @@
+# Kylander: The Reckoning - Shared-Memory Rings
+# Byte rings in multiprocessing shared memory for passing messages between
+# processes without locks or a broker. Each record is a length-prefixed
+# payload, 8-byte aligned; a record that doesn't fit before the end of the
+# buffer leaves a padding marker and starts again at offset 0.
+#
+# BroadcastRing: one writer, any number of readers, each with its own read
+#   position. The writer never waits and overwrites the oldest records; a
+#   reader that falls a whole buffer behind skips ahead and counts what it lost.
+# ShmQueue: one producer, one consumer. put() refuses a record when the consumer
+#   hasn't made room for it.
+#
+# Positions are absolute byte counts that only grow. The writer announces the
+# end of the record it is about to write (reserve) before writing it and
+# publishes it (commit) afterwards; a reader validates a copied record against
+# the reserve position, seqlock-style. This relies on aligned 8-byte stores
+# becoming visible in program order, as they do on x86-64.
+
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = 0x4B594C52          # 'KYLR'
+HEADER = struct.Struct('<IIQQQQ')   # magic, capacity, reserve, commit, consumer position, dropped puts
+HEADER_SIZE = 64
+LENGTH = struct.Struct('<I')
+PADDING = 0xFFFFFFFF        # Length marking "the rest of the buffer is unused, go to offset 0"
+_U64 = struct.Struct('<Q')
+_RESERVE, _COMMIT, _CONSUMER, _DROPPED = 8, 16, 24, 32   # Header field offsets
+
+
+def _aligned(size):
+    return (size + 7) & ~7
+
+
+class _Ring:
+    def __init__(self, name=None, capacity=None, create=False):
+        if create:
+            capacity = _aligned(capacity)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, capacity, 0, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator unlinks the segment; without this the tracker of a process
+            # that merely attached would remove it when that process exits
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        magic, self.capacity = HEADER.unpack_from(self.shm.buf, 0)[:2]
+        if magic != MAGIC:
+            raise ValueError(f"shared memory {self.shm.name!r} is not a Kylander ring")
+        self.owner = create
+        self.buf = self.shm.buf
+        self.data = self.buf[HEADER_SIZE:HEADER_SIZE + self.capacity]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _get(self, offset):
+        return _U64.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        _U64.pack_into(self.buf, offset, value)
+
+    def _write(self, position, payload):
+        """Write one record at absolute `position`; returns the position after it"""
+        size = _aligned(LENGTH.size + len(payload))
+        if size > self.capacity // 2:
+            raise ValueError(f"record of {len(payload)} bytes is too large for a {self.capacity}-byte ring")
+        offset = position % self.capacity
+        if offset + size > self.capacity:
+            LENGTH.pack_into(self.data, offset, PADDING)
+            position += self.capacity - offset
+            offset = 0
+        LENGTH.pack_into(self.data, offset, len(payload))
+        self.data[offset + LENGTH.size:offset + LENGTH.size + len(payload)] = payload
+        return position + size
+
+    def _record_size(self, position, payload_size):
+        """Bytes the record at `position` takes, padding before it included"""
+        size = _aligned(LENGTH.size + payload_size)
+        offset = position % self.capacity
+        return size + (self.capacity - offset if offset + size > self.capacity else 0)
+
+    def _read(self, position):
+        """(payload bytes, position after it) for the record at `position`"""
+        offset = position % self.capacity
+        (length,) = LENGTH.unpack_from(self.data, offset)
+        if length == PADDING:
+            position += self.capacity - offset
+            offset = 0
+            (length,) = LENGTH.unpack_from(self.data, offset)
+        if length > self.capacity:
+            raise ValueError("corrupt ring record")
+        payload = bytes(self.data[offset + LENGTH.size:offset + LENGTH.size + length])
+        return payload, position + _aligned(LENGTH.size + length)
+
+    def close(self):
+        self.data.release()
+        self.buf = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class BroadcastRing(_Ring):
+    """Single writer; every reader sees every record it keeps up with"""
+
+    def write(self, payload):
+        position = self._get(_COMMIT)
+        end = position + self._record_size(position, len(payload))
+        self._set(_RESERVE, end)   # Readers treat anything this write may overwrite as gone
+        self._write(position, payload)
+        self._set(_COMMIT, end)
+
+    def reader(self):
+        return RingReader(self)
+
+
+class RingReader:
+    """One reader's position in a BroadcastRing; starts at the newest record"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring._get(_COMMIT)
+        self.lost_bytes = 0
+        self.lapped = 0
+
+    def read(self, limit=None):
+        """Records committed since the last read (at most `limit`), oldest first"""
+        ring = self.ring
+        commit = ring._get(_COMMIT)
+        records = []
+        while self.position < commit and (limit is None or len(records) < limit):
+            start = self.position
+            if ring._get(_RESERVE) - ring.capacity > start:
+                self._skip_to(commit); break
+            try:
+                payload, end = ring._read(start)
+            except ValueError:
+                self._skip_to(commit); break
+            if ring._get(_RESERVE) - ring.capacity > start:   # Overwritten while copying
+                self._skip_to(commit); break
+            records.append(payload)
+            self.position = end
+        return records
+
+    def _skip_to(self, position):
+        # Record boundaries behind the writer are unknown once lapped; resume at its latest commit
+        self.lost_bytes += position - self.position
+        self.lapped += 1
+        self.position = position
+
+
+class ShmQueue(_Ring):
+    """Single producer, single consumer; nothing is overwritten"""
+
+    def put(self, payload):
+        """Append a record; False (and counted) when the consumer is a full buffer behind"""
+        position = self._get(_COMMIT)
+        end = position + self._record_size(position, len(payload))
+        if end - self._get(_CONSUMER) > self.capacity:
+            self._set(_DROPPED, self._get(_DROPPED) + 1)
+            return False
+        self._write(position, payload)
+        self._set(_COMMIT, end)
+        return True
+
+    def get_all(self, limit=None):
+        """Take every record queued so far (at most `limit`), oldest first"""
+        position = self._get(_CONSUMER)
+        commit = self._get(_COMMIT)
+        records = []
+        while position < commit and (limit is None or len(records) < limit):
+            payload, position = self._read(position)
+            records.append(payload)
+        self._set(_CONSUMER, position)
+        return records
+
+    def stats(self):
+        commit = self._get(_COMMIT)
+        return {'queued_bytes': commit - self._get(_CONSUMER), 'capacity': self.capacity,
+                'dropped': self._get(_DROPPED)}
@@ -0,0 +1,145 @@
+# Kylander: The Reckoning - Delta-Compressed Room Snapshots
+# Each published room state becomes a numbered snapshot. Clients acknowledge the
+# snapshots they receive and get only the fields that changed since their last
+# acknowledged one, plus a full keyframe now and then so they can always resync.
+
+from collections import OrderedDict
+
+KEYFRAME_INTERVAL = 300   # Messages per client between forced full keyframes (~5 s at 60 Hz)
+HISTORY_SIZE = 64         # Snapshots kept as possible delta bases (~1 s at 60 Hz)
+ENVELOPE_KEYS = ('frame',)  # Room keys that ride in the message envelope, not the snapshot
+
+
+def take_snapshot(room_state, exclude_room_keys=ENVELOPE_KEYS, exclude_player_keys=()):
+    """Copy a room state deep enough that later mutation of the room can't change it"""
+    snapshot = {}
+    for key, value in room_state.items():
+        if key in exclude_room_keys:
+            continue
+        if key == 'players':
+            # Store-backed players (player_store.PlayerView) build their dict once via to_dict()
+            players = {sid: p_state.to_dict() if hasattr(p_state, 'to_dict') else dict(p_state)
+                       for sid, p_state in value.items()}
+            if exclude_player_keys:
+                players = {sid: {k: v for k, v in p_state.items() if k not in exclude_player_keys}
+                           for sid, p_state in players.items()}
+            snapshot[key] = players
+        elif isinstance(value, list):
+            snapshot[key] = list(value)
+        else:
+            snapshot[key] = value
+    return snapshot
+
+
+def diff_snapshots(base, current):
+    """Fields of current that differ from base, in the compact shape the client applies.
+
+    's': changed room keys, 'r': removed room keys,
+    'p': changed fields per player sid (new players in full), 'pr': removed player sids"""
+    delta = {}
+    changed = {k: v for k, v in current.items() if k != 'players' and (k not in base or base[k] != v)}
+    if changed: delta['s'] = changed
+    removed = [k for k in base if k not in current]
+    if removed: delta['r'] = removed
+
+    base_players = base.get('players', {}); current_players = current.get('players', {})
+    player_changes = {}
+    for sid, p_state in current_players.items():
+        base_p = base_players.get(sid)
+        if base_p is None:
+            player_changes[sid] = p_state
+        else:
+            fields = {k: v for k, v in p_state.items() if k not in base_p or base_p[k] != v}
+            if fields: player_changes[sid] = fields
+    if player_changes: delta['p'] = player_changes
+    removed_players = [sid for sid in base_players if sid not in current_players]
+    if removed_players: delta['pr'] = removed_players
+    return delta
+
+
+class _ClientCursor:
+    __slots__ = ('acked_seq', 'last_sent_seq', 'sends_since_keyframe', 'needs_keyframe')
+
+    def __init__(self):
+        self.acked_seq = None
+        self.last_sent_seq = None
+        self.sends_since_keyframe = 0
+        self.needs_keyframe = True
+
+
+class SnapshotChannel:
+    """Snapshot history and per-client ack cursors for one room"""
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, history_size=HISTORY_SIZE,
+                 exclude_room_keys=ENVELOPE_KEYS, exclude_player_keys=()):
+        self.keyframe_interval = keyframe_interval
+        # Fields sent some other way (e.g. the binary hot-state structs) stay out of snapshots
+        self.exclude_room_keys = frozenset(exclude_room_keys) | frozenset(ENVELOPE_KEYS)
+        self.exclude_player_keys = frozenset(exclude_player_keys)
+        self.history_size = history_size
+        self.history = OrderedDict()  # seq -> snapshot
+        self.seq = 0
+        self.clients = {}             # sid -> _ClientCursor
+        self.stats = {'snapshots': 0, 'keyframes_sent': 0, 'deltas_sent': 0, 'unchanged_skipped': 0}
+
+    def add_client(self, sid):
+        """Register (or reset) a client; its next message is a keyframe"""
+        self.clients[sid] = _ClientCursor()
+
+    def remove_client(self, sid):
+        self.clients.pop(sid, None)
+
+    def ack(self, sid, seq):
+        cursor = self.clients.get(sid)
+        if cursor is None or not isinstance(seq, int):
+            return
+        # Only newer snapshots we still hold can become the delta base
+        if seq in self.history and (cursor.acked_seq is None or seq > cursor.acked_seq):
+            cursor.acked_seq = seq
+
+    def request_keyframe(self, sid):
+        cursor = self.clients.get(sid)
+        if cursor: cursor.needs_keyframe = True
+
+    def record(self, room_state):
+        """Snapshot the room; a new seq only if it differs from the last one. Returns (seq, snapshot)"""
+        snapshot = take_snapshot(room_state, self.exclude_room_keys, self.exclude_player_keys)
+        if not self.history or self.history[self.seq] != snapshot:
+            self.seq += 1
+            self.history[self.seq] = snapshot
+            if len(self.history) > self.history_size:
+                self.history.popitem(last=False)
+            self.stats['snapshots'] += 1
+        return self.seq, self.history[self.seq]
+
+    def publish(self, room_state):
+        """Snapshot the room and return [(payload, [sids])] for everyone who needs an update"""
+        _, snapshot = self.record(room_state)
+
+        frame = room_state.get('frame', 0)
+        groups = {}  # base seq (None for keyframe) -> [sids]
+        for sid, cursor in self.clients.items():
+            keyframe = (cursor.needs_keyframe or cursor.acked_seq not in self.history or
+                        cursor.sends_since_keyframe >= self.keyframe_interval)
+            if not keyframe and cursor.last_sent_seq == self.seq:
+                self.stats['unchanged_skipped'] += 1
+                continue
+            base_seq = None if keyframe else cursor.acked_seq
+            groups.setdefault(base_seq, []).append(sid)
+            cursor.last_sent_seq = self.seq
+            if keyframe:
+                cursor.needs_keyframe = False; cursor.sends_since_keyframe = 0
+            else:
+                cursor.sends_since_keyframe += 1
+
+        messages = []
+        for base_seq, sids in groups.items():
+            if base_seq is None:
+                payload = {'seq': self.seq, 'base': None, 'frame': frame, 'state': snapshot}
+                self.stats['keyframes_sent'] += len(sids)
+            else:
+                payload = {'seq': self.seq, 'base': base_seq, 'frame': frame,
+                           'delta': diff_snapshots(self.history[base_seq], snapshot)}
+                self.stats['deltas_sent'] += len(sids)
+            messages.append((payload, sids))
+        return messages
@@ -0,0 +1,76 @@
+# Kylander: The Reckoning - Spectators
+# Spectators watch a room read-only: they hold no player slot, send no input
+# and don't count against MAX_PLAYERS_PER_ROOM. A room's spectators share one
+# stream at a lower rate than the players get. Every few frames the room is
+# captured (packed hot state, plus a copy of the cold fields when they
+# changed) into a short delay buffer; the capture that has aged past the delay
+# is released as one update for the whole group, encoded once however many
+# spectators there are. app.py sends the updates from outside the tick.
+
+from collections import deque
+
+import wire_protocol
+from snapshots import take_snapshot
+
+SPECTATOR_RATE = 10            # Updates per second
+SPECTATOR_DELAY_FRAMES = 15    # How far spectators trail the match (~250 ms at 60 fps)
+MAX_SPECTATORS_PER_ROOM = 500
+
+
+class SpectatorGroup:
+    """One room's spectators and their shared, delayed update stream"""
+
+    def __init__(self, interval_frames, delay_frames=SPECTATOR_DELAY_FRAMES):
+        self.interval_frames = interval_frames
+        self.delay_frames = delay_frames
+        self.sids = set()
+        self.pending = deque()       # (frame, hot bytes, cold keyframe payload or None), oldest first
+        self.last_capture_frame = None
+        self.sfx_event = None        # Newest sound since the last capture (sounds last a single frame)
+        self.cold = None             # Newest captured cold snapshot
+        self.cold_seq = 0
+        self.last_update = None      # (frame, hot bytes, cold keyframe payload) last released; starts joiners off
+        self.stats = {'captures': 0, 'updates': 0, 'cold_keyframes': 0}
+
+    def observe(self, room_state):
+        """Call once per tick: captures the room every interval_frames frames"""
+        frame = room_state['frame']
+        sfx_event = room_state.get('sfx_event_for_client')
+        if sfx_event is not None: self.sfx_event = sfx_event
+        if self.last_capture_frame is not None and frame - self.last_capture_frame < self.interval_frames:
+            return
+        self.last_capture_frame = frame
+        snapshot = take_snapshot(room_state, wire_protocol.HOT_ROOM_KEYS, wire_protocol.HOT_PLAYER_KEYS)
+        cold_payload = None
+        if snapshot != self.cold:
+            self.cold = snapshot; self.cold_seq += 1
+            cold_payload = {'seq': self.cold_seq, 'base': None, 'frame': frame, 'state': snapshot}
+        self.pending.append((frame, wire_protocol.encode_hot_state(room_state, self.sfx_event), cold_payload))
+        self.sfx_event = None
+        self.stats['captures'] += 1
+
+    def release(self, frame):
+        """The update whose delay has passed by `frame`, as (frame, hot bytes, cold payload or None), or None"""
+        update = None
+        while self.pending and frame - self.pending[0][0] >= self.delay_frames:
+            captured = self.pending.popleft()
+            if update is not None and captured[2] is None and update[2] is not None:
+                captured = (captured[0], captured[1], update[2])  # Never skip past a cold change
+            update = captured
+        if update is None:
+            return None
+        cold_payload = update[2] or (self.last_update[2] if self.last_update else None)
+        self.last_update = (update[0], update[1], cold_payload)
+        self.stats['updates'] += 1
+        if update[2] is not None: self.stats['cold_keyframes'] += 1
+        return update
+
+    def join_update(self):
+        """(frame, hot bytes, cold payload) a new spectator starts from, or None before the first release"""
+        return self.last_update
+
+
+def encode_update(update):
+    """Binary room message for a spectator update"""
+    frame, hot_bytes, cold_payload = update
+    return wire_protocol.encode_room_message(frame, hot_bytes, cold_payload)
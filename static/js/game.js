@@ -12,11 +12,29 @@ const SERVER_ATTACK_DURATION = 24;  // INCREASED: Match server value (was 18)
 const WALK_ANIMATION_MS_PER_FRAME = 133; 
 const QUICKENING_FLASH_DURATION_MS_CLIENT = 100; 
 
-const socket = io();
+// Join a specific room when the URL carries ?room=<id> (shared by Player 1 for two-player games)
+const pageParams = new URLSearchParams(window.location.search);
+const requestedRoomId = pageParams.get('room');
+// Compact binary protocol by default; ?wire=json falls back to JSON snapshots
+const WIRE_PROTOCOL_VERSION = 2;
+const useBinaryWire = pageParams.get('wire') !== 'json';
+// ?spectate=1 (with ?room=<id>) watches a match read-only, a little behind and at a lower rate
+const spectating = pageParams.has('spectate');
+const socketQuery = {};
+if (requestedRoomId) socketQuery.room = requestedRoomId;
+if (spectating) socketQuery.spectate = '1';
+if (useBinaryWire) socketQuery.wire = `bin${WIRE_PROTOCOL_VERSION}`;
+// ?match=1 waits for an opponent in the matchmaking queue (optionally &character=<name>&rating=<n>&mode=ONE)
+for (const key of ['match', 'character', 'rating', 'mode']) {
+    if (pageParams.has(key)) socketQuery[key] = pageParams.get(key);
+}
+let matchmakingStatus = null;
+const socket = io({ query: socketQuery });
 
 let localPlayerId = null;
+let localRoomId = null;
 let roomState = {};
-let allAssetsLoaded = false;
+let allAssetsLoaded = false;  // Everything the current screen draws has loaded
 let currentMusic = null;
 let requestAnimationFrameId;
 let mainMusicPlaying = false; 
@@ -78,6 +96,46 @@ const ASSET_PATHS = {
     }
 };
 
+// The server's asset manifest (asset_tiers.py), inlined by the page: for every asset its tier and
+// URL (content-hashed when built), for a sprite frame its rectangle in the fighter's atlas.
+// Without it every path above is fetched as is, all before the first screen.
+const ASSET_MANIFEST = window.ASSET_MANIFEST || null;
+const atlasLoads = {};  // atlas -> Promise of its image, shared by all of its frames
+
+function manifestEntry(path) {
+    return ASSET_MANIFEST ? ASSET_MANIFEST.assets[path.replace(/^static\//, '')] : undefined;
+}
+
+function builtAssetPath(path) {
+    const entry = manifestEntry(path);
+    return entry && entry.url ? `static/${entry.url}` : path;
+}
+
+function loadAtlas(atlas) {
+    if (!atlasLoads[atlas]) {
+        atlasLoads[atlas] = new Promise((resolve) => {
+            const img = new Image();
+            img.onload = () => resolve(img);
+            img.onerror = (err) => { console.error(`ATLAS LOAD FAIL: ${atlas}`, err); resolve(null); };
+            img.src = `static/${ASSET_MANIFEST.atlases[atlas].url}`;
+        });
+    }
+    return atlasLoads[atlas];
+}
+
+// A sprite frame cut out of its atlas into a canvas, which the drawing code uses like the frame's own image
+function loadAtlasFrame(frame, key) {
+    return loadAtlas(frame.atlas).then((atlasImg) => {
+        assetsLoaded++;
+        if (!atlasImg) return null;
+        const canvas = document.createElement('canvas');
+        canvas.width = frame.w; canvas.height = frame.h;
+        canvas.getContext('2d').drawImage(atlasImg, frame.x, frame.y, frame.w, frame.h, 0, 0, frame.w, frame.h);
+        loadedAssets.images[key] = canvas;
+        return canvas;
+    });
+}
+
 const loadedAssets = { images: {}, sounds: {} };
 let assetsToLoad = 0, assetsLoaded = 0;
 const clientPlayerAnimationState = {};
@@ -86,9 +144,11 @@ const clientPlayerAnimationState = {};
 let darkQuickeningLoaded = false;
 
 function loadImage(path, key) {
+    const entry = manifestEntry(path);
+    if (entry && entry.frame) return loadAtlasFrame(entry.frame, key);
     return new Promise((resolve) => {
         const img = new Image();
-        img.src = path;
+        img.src = builtAssetPath(path);
         img.onload = () => { 
             loadedAssets.images[key] = img; 
             assetsLoaded++;
@@ -112,56 +172,134 @@ function loadImage(path, key) {
     });
 }
 
+// Sound effects come out of one audio sprite (build_assets.py), decoded once into a Web Audio buffer;
+// each plays from its offset in it, starting with no media element to spin up. The server names them
+// by sprite id (the sound file's name), which sfxById resolves with or without a build.
+let sfxAudioContext = null;
+const audioSpriteLoads = {};  // sprite -> Promise of its decoded AudioBuffer
+const sfxById = {};
+
+function loadAudioSprite(sprite) {
+    if (!audioSpriteLoads[sprite]) {
+        const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+        if (!sfxAudioContext && AudioContextClass) sfxAudioContext = new AudioContextClass();  // Resumed on the first click/key
+        audioSpriteLoads[sprite] = !sfxAudioContext ? Promise.resolve(null) : fetch(`static/${ASSET_MANIFEST.audio_sprites[sprite].url}`)
+            .then(response => response.arrayBuffer())
+            .then(data => new Promise((resolve, reject) => sfxAudioContext.decodeAudioData(data, resolve, reject)))
+            .catch(err => { console.error(`AUDIO SPRITE LOAD FAIL: ${sprite}`, err); return null; });
+    }
+    return audioSpriteLoads[sprite];
+}
+
+// One sound of a sprite, with the bits of the Audio element interface the game uses
+class SpriteSound {
+    constructor(buffer, sound) { this.buffer = buffer; this.sound = sound; this.volume = 1; this.currentTime = 0; this.source = null; }
+    get paused() { return !this.source; }
+    play() {
+        this.pause();
+        const gain = sfxAudioContext.createGain();
+        gain.gain.value = this.volume;
+        gain.connect(sfxAudioContext.destination);
+        const source = sfxAudioContext.createBufferSource();
+        source.buffer = this.buffer;
+        source.connect(gain);
+        source.onended = () => { if (this.source === source) this.source = null; };
+        source.start(0, this.sound.start, this.sound.duration);
+        this.source = source;
+        return Promise.resolve();
+    }
+    pause() { if (this.source) { this.source.stop(); this.source = null; } }
+}
+
+function soundId(path) { return path.split('/').pop().replace(/\.[^.]*$/, ''); }
+
 function loadSound(path, key) {
+    const entry = manifestEntry(path);
+    if (entry && entry.sound) {
+        return loadAudioSprite(entry.sound.sprite).then((buffer) => {
+            assetsLoaded++;
+            if (!buffer) return null;
+            const sound = new SpriteSound(buffer, entry.sound);
+            loadedAssets.sounds[key] = sfxById[entry.sound.id] = sound;
+            return sound;
+        });
+    }
     return new Promise((resolve) => {
         try {
-            const audio = new Audio(path); loadedAssets.sounds[key] = audio; assetsLoaded++; resolve(audio);
+            const audio = new Audio(builtAssetPath(path)); loadedAssets.sounds[key] = sfxById[soundId(path)] = audio; assetsLoaded++; resolve(audio);
         } catch (err) { console.error(`SOUND LOAD FAIL: ${path} (key: ${key})`, err); assetsLoaded++; resolve(null); }
     });
 }
 
-function loadAllAssets() {
-    const promises = []; assetsToLoad = 0; assetsLoaded = 0; allAssetsLoaded = false;
+// Every asset the client uses: {path, key, sound}
+function assetList() {
+    const assets = [];
+    const image = (path, key) => assets.push({ path, key, sound: false });
     for (const key in ASSET_PATHS.ui) { 
-        if (key !== 'darkQuickeningAlt') {  // Skip alternative, we'll load it only if needed
-            assetsToLoad++; 
-            promises.push(loadImage(ASSET_PATHS.ui[key], `ui_${key}`)); 
-        }
+        if (key !== 'darkQuickeningAlt') image(ASSET_PATHS.ui[key], `ui_${key}`);  // Skip alternative, we'll load it only if needed
     }
     for (const category in ASSET_PATHS.backgrounds) {
-        ASSET_PATHS.backgrounds[category].forEach((bgPath, index) => {
-            assetsToLoad++; promises.push(loadImage(bgPath, `bg_${category}_${index}`));
-        });
+        ASSET_PATHS.backgrounds[category].forEach((bgPath, index) => image(bgPath, `bg_${category}_${index}`));
     }
     for (const charKey in ASSET_PATHS.characters) {
         const charData = ASSET_PATHS.characters[charKey];
-        assetsToLoad++; promises.push(loadImage(charData.idle, `char_${charKey}_idle`));
-        assetsToLoad++; promises.push(loadImage(charData.duck, `char_${charKey}_duck`));
-        assetsToLoad++; promises.push(loadImage(charData.jump, `char_${charKey}_jump`));
-        assetsToLoad++; promises.push(loadImage(charData.jump_attack, `char_${charKey}_jump_attack`));
-        for (let i = 0; i < charData.num_attack; i++) {
-            assetsToLoad++; promises.push(loadImage(`${charData.attack_prefix}_${i+1}.png`, `char_${charKey}_attack_${i}`));
-        }
-        for (let i = 0; i < charData.num_walk; i++) {
-            assetsToLoad++; promises.push(loadImage(`${charData.walk_prefix}_${i+1}.png`, `char_${charKey}_walk_${i}`));
-        }
+        image(charData.idle, `char_${charKey}_idle`);
+        image(charData.duck, `char_${charKey}_duck`);
+        image(charData.jump, `char_${charKey}_jump`);
+        image(charData.jump_attack, `char_${charKey}_jump_attack`);
+        for (let i = 0; i < charData.num_attack; i++) image(`${charData.attack_prefix}_${i+1}.png`, `char_${charKey}_attack_${i}`);
+        for (let i = 0; i < charData.num_walk; i++) image(`${charData.walk_prefix}_${i+1}.png`, `char_${charKey}_walk_${i}`);
     }
-    for (const key in ASSET_PATHS.sfx) { assetsToLoad++; promises.push(loadSound(ASSET_PATHS.sfx[key], `sfx_${key}`));}
-    for (const musicAssetKey in ASSET_PATHS.music) { 
-        assetsToLoad++; 
-        promises.push(loadSound(ASSET_PATHS.music[musicAssetKey], musicAssetKey)); 
+    for (const key in ASSET_PATHS.sfx) assets.push({ path: ASSET_PATHS.sfx[key], key: `sfx_${key}`, sound: true });
+    for (const musicAssetKey in ASSET_PATHS.music) assets.push({ path: ASSET_PATHS.music[musicAssetKey], key: musicAssetKey, sound: true });
+    return assets;
+}
+
+// Progressive loading: a screen waits only for the tiers it draws from (ASSET_MANIFEST.screens),
+// and the tier after them loads in the background meanwhile
+const ASSET_TIERS = ASSET_MANIFEST ? ASSET_MANIFEST.tiers : ['ALL'];
+const tierLoads = {};            // tier -> Promise, once its loading has started
+const loadedTiers = new Set();
+let allAssets = null;
+
+function assetTier(path) {
+    const entry = manifestEntry(path);
+    return entry ? entry.tier : ASSET_TIERS[0];  // Unknown to the server: load it with the first tier
+}
+
+function loadTier(tier) {
+    if (!tierLoads[tier]) {
+        if (!allAssets) allAssets = assetList();
+        const assets = allAssets.filter(asset => assetTier(asset.path) === tier);
+        assetsToLoad += assets.length;
+        tierLoads[tier] = Promise.all(assets.map(asset => asset.sound ? loadSound(asset.path, asset.key) : loadImage(asset.path, asset.key)))
+            .then(() => { loadedTiers.add(tier); console.log(`Asset tier ${tier} loaded (${assets.length} assets).`); });
     }
-    console.log(`Attempting to load ${assetsToLoad} assets.`);
-    return Promise.all(promises);
+    return tierLoads[tier];
+}
+
+// True once everything `screen` draws has loaded; until then starts loading it, after that the next tier
+function screenAssetsReady(screen) {
+    const needed = (ASSET_MANIFEST && ASSET_MANIFEST.screens[screen]) || ASSET_TIERS;
+    needed.forEach(loadTier);
+    if (!needed.every(tier => loadedTiers.has(tier))) return false;
+    const next = ASSET_TIERS[ASSET_TIERS.indexOf(needed[needed.length - 1]) + 1];
+    if (next) loadTier(next);
+    return true;
 }
 
 function drawLoadingScreen() {
     ctx.fillStyle = 'black'; ctx.fillRect(0, 0, GAME_WIDTH, GAME_HEIGHT);
     ctx.fillStyle = 'white'; ctx.font = '20px HighlanderFont, Arial'; ctx.textAlign = 'center';
     const progress = assetsToLoad > 0 ? Math.min(100, (assetsLoaded / assetsToLoad) * 100) : 100;
-    ctx.fillText(`Loading Assets... ${Math.round(progress)}%`, GAME_WIDTH / 2, GAME_HEIGHT / 2);
+    if (matchmakingStatus && matchmakingStatus.status === 'queued' && progress >= 100) {
+        ctx.fillText('Finding an opponent...', GAME_WIDTH / 2, GAME_HEIGHT / 2);
+        ctx.font = '16px HighlanderFont, Arial';
+        ctx.fillText(`${matchmakingStatus.waiting} waiting`, GAME_WIDTH / 2, GAME_HEIGHT / 2 + 30);
+    } else {
+        ctx.fillText(`Loading Assets... ${Math.round(progress)}%`, GAME_WIDTH / 2, GAME_HEIGHT / 2);
+    }
     ctx.textAlign = 'left';
-    if (assetsLoaded >= assetsToLoad && !allAssetsLoaded) { allAssetsLoaded = true; console.log("All assets loading initiated.");}
 }
 
 // IMPROVED: Better playMusic function with forced restart
@@ -758,6 +896,8 @@ function gameLoop(currentTime) {
     ctx.globalCompositeOperation = 'source-over';
     ctx.globalAlpha = 1.0;
     
+    // Before the first room update, the title screen's assets (where most sessions start)
+    allAssetsLoaded = screenAssetsReady(roomState.current_screen || ASSET_TIERS[0]);
     if (!allAssetsLoaded || Object.keys(roomState).length === 0) {
         drawLoadingScreen();
     } else {
@@ -836,21 +976,201 @@ function gameLoop(currentTime) {
     requestAnimationFrameId = requestAnimationFrame(gameLoop);
 }
 
-socket.on('connect', () => { console.log('Connected:', socket.id); });
+socket.on('connect', () => { console.log('Connected:', socket.id); snapshotStates.clear(); coldSnapshotState = null; });
 socket.on('assign_player_id', (data) => {
     localPlayerId = data.playerId; 
     roomState = data.initialRoomState;
+    // Put the room id in the address bar so the "go to" link sends Player 2 to this room
+    if (data.roomId && data.roomId !== localRoomId) {
+        localRoomId = data.roomId;
+        const url = new URL(window.location.href);
+        url.searchParams.set('room', localRoomId);
+        window.history.replaceState(null, '', url.toString());
+    }
     console.log('Assigned ID:', localPlayerId, 'Initial State Received. Screen:', roomState.current_screen);
 });
 
+socket.on('matchmaking', (data) => {
+    matchmakingStatus = data;
+    console.log('Matchmaking:', data.status, data.opponent || '');
+});
+
+// Spectators get binary room updates only (the JSON part is always a full keyframe)
+socket.on('spectating', (data) => {
+    localRoomId = data.roomId;
+    console.log('Spectating room', localRoomId);
+});
+socket.on('spectate_ended', () => { console.log('The match being watched has ended'); });
+
+// Delta-compressed room snapshots: each message is a full keyframe or the changes since
+// a snapshot we acknowledged, so keep recent snapshots around as possible delta bases.
+const snapshotStates = new Map();
+let lastAckSentTime = 0;
+const SNAPSHOT_ACK_INTERVAL_MS = 50;
+const SNAPSHOT_HISTORY_SIZE = 64;  // Matches the server's HISTORY_SIZE: older bases are never used
+
+function applySnapshotDelta(base, delta) {
+    const state = Object.assign({}, base);
+    if (delta.s) Object.assign(state, delta.s);
+    if (delta.r) delta.r.forEach(key => { delete state[key]; });
+    if (delta.p || delta.pr) {
+        const players = Object.assign({}, base.players);
+        if (delta.p) {
+            for (const sid in delta.p) {
+                players[sid] = Object.assign({}, players[sid], delta.p[sid]);
+            }
+        }
+        if (delta.pr) delta.pr.forEach(sid => { delete players[sid]; });
+        state.players = players;
+    }
+    return state;
+}
+
+// Rebuild the full snapshot a message describes; null if we no longer hold its delta base
+function reconstructSnapshot(msg) {
+    let state;
+    if (msg.state) {
+        state = msg.state;
+    } else {
+        const base = snapshotStates.get(msg.base);
+        if (!base) { socket.emit('snapshot_resync', {}); return null; }
+        state = applySnapshotDelta(base, msg.delta);
+    }
+    snapshotStates.set(msg.seq, state);
+    for (const seq of snapshotStates.keys()) {
+        if (seq <= msg.seq - SNAPSHOT_HISTORY_SIZE) snapshotStates.delete(seq);
+    }
+
+    // Acknowledge keyframes at once and deltas at a modest rate
+    const now = Date.now();
+    if (msg.state || now - lastAckSentTime >= SNAPSHOT_ACK_INTERVAL_MS) {
+        socket.emit('snapshot_ack', { seq: msg.seq });
+        lastAckSentTime = now;
+    }
+    return state;
+}
+
+socket.on('room_snapshot', (msg) => {
+    const state = reconstructSnapshot(msg);
+    if (state) applyRoomState(Object.assign({}, state, { frame: msg.frame }));
+});
+
+// --- Binary wire protocol (mirrors wire_protocol.py; keep tables and layouts in sync) ---
+const WIRE_MSG_ROOM_STATE = 1;
+const WIRE_MSG_PLAYER_ACTIONS = 2;
+const WIRE_SCREENS = ['TITLE', 'MODE_SELECT', 'CHARACTER_SELECT_P1', 'CHARACTER_SELECT_P2', 'CONTROLS',
+                      'PLAYING', 'SPECIAL', 'SPECIAL_END', 'VICTORY', 'CHURCH_INTRO', 'CHURCH_VICTORY',
+                      'CHURCH_VICTORY_IMMEDIATE', 'FINAL', 'GAME_OVER', 'SLIDESHOW', 'SLIDESHOW_TO_TITLE'];
+const WIRE_ANIMATIONS = ['idle', 'walk', 'attack', 'jump_attack', 'jump', 'duck'];
+const WIRE_SFX_EVENTS = [null, 'sword_whoosh', 'sword_clash', 'sword_swing', 'swordeffects'];  // Audio sprite ids
+const WIRE_BACKGROUND_KEYS = ['paris', 'church', 'victory', 'slideshow', 'church_victory'];
+const WIRE_ROOM_FLAGS = ['quickening_effect_active', 'dark_quickening_effect_active', 'special_level_active',
+                         'slideshow_music_started', 'church_victory_sound_triggered', 'final_sound_played',
+                         'swordeffects_playing', 'ai_opponent_active', 'p1_selection_complete',
+                         'p2_selection_complete', 'p1_waiting_for_p2'];
+const WIRE_PLAYER_FLAGS = ['is_attacking', 'is_ducking', 'is_jumping', 'has_hit_this_attack',
+                           'is_ready_next_round', 'miss_swing'];
+const WIRE_HEADER_SIZE = 8, WIRE_ROOM_SIZE = 14, WIRE_PLAYER_SIZE = 13;
+const WIRE_ACTION_LEFT = 1, WIRE_ACTION_RIGHT = 2, WIRE_ACTION_JUMP = 4, WIRE_ACTION_ATTACK = 8,
+      WIRE_ACTION_DUCK = 16, WIRE_ACTION_DUCK_ACTIVE = 32;
+let coldSnapshotState = null;  // Latest JSON-carried (rarely changing) fields for binary clients
+let actionFrameStamp = 0;
+let lastRoomFrame = 0;  // Newest room frame shown; input is stamped with it so the server can apply it there
+
+function decodeFlags(bits, keys, target) {
+    keys.forEach((key, i) => { target[key] = (bits & (1 << i)) !== 0; });
+}
+
+function decodeRoomMessage(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== WIRE_PROTOCOL_VERSION || view.getUint8(1) !== WIRE_MSG_ROOM_STATE) return null;
+    const frame = view.getUint32(2, true);
+    const coldLength = view.getUint16(6, true);
+    let o = WIRE_HEADER_SIZE;
+    const victorySfx = view.getInt8(o + 10);
+    const room = {
+        frame: frame,
+        current_screen: WIRE_SCREENS[view.getUint8(o)] || 'UNKNOWN',
+        current_background_key: WIRE_BACKGROUND_KEYS[view.getUint8(o + 1)],
+        current_background_index: view.getUint8(o + 2),
+        sfx_event_for_client: WIRE_SFX_EVENTS[view.getUint8(o + 3)] || null,
+        clash_flash_timer: view.getUint8(o + 4),
+        state_timer_frames: view.getUint16(o + 5, true),
+        match_score_p1: view.getUint8(o + 7),
+        match_score_p2: view.getUint8(o + 8),
+        church_victory_bg_index: view.getUint8(o + 9),
+    };
+    if (victorySfx >= 0) room.victory_sfx_to_play_index = victorySfx;
+    decodeFlags(view.getUint16(o + 11, true), WIRE_ROOM_FLAGS, room);
+    const playerCount = view.getUint8(o + 13);
+    o += WIRE_ROOM_SIZE;
+    const players = {};
+    for (let i = 0; i < playerCount; i++, o += WIRE_PLAYER_SIZE) {
+        const p = {
+            x: view.getInt16(o + 1, true), y: view.getInt16(o + 3, true),
+            vertical_velocity: view.getInt8(o + 5), health: view.getInt8(o + 6), facing: view.getInt8(o + 7),
+            current_animation: WIRE_ANIMATIONS[view.getUint8(o + 8)] || 'idle',
+            attack_timer: view.getUint8(o + 9), cooldown_timer: view.getUint8(o + 10),
+            knockback_timer: view.getUint8(o + 11),
+        };
+        decodeFlags(view.getUint8(o + 12), WIRE_PLAYER_FLAGS, p);
+        players[`player${view.getUint8(o)}`] = p;
+    }
+    const cold = coldLength ? JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, o, coldLength))) : null;
+    return { room, players, cold };
+}
+
+socket.on('room_snapshot_bin', (data) => {
+    const decoded = decodeRoomMessage(data instanceof ArrayBuffer ? data : data.buffer);
+    if (!decoded) return;
+    if (decoded.cold) {
+        const cold = reconstructSnapshot(decoded.cold);
+        if (!cold) return;
+        coldSnapshotState = cold;
+    }
+    if (!coldSnapshotState) return;
+    // Overlay the packed per-frame fields on the latest cold snapshot
+    const state = Object.assign({}, coldSnapshotState, decoded.room);
+    state.players = {};
+    for (const sid in coldSnapshotState.players) {
+        const p = coldSnapshotState.players[sid];
+        state.players[sid] = Object.assign({}, p, decoded.players[p.id]);
+    }
+    applyRoomState(state);
+});
+
+function emitPlayerActions(actions) {
+    if (!useBinaryWire) {
+        socket.emit('player_actions', { actions: actions, frame: actionFrameStamp++, room_frame: lastRoomFrame });
+        return;
+    }
+    let bits = 0;
+    actions.forEach(action => {
+        if (action.type === 'move') bits |= action.direction === 'left' ? WIRE_ACTION_LEFT : WIRE_ACTION_RIGHT;
+        else if (action.type === 'jump') bits |= WIRE_ACTION_JUMP;
+        else if (action.type === 'attack') bits |= WIRE_ACTION_ATTACK;
+        else if (action.type === 'duck') bits |= WIRE_ACTION_DUCK | (action.active ? WIRE_ACTION_DUCK_ACTIVE : 0);
+    });
+    const buffer = new ArrayBuffer(11);
+    const view = new DataView(buffer);
+    view.setUint8(0, WIRE_PROTOCOL_VERSION); view.setUint8(1, WIRE_MSG_PLAYER_ACTIONS);
+    view.setUint32(2, actionFrameStamp++ >>> 0, true); view.setUint32(6, lastRoomFrame >>> 0, true);
+    view.setUint8(10, bits);
+    socket.emit('player_actions', buffer);
+}
+
+// Full room state pushes (older servers) go through the same path
+socket.on('update_room_state', (newRoomState) => applyRoomState(newRoomState));
+
 // ENHANCED: Slideshow music handling with Darius sound support
-socket.on('update_room_state', (newRoomState) => {
+function applyRoomState(newRoomState) {
     const oldScreen = roomState.current_screen;
     const oldRoundWinner = roomState.round_winner_player_id;
     const oldSlideshowMusic = roomState.slideshow_music_started;
     const oldSlideshow = (roomState.current_screen === 'SLIDESHOW');
     const oldChurchVictorySound = roomState.church_victory_sound_triggered; // NEW: Track church victory sound
     roomState = newRoomState;
+    if (typeof roomState.frame === 'number') lastRoomFrame = roomState.frame;
 
     if (roomState.round_winner_player_id && roomState.round_winner_player_id !== oldRoundWinner) {
         roundVictorySfxPlayed = false; 
@@ -970,15 +1290,12 @@ socket.on('update_room_state', (newRoomState) => {
 
     // Enhanced sound effect management with Darius sound support
     if (roomState.sfx_event_for_client) {
-        const sfx = loadedAssets.sounds[roomState.sfx_event_for_client];
+        const sfx = sfxById[roomState.sfx_event_for_client];
         if (sfx) {
+            if (roomState.sfx_event_for_client === 'swordeffects') sfx.volume = 0.7;
             sfx.currentTime = 0;
             sfx.play().catch(e => console.warn("SFX play error (event):", e));
         }
-        
-        if (roomState.sfx_event_for_client === 'sfx_swordEffects') {
-            sfx.volume = 0.7;
-        }
     }
 
     // NEW: Handle Darius sounds for church victory screens based on background
@@ -1002,6 +1319,13 @@ socket.on('update_room_state', (newRoomState) => {
             console.warn(`${soundName} sound not loaded (key: ${soundKey})`);
         }
     }
+}
+
+// Sharded servers: this worker doesn't host the room, so load the page from the one that does
+socket.on('wrong_shard', (data) => {
+    const url = new URL(window.location.href);
+    url.searchParams.set('room', data.roomId);
+    window.location.replace(`${data.owner}/${url.search}`);
 });
 
 socket.on('room_full', () => { 
@@ -1018,7 +1342,7 @@ function handleKeyDown(e) {
     const key = e.key.toLowerCase();
     const gameControlKeys = [' ', 'arrowup', 'arrowdown', 'arrowleft', 'arrowright', 'q', 'e', 'a', 's', 'd', 'w', 'shift', 'alt', 'control', 'enter', 'b'];
     if (gameControlKeys.includes(key) || (key >= '1' && key <= '3')) e.preventDefault();
-    if (!allAssetsLoaded) return;
+    if (!allAssetsLoaded || spectating) return;
     keysPressed[key] = true;
 
     if (roomState.current_screen === 'TITLE' && key === 'enter') {
@@ -1058,7 +1382,7 @@ function handleKeyUp(e) {
                 pControlsDuckKey = 'arrowdown';
             }
             if (key === pControlsDuckKey && myClientPlayerObject.is_ducking) { 
-                socket.emit('player_actions', { actions: [{ type: 'duck', active: false }] });
+                emitPlayerActions([{ type: 'duck', active: false }]);
             }
         }
     }
@@ -1100,11 +1424,14 @@ function sendPlayerActions() {
     
     // FIXED: Always send actions to server, even if empty
     // This allows server to detect when movement keys are released
-    socket.emit('player_actions', { actions: actions });
+    emitPlayerActions(actions);
 }
 
 function enableAudioContext() {
     console.log("User interaction detected, attempting to enable audio context.");
+    if (sfxAudioContext && sfxAudioContext.state === 'suspended') {
+        sfxAudioContext.resume().catch(e => console.warn("Sound effect AudioContext resume error:", e));
+    }
     let audioContextResumed = false;
     const AudioContext = window.AudioContext || window.webkitAudioContext;
     if (AudioContext) {
@@ -1145,14 +1472,6 @@ function enableAudioContext() {
 window.addEventListener('click', enableAudioContext, { once: true });
 window.addEventListener('keydown', enableAudioContext, { once: true });
 
-loadAllAssets().then(() => {
-    console.log("Asset loading phase complete.");
-    function animationLoop(time) { gameLoop(time); requestAnimationFrameId = requestAnimationFrame(animationLoop); }
-    requestAnimationFrameId = requestAnimationFrame(animationLoop);
-}).catch(err => { 
-    console.error("Error during initial asset loading promise:", err);
-    ctx.fillStyle = 'black'; ctx.fillRect(0,0, GAME_WIDTH, GAME_HEIGHT);
-    ctx.fillStyle = 'red'; ctx.font = '20px HighlanderFont, Arial'; ctx.textAlign = 'center';
-    ctx.fillText("Error loading assets. Please check console.", GAME_WIDTH / 2, 50);
-    ctx.textAlign = 'left';
-});
+// The loading screen shows until the current screen's assets are in (see screenAssetsReady)
+function animationLoop(time) { gameLoop(time); requestAnimationFrameId = requestAnimationFrame(animationLoop); }
+requestAnimationFrameId = requestAnimationFrame(animationLoop);
@@ -0,0 +1,114 @@
+# Kylander: The Reckoning - Static File Serving
+# Replaces Flask's static route with one that costs the eventlet workers as
+# little as possible per asset:
+#   - a file built with precompressed variants (build_assets.py writes .br
+#     and .gz next to text assets) is sent in the best encoding the client
+#     accepts, without compressing anything at request time;
+#   - every response has a strong ETag: the content hash in the name of a
+#     built file, else a hash of the file computed once per modification;
+#   - content-hashed files under build/ are cacheable for a year as immutable,
+#     anything else is revalidated, which is a bodiless 304 when unchanged;
+#   - byte ranges (audio seeks) come straight from the file; the file body
+#     goes through the server's wsgi.file_wrapper, sendfile() where it has one.
+# Bytes sent, 304s and which encodings were used are counted for /health.
+
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import abort, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+BUILD_PREFIX = 'build/'          # build_assets.BUILD_DIR_NAME: everything under it is content-hashed
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))   # Preferred first
+HASHED_NAME = re.compile(r'\.([0-9a-f]{10})\.[^./]+$')   # name.<build_assets hash>.ext
+
+
+class _Entry:
+    __slots__ = ('stamp', 'etag', 'variants')
+
+    def __init__(self, stamp, etag, variants):
+        self.stamp = stamp         # (mtime_ns, size) of the file when this was worked out
+        self.etag = etag
+        self.variants = variants   # [(encoding, path)] of the precompressed copies that exist
+
+
+class StaticFiles:
+    """The static route of one Flask app; see the module comment"""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.entries = {}   # path -> _Entry
+        self.stats = {'requests': 0, 'bytes_sent': 0, 'not_modified': 0, 'ranges': 0, 'not_found': 0,
+                      'encodings': {encoding: 0 for encoding, _ in ENCODINGS}}
+
+    def _entry(self, path, filename, st):
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self.entries.get(path)
+        if entry is None or entry.stamp != stamp:
+            hashed = HASHED_NAME.search(filename) if filename.startswith(BUILD_PREFIX) else None
+            if hashed:
+                etag = hashed.group(1)
+            else:
+                with open(path, 'rb') as f:
+                    etag = hashlib.sha256(f.read()).hexdigest()[:16]
+            variants = [(encoding, path + suffix) for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+            entry = self.entries[path] = _Entry(stamp, etag, variants)
+        return entry
+
+    def serve(self, filename):
+        """View function for /static/<path:filename>"""
+        self.stats['requests'] += 1
+        path = safe_join(self.static_dir, filename)
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None or not os.path.isfile(path):
+            self.stats['not_found'] += 1
+            abort(404)
+        entry = self._entry(path, filename, st)
+
+        send_path, etag, encoding = path, entry.etag, None
+        if entry.variants and 'Range' not in request.headers:   # Ranges are always of the plain file
+            accepted = request.accept_encodings
+            for variant_encoding, variant_path in entry.variants:
+                if accepted[variant_encoding]:
+                    send_path, etag, encoding = variant_path, f"{entry.etag}-{variant_encoding}", variant_encoding
+                    break
+
+        immutable = filename.startswith(BUILD_PREFIX)
+        # Content type from the original name; without max_age the response says no-cache (revalidate)
+        response = send_file(send_path, request.environ, conditional=True, etag=etag,
+                             mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                             max_age=IMMUTABLE_MAX_AGE if immutable else None)
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.immutable = True
+        if entry.variants:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+
+        if response.status_code == 304:
+            self.stats['not_modified'] += 1
+        else:
+            if response.status_code == 206:
+                self.stats['ranges'] += 1
+            if encoding:
+                self.stats['encodings'][encoding] += 1
+            self.stats['bytes_sent'] += response.content_length or 0
+        return response
+
+    def report(self):
+        return dict(self.stats, files=len(self.entries))
+
+
+def install(app):
+    """Serve app's static folder through a StaticFiles; returns it"""
+    static_files = StaticFiles(app.static_folder)
+    app.view_functions['static'] = static_files.serve
+    return static_files
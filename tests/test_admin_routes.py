@@ -0,0 +1,41 @@
+# Admin routes are refused unless the request carries KYLANDER_ADMIN_TOKEN,
+# and refused outright when no token is configured.
+
+import pytest
+
+import app as server
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def test_logging_refused_without_configured_token(client, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', None)
+    assert client.get('/logging?level=DEBUG').status_code == 403
+    assert client.get('/logging?level=DEBUG&token=').status_code == 403
+
+
+def test_logging_requires_token(client, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secret')
+    assert client.get('/logging').status_code == 403
+    assert client.get('/logging?token=wrong').status_code == 403
+    assert client.get('/logging?token=secret').status_code == 200
+
+
+def test_trace_refused_without_configured_token(client, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', None)
+    monkeypatch.setattr(server.tracing.TRACER, 'enabled', False)
+    assert client.get('/trace?enable=1').status_code == 403
+    assert not server.tracing.TRACER.enabled
+    assert client.get('/trace').status_code == 403   # Nor the ring itself
+
+
+def test_trace_requires_token(client, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(server.tracing.TRACER, 'enabled', False)
+    assert client.get('/trace?enable=1&token=wrong').status_code == 403
+    assert not server.tracing.TRACER.enabled
+    assert client.get('/trace?enable=1&token=secret').status_code == 200
+    assert server.tracing.TRACER.enabled
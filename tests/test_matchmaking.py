@@ -0,0 +1,62 @@
+# Matchmaking passes run on a background task, outside any request or app
+# context; these run one the same way, with the queue on a fake clock.
+
+import pytest
+
+import app as server
+import matchmaking
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(server, 'matchmaking_queue', matchmaking.MatchmakingQueue(ai_fallback_s=30, clock=lambda: now[0]))
+    monkeypatch.setattr(server, 'matchmaking_started', True)   # The test runs the passes itself
+    return now
+
+
+def queue_player(rating):
+    client = server.socketio.test_client(server.app, query_string=f'match=1&rating={rating}')
+    client.get_received()
+    return client, server.socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+
+
+def received(client):
+    return [message['name'] for message in client.get_received()]
+
+
+def test_pair_matched_after_widening_is_seated(clock):
+    (client1, sid1), (client2, sid2) = queue_player(1000), queue_player(1250)   # Two bands apart: no pair yet
+    assert sid1 in server.matchmaking_queue and sid2 in server.matchmaking_queue
+    clock[0] = matchmaking.WIDEN_EVERY_S
+    server.match_waiting_players()
+    room = server.room_manager.room_for_sid(sid1)
+    assert room is not None and room is server.room_manager.room_for_sid(sid2)
+    assert room['game_mode'] == 'TWO' and set(room['players']) == {sid1, sid2}
+    assert sid1 in server.socketio.server.manager.rooms['/'][room['id']]
+    assert 'assign_player_id' in received(client1) and 'assign_player_id' in received(client2)
+    client1.disconnect(); client2.disconnect()
+
+
+def test_ai_fallback_is_seated(clock):
+    client, sid = queue_player(1000)
+    clock[0] = 30
+    server.match_waiting_players()
+    room = server.room_manager.room_for_sid(sid)
+    assert room is not None and room['ai_opponent_active'] and room['game_mode'] == 'ONE'
+    assert 'assign_player_id' in received(client)
+    client.disconnect()
+
+
+def test_failed_seating_leaves_no_room(clock, monkeypatch):
+    client, sid = queue_player(1000)
+    rooms = len(server.room_manager)
+
+    def fail_to_seat(room, player_sid, player_id_str):
+        raise RuntimeError('seat failed')
+    monkeypatch.setattr(server, 'seat_player', fail_to_seat)
+    clock[0] = 30
+    server.match_waiting_players()
+    assert len(server.room_manager) == rooms and server.room_manager.room_for_sid(sid) is None
+    assert {'status': 'failed'} in [message['args'][0] for message in client.queue if message['name'] == 'matchmaking']
+    assert not client.is_connected()   # Disconnected, so it reconnects and queues again
@@ -0,0 +1,171 @@
+# Kylander: The Reckoning - Tick Tracing
+# Spans around the phases of a tick (timers, input, physics, AI, combat,
+# broadcast) and around the socket handlers, recorded into a fixed-size ring
+# and exported as Chrome trace-event JSON, which Perfetto (ui.perfetto.dev)
+# and chrome://tracing open as a timeline. The phases of a tick run back to
+# back, so they are timed as laps: a tick (or batched pass) starts with
+# `laps = TRACER.enabled and TRACER.laps()`, which is False while tracing is
+# off, and each phase ends with `if laps: laps.lap(name)`. Untraced, that is
+# one attribute read per tick and a test of a local per phase. Only the tick
+# itself is a span() context manager.
+# Off is the default. Turned on (KYLANDER_TRACE=1, or /trace?enable=1 with
+# the admin token at runtime) every span is a tuple in the ring, and a tick
+# over its budget snapshots the last second of spans as a capture, at most
+# one capture per AUTO_CAPTURE_INTERVAL_S so a struggling server isn't made
+# worse by dumping traces every frame.
+
+import collections
+import functools
+import json
+import time
+
+RING_SPANS = 65536               # Spans kept (about two minutes of ticks with every phase traced)
+CAPTURE_WINDOW_S = 1.0           # Spans before a slow tick's end that a capture keeps
+AUTO_CAPTURE_INTERVAL_S = 30.0   # Least time between automatic captures
+MAX_CAPTURES = 8                 # Captures kept, newest first out when full
+
+# Timeline rows: category -> (tid, name)
+TRACKS = {'tick': (1, 'game loop'), 'socket': (2, 'socket handlers')}
+PID = 1
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start_ns')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer; self.name = name; self.cat = cat; self.args = args
+
+    def __enter__(self):
+        self.start_ns = self.tracer.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.cat, self.start_ns, self.tracer.clock(), self.args)
+        return False
+
+
+class Laps:
+    """Back-to-back spans: each lap(name) records the time since the previous lap, or since the Laps began"""
+    __slots__ = ('tracer', 'cat', 'last_ns')
+
+    def __init__(self, tracer, cat):
+        self.tracer = tracer; self.cat = cat; self.last_ns = tracer.clock()
+
+    def lap(self, name, **args):
+        now = self.tracer.clock()
+        self.tracer.record(name, self.cat, self.last_ns, now, args)
+        self.last_ns = now
+
+
+class Tracer:
+    """Ring of (name, category, start ns, end ns, args) spans; see the module comment"""
+
+    def __init__(self, capacity=RING_SPANS, clock=time.perf_counter_ns, wall_clock=time.monotonic):
+        self.capacity = capacity
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.enabled = False
+        self.spans = [None] * capacity
+        self.recorded = 0   # Spans ever recorded; the next goes at recorded % capacity
+        self.captures = collections.deque(maxlen=MAX_CAPTURES)
+        self.last_capture_at = None
+        self.captures_skipped = 0
+
+    def span(self, name, cat='tick', **args):
+        """Context manager timing its block as one span (NULL_SPAN while tracing is off)"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def laps(self, cat='tick'):
+        """Laps starting now, or None while tracing is off"""
+        return Laps(self, cat) if self.enabled else None
+
+    def record(self, name, cat, start_ns, end_ns, args=None):
+        self.spans[self.recorded % self.capacity] = (name, cat, start_ns, end_ns, args)
+        self.recorded += 1
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+
+    def clear(self):
+        self.spans = [None] * self.capacity; self.recorded = 0
+
+    def recent(self, window_s=None):
+        """Recorded spans oldest first; only those ending within the last window_s when given"""
+        if self.recorded <= self.capacity:
+            spans = self.spans[:self.recorded]
+        else:
+            split = self.recorded % self.capacity
+            spans = self.spans[split:] + self.spans[:split]
+        if window_s is not None:
+            since = self.clock() - int(window_s * 1e9)
+            spans = [span for span in spans if span[3] >= since]
+        return spans
+
+    def auto_capture(self, reason, **detail):
+        """Keep the last CAPTURE_WINDOW_S of spans, unless a capture was taken too recently; the capture or None"""
+        if not self.enabled:
+            return None
+        now = self.wall_clock()
+        if self.last_capture_at is not None and now - self.last_capture_at < AUTO_CAPTURE_INTERVAL_S:
+            self.captures_skipped += 1
+            return None
+        self.last_capture_at = now
+        capture = {'reason': reason, 'time': time.time(), 'detail': detail, 'spans': self.recent(CAPTURE_WINDOW_S)}
+        self.captures.appendleft(capture)
+        return capture
+
+    def stats(self):
+        return {'enabled': self.enabled, 'recorded': self.recorded, 'held': min(self.recorded, self.capacity),
+                'captures_skipped': self.captures_skipped,
+                'captures': [{'reason': capture['reason'], 'time': capture['time'], 'spans': len(capture['spans']),
+                              **capture['detail']} for capture in self.captures]}
+
+
+def chrome_trace(spans, metadata=None):
+    """Chrome trace-event JSON text for spans (complete 'X' events, microsecond timestamps)"""
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': PID, 'args': {'name': 'kylander'}}]
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': PID, 'tid': tid, 'args': {'name': track}}
+               for tid, track in TRACKS.values()]
+    for name, cat, start_ns, end_ns, args in spans:
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000,
+                 'pid': PID, 'tid': TRACKS.get(cat, TRACKS['tick'])[0]}
+        if args:
+            event['args'] = args
+        events.append(event)
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata or {}},
+                      separators=(',', ':'), default=str)
+
+
+def traced(name, cat='socket', tracer=None):
+    """Decorator: record each call as a span"""
+    tracer = tracer or TRACER
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# The process's tracer; the game modules' spans go here
+TRACER = Tracer()
+span = TRACER.span
@@ -0,0 +1,134 @@
+# Kylander: The Reckoning - Binary Wire Protocol
+# Optional compact encoding for the per-tick room update and for player input.
+# The fields that change every frame are packed into fixed little-endian structs
+# and strings become small enum ids; everything else still travels as a JSON
+# snapshot delta appended to the same message. static/js/game.js mirrors every
+# table and layout here, so bump PROTOCOL_VERSION whenever one changes.
+
+import json
+import struct
+
+PROTOCOL_VERSION = 2
+WIRE_PARAM_BINARY = f"bin{PROTOCOL_VERSION}"  # Clients opt in with ?wire=bin2 on the socket URL
+
+MSG_ROOM_STATE = 1
+MSG_PLAYER_ACTIONS = 2
+
+# --- Enum tables (index = wire id; append only within a protocol version) ---
+SCREENS = ['TITLE', 'MODE_SELECT', 'CHARACTER_SELECT_P1', 'CHARACTER_SELECT_P2', 'CONTROLS',
+           'PLAYING', 'SPECIAL', 'SPECIAL_END', 'VICTORY', 'CHURCH_INTRO', 'CHURCH_VICTORY',
+           'CHURCH_VICTORY_IMMEDIATE', 'FINAL', 'GAME_OVER', 'SLIDESHOW', 'SLIDESHOW_TO_TITLE']
+ANIMATIONS = ['idle', 'walk', 'attack', 'jump_attack', 'jump', 'duck']
+SFX_EVENTS = [None, 'sword_whoosh', 'sword_clash', 'sword_swing', 'swordeffects']   # Audio sprite ids
+BACKGROUND_KEYS = ['paris', 'church', 'victory', 'slideshow', 'church_victory']
+UNKNOWN_ID = 255
+
+SCREEN_IDS = {name: i for i, name in enumerate(SCREENS)}
+ANIMATION_IDS = {name: i for i, name in enumerate(ANIMATIONS)}
+SFX_EVENT_IDS = {name: i for i, name in enumerate(SFX_EVENTS)}
+BACKGROUND_KEY_IDS = {name: i for i, name in enumerate(BACKGROUND_KEYS)}
+
+ROOM_FLAG_KEYS = ['quickening_effect_active', 'dark_quickening_effect_active', 'special_level_active',
+                  'slideshow_music_started', 'church_victory_sound_triggered', 'final_sound_played',
+                  'swordeffects_playing', 'ai_opponent_active', 'p1_selection_complete',
+                  'p2_selection_complete', 'p1_waiting_for_p2']
+PLAYER_FLAG_KEYS = ['is_attacking', 'is_ducking', 'is_jumping', 'has_hit_this_attack',
+                    'is_ready_next_round', 'miss_swing']
+
+# Keys carried by the structs below; the JSON snapshot for binary clients leaves them out
+HOT_ROOM_KEYS = frozenset(['frame', 'current_screen', 'current_background_key', 'current_background_index',
+                           'sfx_event_for_client', 'clash_flash_timer', 'state_timer_frames',
+                           'match_score_p1', 'match_score_p2', 'church_victory_bg_index',
+                           'victory_sfx_to_play_index'] + ROOM_FLAG_KEYS)
+HOT_PLAYER_KEYS = frozenset(['x', 'y', 'vertical_velocity', 'health', 'facing', 'current_animation',
+                             'attack_timer', 'cooldown_timer', 'knockback_timer'] + PLAYER_FLAG_KEYS)
+
+# --- Layouts ---
+# header: version, msg type, room frame, length of the JSON tail (0 = none)
+HEADER = struct.Struct('<BBIH')
+# room: screen, bg key, bg index, sfx, clash flash, screen timer, score p1, score p2,
+#       church victory bg, victory sfx index (-1 = none), flags, player count
+ROOM = struct.Struct('<BBBBBHBBBbHB')
+# player: slot (1/2), x, y, vertical velocity, health, facing, animation,
+#         attack timer, cooldown timer, knockback timer, flags
+PLAYER = struct.Struct('<BhhbbbBBBBB')
+# input: version, msg type, client frame stamp, room frame the client last saw, action bits
+ACTIONS = struct.Struct('<BBIIB')
+
+ACTION_LEFT = 1; ACTION_RIGHT = 2; ACTION_JUMP = 4; ACTION_ATTACK = 8
+ACTION_DUCK = 16; ACTION_DUCK_ACTIVE = 32
+
+
+def negotiate(wire_param):
+    """Protocol version for a client's ?wire= value, or None for the JSON protocol"""
+    return PROTOCOL_VERSION if wire_param == WIRE_PARAM_BINARY else None
+
+
+def _clamp(value, low, high):
+    value = int(round(value))
+    return low if value < low else high if value > high else value
+
+
+def _flags(state, keys):
+    bits = 0
+    for i, key in enumerate(keys):
+        if state.get(key): bits |= 1 << i
+    return bits
+
+
+def encode_hot_state(room_state, sfx_event=None):
+    """Pack the per-frame room and player fields (everything but the header and JSON tail).
+
+    sfx_event, when given, replaces the room's sound of this frame (for updates that cover several frames)."""
+    victory_sfx = room_state.get('victory_sfx_to_play_index')
+    players = [p for p in room_state['players'].values() if p.get('id') in ('player1', 'player2')]
+    parts = [ROOM.pack(
+        SCREEN_IDS.get(room_state.get('current_screen'), UNKNOWN_ID),
+        BACKGROUND_KEY_IDS.get(room_state.get('current_background_key'), UNKNOWN_ID),
+        _clamp(room_state.get('current_background_index') or 0, 0, 255),
+        SFX_EVENT_IDS.get(sfx_event or room_state.get('sfx_event_for_client'), UNKNOWN_ID),
+        _clamp(room_state.get('clash_flash_timer', 0), 0, 255),
+        _clamp(room_state.get('state_timer_frames', 0), 0, 65535),
+        _clamp(room_state.get('match_score_p1', 0), 0, 255),
+        _clamp(room_state.get('match_score_p2', 0), 0, 255),
+        _clamp(room_state.get('church_victory_bg_index', 0), 0, 255),
+        -1 if victory_sfx is None else _clamp(victory_sfx, -1, 127),
+        _flags(room_state, ROOM_FLAG_KEYS),
+        len(players))]
+    for p_state in players:
+        parts.append(PLAYER.pack(
+            1 if p_state['id'] == 'player1' else 2,
+            _clamp(p_state['x'], -32768, 32767), _clamp(p_state['y'], -32768, 32767),
+            _clamp(p_state['vertical_velocity'], -128, 127),
+            _clamp(p_state['health'], -128, 127),
+            _clamp(p_state['facing'], -1, 1),
+            ANIMATION_IDS.get(p_state.get('current_animation'), UNKNOWN_ID),
+            _clamp(p_state['attack_timer'], 0, 255),
+            _clamp(p_state['cooldown_timer'], 0, 255),
+            _clamp(p_state.get('knockback_timer', 0), 0, 255),
+            _flags(p_state, PLAYER_FLAG_KEYS)))
+    return b''.join(parts)
+
+
+def encode_room_message(frame, hot_bytes, cold_payload=None):
+    """Full binary room update: header + packed hot state + optional JSON snapshot delta"""
+    tail = json.dumps(cold_payload, separators=(',', ':')).encode('utf-8') if cold_payload else b''
+    if len(tail) > 0xFFFF:
+        raise ValueError(f"cold snapshot too large for binary message ({len(tail)} bytes)")
+    return HEADER.pack(PROTOCOL_VERSION, MSG_ROOM_STATE, frame & 0xFFFFFFFF, len(tail)) + hot_bytes + tail
+
+
+def decode_player_actions(data):
+    """Binary player_actions -> {'frame': stamp, 'room_frame': seen, 'actions': [...]} or None if not understood"""
+    if len(data) < ACTIONS.size:
+        return None
+    version, msg_type, frame, room_frame, bits = ACTIONS.unpack_from(data)
+    if version != PROTOCOL_VERSION or msg_type != MSG_PLAYER_ACTIONS:
+        return None
+    actions = []
+    if bits & ACTION_LEFT: actions.append({'type': 'move', 'direction': 'left'})
+    if bits & ACTION_RIGHT: actions.append({'type': 'move', 'direction': 'right'})
+    if bits & ACTION_JUMP: actions.append({'type': 'jump'})
+    if bits & ACTION_DUCK: actions.append({'type': 'duck', 'active': bool(bits & ACTION_DUCK_ACTIVE)})
+    if bits & ACTION_ATTACK: actions.append({'type': 'attack'})
+    return {'frame': frame, 'room_frame': room_frame, 'actions': actions}